@@ -0,0 +1,464 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import os
+import os.path
+import shutil
+import hashlib
+import collections
+import numpy as np
+
+
+# Local modules
+
+import enumcachemodule
+import foodindexmodule
+import mealtablemodule
+import rangeindexmodule
+import usermodule
+
+
+#############
+# Constants #
+#############
+
+# Width (in kcal) of the buckets in which the meal targets of the users are grouped by CohortPlanner: the meals of
+# a user are computed for the multiple of KCAL_BUCKET closest to their exact target (so their energy differs from it
+# by at most KCAL_BUCKET/2 kcal); planUsers reports both targets ('meal_kcal' and 'planned_kcal')
+KCAL_BUCKET = 10.0
+
+# Number of users whose meal ratings are computed together by CohortPlanner (bounds its (N,U) rating matrices)
+RATING_BLOCK_SIZE = 64
+
+
+#######################
+# Class CohortRatings #
+#######################
+
+class CohortRatings(object):
+
+  def __init__(self, Table, FoodRatingsList, Dtype=np.float64, CountMatrix=None):
+    """
+    Parameters passed in data mode: Table, FoodRatingsList, Dtype, CountMatrix
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - Table is a MealTable shared by all the users of the cohort
+      - FoodRatingsList is a list of U dictionaries associating a rating between 0 and 5 to each food used by
+        the meals of Table (typically the User.ratings of the users of the cohort)
+      - if specified, CountMatrix is foodCountMatrix(Table.food_indices, len(Table.foods)), shared by the
+        CohortRatings of several blocks of users of the same table
+    Postconditions:
+      - self.rating_matrix is the (F,U) matrix of the food ratings, self.count_matrix the (N,F) matrix of the
+        number of components of each meal made of each food (the one-hot encoding of Table.food_indices)
+      - self.ratings is the (N,U) matrix of the ratings of every meal for every user, computed with a single
+        matrix product instead of U calls to computeAllRatings (memory: N x U x the size of Dtype)
+    Result: self
+    """
+    self.table = Table
+    self.nb_users = len(FoodRatingsList)
+    self.rating_matrix = buildRatingMatrix(Table.foods, FoodRatingsList)
+    self.count_matrix = foodCountMatrix(Table.food_indices, len(Table.foods)) if CountMatrix is None else CountMatrix
+    self.ratings = computeCohortRatings(self.count_matrix, self.rating_matrix, Dtype)
+
+
+  def __len__(self):
+    return self.nb_users
+
+
+  def getVetoBitmaps(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: a (U,W) uint64 array: row u is the packed bitmap (see foodindexmodule) of the meals of the table
+    that do not contain a food vetoed (0-rated) by user u, as MealTable.filterBasedOnUserVeto
+    """
+    vetoed_foods = (np.nan_to_num(self.rating_matrix, nan=1.0) <= 0).astype(np.float32)
+    return packRowBitmaps(self.count_matrix @ vetoed_foods == 0)
+
+
+  def getSatisfactionBitmaps(self, MinimalMealRatings):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - MinimalMealRatings is a float or a list of U floats (one per user)
+    Postconditions: [none]
+    Result: a (U,W) uint64 array: row u is the packed bitmap of the meals of the table whose rating for
+    user u is larger or equal to its minimal rating, as MealTable.filterBasedOnMinimalMealSatisfaction
+    """
+    return packRowBitmaps(self.ratings >= np.asarray(MinimalMealRatings, dtype=np.float64))
+
+
+  def getUserView(self, User, Bitmaps):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - User is the index of a user of the cohort, Bitmaps a (U,W) array returned by the methods above (or
+        their bitwise and, to combine the filters)
+    Postconditions: [none]
+    Result: a MealView of the meals of the bitmap of User
+    """
+    return mealtablemodule.MealView(self.table, foodindexmodule.bitsetToRows(Bitmaps[User], len(self.table)))
+
+
+  def getUserRatings(self, User):
+    return self.ratings[:, User]
+
+
+
+#######################
+# Class CohortPlanner #
+#######################
+
+class CohortPlanner(object):
+
+  def __init__(self, NutrDB, EnvDB, KcalBucket=KCAL_BUCKET, Directory=None, Dtype=np.float64):
+    """
+    Parameters passed in data mode: NutrDB, EnvDB, KcalBucket, Directory, Dtype
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - NutrDB is a complete and consistent NutritionDatabase, EnvDB an EnvironmentalDatabase consistent with it
+      - KcalBucket is a positive float: the users whose meal targets round to the same multiple of KcalBucket
+        (and who share the same extra quantities) share the same meals
+      - if specified, Directory is the directory of the disk tier of the enumeration cache
+    Postconditions:
+      - the shared tables are obtained from an EnumerationCache using a KcalTargetIndex, so that each distinct
+        ExtraQtyDict is enumerated once and each of its targets is derived from the index
+    Result: self
+    """
+    self.nutrDB = NutrDB
+    self.envDB = EnvDB
+    self.cache = enumcachemodule.EnumerationCache(NutrDB, EnvDB, MaxEntries=1, Directory=Directory, Rounding=KcalBucket, UseKcalIndex=True, Dtype=Dtype)
+
+
+  def groupUsers(self, Users, MealKcalTargets):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Users is a list of instances of class User, MealKcalTargets the list or array of their meal targets
+        (NaN for the users whose target could not be computed)
+    Postconditions: [none]
+    Result: an OrderedDict associating the list of the positions of its users in Users to each key of the
+    enumeration cache (rounded target, extra quantities, databases), sorted by key; the users whose target
+    is NaN are not grouped
+    """
+    groups = collections.defaultdict(list)
+    for (i, user) in enumerate(Users):
+      if not np.isnan(MealKcalTargets[i]):
+        groups[self.cache.makeKey(MealKcalTargets[i], user.extra_qty_dict)].append(i)
+    return collections.OrderedDict(sorted(groups.items(), key=lambda item: (sorted(item[0][1]), item[0][0])))
+
+
+  def planGroup(self, Users, Positions, MealKcalTarget, MinimalMealRating=None):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Positions is a list of positions in Users of users sharing the same ExtraQtyDict and rounded target,
+        MealKcalTarget the target of one of them
+      - if specified, MinimalMealRating is the minimal rating of the meals of the users who rated the foods
+    Postconditions:
+      - the shared table is obtained once; the users are then grouped by filters (environmental thresholds and
+        ratings of the foods used by its meals), and the meals of each distinct filter are computed once: the
+        thresholds with an ImpactRangeIndex built once for the group, the vetoes and minimal ratings with the
+        bitmaps of CohortRatings of at most RATING_BLOCK_SIZE distinct ratings at a time (the users with an empty
+        User.ratings are not filtered on ratings, as in main.py)
+      - the users with the same filters share the same MealView, so that the cost depends on the number of
+        distinct filters and not on the number of users
+    Result: a dictionary associating, to each position of Positions, either a MealView of the meals of this
+    user, or a string describing why they could not be computed
+    """
+    table = self.cache.getMealTable(MealKcalTarget, Users[Positions[0]].extra_qty_dict)
+    range_index = rangeindexmodule.ImpactRangeIndex(table)
+    used_foods = [table.foods[f] for f in np.flatnonzero(np.bincount(table.food_indices.ravel(), minlength=len(table.foods)))]
+    results = {}
+    filters = collections.OrderedDict() # filter key -> positions of its users
+    for i in Positions:
+      ratings = Users[i].ratings
+      if len(ratings) > 0 and any(food not in ratings for food in used_foods):
+        results[i] = 'Incomplete food ratings.'
+        continue
+      thresholds = Users[i].env_thresholds
+      key = (None if thresholds is None else tuple(thresholds.toList()),
+             None if len(ratings) == 0 else tuple(ratings[food] for food in used_foods))
+      filters.setdefault(key, []).append(i)
+    allowed_rows = {} # ratings key -> rows allowed by the vetoes and minimal rating
+    rating_keys = list(collections.OrderedDict.fromkeys(key[1] for key in filters if key[1] is not None))
+    if len(rating_keys) > 0:
+      count_matrix = foodCountMatrix(table.food_indices, len(table.foods))
+      for start in range(0, len(rating_keys), RATING_BLOCK_SIZE):
+        block = rating_keys[start:start+RATING_BLOCK_SIZE]
+        cohort = CohortRatings(table, [dict(zip(used_foods, key)) for key in block], CountMatrix=count_matrix)
+        bitmaps = cohort.getVetoBitmaps()
+        if MinimalMealRating is not None:
+          bitmaps &= cohort.getSatisfactionBitmaps(MinimalMealRating)
+        for (u, key) in enumerate(block):
+          allowed_rows[key] = foodindexmodule.bitsetToRows(bitmaps[u], len(table))
+        cohort = bitmaps = None
+    for ((thresholds, rating_key), positions) in filters.items():
+      if thresholds is not None:
+        rows = range_index.query(Users[positions[0]].env_thresholds)
+      else:
+        rows = np.arange(len(table))
+      if rating_key is not None:
+        rows = np.intersect1d(rows, allowed_rows[rating_key], assume_unique=True)
+      view = mealtablemodule.MealView(table, rows)
+      for i in positions:
+        results[i] = view
+    return results
+
+
+  def planUsers(self, Users, OutputDirectory=None, UserNames=None, MinimalMealRating=None):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Users is a list of instances of class User, whose physiological parameters, extra quantities and
+        (optionally) ratings and environmental thresholds are set
+      - if specified, OutputDirectory is a directory (created if needed) and UserNames a list of distinct
+        strings, one per user (default: 'user0', 'user1', ...)
+    Postconditions:
+      - the energy requirements of all the users are computed in one call of computeCohortEnergyRequirements,
+        the users are grouped with groupUsers and each group is planned with planGroup, so that the number of
+        enumerations depends on the number of groups and not on the number of users
+      - if OutputDirectory is specified, the meals of each user are written in the file <name>.txt of this
+        directory, in the format of MealTable.saveToFile (the file of a user whose meals are the same as those
+        of a previous user of the group is copied instead of being written again)
+    Result: a list containing, for each user, a dictionary with the keys 'name', 'daily_energy', 'meal_kcal' (the
+    exact target of the user) and 'planned_kcal' (the rounded target for which the meals are computed, NaN if
+    'meal_kcal' is NaN), and either 'nb_meals' (and 'output_file' if OutputDirectory is specified) or 'error'
+    """
+    if UserNames is None:
+      UserNames = ['user' + str(i) for i in range(len(Users))]
+    (bmr, daily_energy, breakfast_kcal, main_meal_kcal, errors) = usermodule.computeCohortEnergyRequirements(
+      [user.gender for user in Users], [user.age for user in Users], [user.body_weight for user in Users],
+      [user.height for user in Users], [user.physical_activity_level for user in Users])
+    results = [{'name': UserNames[i], 'daily_energy': float(daily_energy[i]), 'meal_kcal': float(main_meal_kcal[i]),
+                'planned_kcal': float('nan') if np.isnan(main_meal_kcal[i]) else self.cache.roundTarget(main_meal_kcal[i])}
+               for i in range(len(Users))]
+    for i in np.flatnonzero(errors['any']).tolist():
+      fields = [field for field in ['gender', 'age', 'body_weight', 'height', 'physical_activity_level'] if errors[field][i]]
+      results[i]['error'] = 'Invalid ' + ', '.join(fields) + '.'
+    if OutputDirectory is not None:
+      os.makedirs(OutputDirectory, exist_ok=True)
+    for (key, positions) in self.groupUsers(Users, main_meal_kcal).items():
+      views = self.planGroup(Users, positions, main_meal_kcal[positions[0]], MinimalMealRating)
+      written_files = {} # users of a group with the same filters have the same meals: their file is written once
+      for i in positions:
+        if isinstance(views[i], str):
+          results[i]['error'] = views[i]
+          continue
+        results[i]['nb_meals'] = len(views[i])
+        if OutputDirectory is not None:
+          results[i]['output_file'] = os.path.join(OutputDirectory, UserNames[i] + '.txt')
+          digest = hashlib.sha1(views[i].rows.tobytes()).digest()
+          if digest in written_files:
+            shutil.copyfile(written_files[digest], results[i]['output_file'])
+          else:
+            views[i].saveToFile(results[i]['output_file'])
+            written_files[digest] = results[i]['output_file']
+    return results
+
+
+
+########################
+# Function definitions #
+########################
+
+def buildRatingMatrix(Foods, FoodRatingsList):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Foods is a list of F strings, FoodRatingsList a list of U dictionaries associating a rating to foods
+  Postconditions: [none]
+  Result: the (F,U) float matrix whose column u is foodRatingVector(Foods, FoodRatingsList[u])
+  """
+  matrix = np.full((len(Foods), len(FoodRatingsList)), np.nan)
+  for (u, food_ratings) in enumerate(FoodRatingsList):
+    matrix[:, u] = mealtablemodule.foodRatingVector(Foods, food_ratings)
+  return matrix
+
+
+def foodCountMatrix(FoodIndices, NbFoods):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - FoodIndices is an (N,6) int array of indices lower than NbFoods
+  Postconditions: [none]
+  Result: the (N,NbFoods) float32 matrix containing, for each meal, the number of its components made of each food
+  """
+  nb_meals = len(FoodIndices)
+  cells = (np.arange(nb_meals)[:, None]*NbFoods + FoodIndices).ravel()
+  return np.bincount(cells, minlength=nb_meals*NbFoods).reshape(nb_meals, NbFoods).astype(np.float32)
+
+
+def computeCohortRatings(CountMatrix, RatingMatrix, Dtype=np.float64):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - CountMatrix is an (N,F) matrix returned by foodCountMatrix, RatingMatrix an (F,U) matrix returned by
+      buildRatingMatrix
+  Postconditions:
+    - a KeyError is raised if a meal contains a food without rating for some user, as in computeRatingArray
+  Result: the (N,U) matrix CountMatrix x RatingMatrix of the ratings of every meal for every user
+  """
+  missing = np.isnan(RatingMatrix)
+  if np.any(missing) and np.any(CountMatrix @ missing.astype(np.float32)):
+    raise KeyError('Some foods of the meals have no rating.')
+  return (CountMatrix.astype(Dtype, copy=False) @ np.where(missing, 0, RatingMatrix).astype(Dtype)).astype(Dtype, copy=False)
+
+
+def packRowBitmaps(Mask):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Mask is an (N,U) boolean array
+  Postconditions: [none]
+  Result: the (U,W) uint64 array whose row u is the packed bitset of column u of Mask, in the layout of
+  foodindexmodule (W = ceil(N/64))
+  """
+  (nb_rows, nb_users) = Mask.shape
+  padded = np.zeros((nb_users, -(-nb_rows // 64)*64), dtype=bool)
+  padded[:, :nb_rows] = Mask.T
+  return np.packbits(padded, axis=1, bitorder='little').view(np.uint64)
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import time
+  import nutritionDBmodule
+
+  nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+  extra_qty_dict = {food: 0.010 for food in nutrDB.extras}
+  meal_table = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict, AsTable=True)
+  generator = np.random.default_rng(0)
+  all_foods = nutrDB.getAllFoods()
+  cohort_ratings = [dict(zip(all_foods, generator.choice(6, len(all_foods), p=[0.05, 0.1, 0.2, 0.3, 0.2, 0.15]).tolist())) for u in range(200)]
+  start = time.time()
+  cohort = CohortRatings(meal_table, cohort_ratings)
+  duration_batch = time.time() - start
+
+  print('Unit test of CohortRatings:')
+  all_same = True
+  start = time.time()
+  for u in [0, 17, 199]:
+    meal_table.computeAllRatings(cohort_ratings[u])
+    if not np.array_equal(cohort.getUserRatings(u), meal_table.ratings):
+      all_same = False
+  duration_loop = (time.time() - start)/3*len(cohort)
+  print(all_same)
+  try:
+    CohortRatings(meal_table, [{}])
+    print(False)
+  except KeyError:
+    print(True)
+  print('')
+
+  print('Unit test of CohortRatings.getVetoBitmaps and CohortRatings.getSatisfactionBitmaps:')
+  vetoes = cohort.getVetoBitmaps()
+  satisfactions = cohort.getSatisfactionBitmaps(np.linspace(10, 20, len(cohort)))
+  all_same = True
+  for u in [0, 17, 199]:
+    if not np.array_equal(cohort.getUserView(u, vetoes).rows, meal_table.filterBasedOnUserVeto(cohort_ratings[u]).rows):
+      all_same = False
+    expected = meal_table.filterBasedOnUserVeto(cohort_ratings[u]).filterBasedOnMinimalMealSatisfaction(cohort_ratings[u], np.linspace(10, 20, len(cohort))[u])
+    if not np.array_equal(cohort.getUserView(u, vetoes & satisfactions).rows, expected.rows):
+      all_same = False
+  print(all_same)
+  print(vetoes.shape == (len(cohort), -(-len(meal_table) // 64)))
+  print('')
+
+  print('Performance for {0} users: {1:.2f} s in batch, about {2:.2f} s with computeAllRatings'.format(len(cohort), duration_batch, duration_loop))
+  print('')
+
+  print('Unit test of CohortPlanner.planUsers:')
+  import tempfile
+  import envDBmodule
+  envDB = envDBmodule.EnvironmentalDatabase('poore2018/DataS2.xlsx')
+  users = []
+  for u in range(60):
+    user = usermodule.User('F' if u % 2 == 0 else 'M', 60 + generator.integers(0, 4), 165, 40, 'light')
+    user.extra_qty_dict = dict(extra_qty_dict) if u % 3 else {food: 0.015 for food in nutrDB.extras}
+    if u % 4 == 0:
+      user.ratings = cohort_ratings[u % 8] # users 0, 8, 16... (and 4, 12, 20...) share their ratings
+    if u % 5 == 0:
+      user.env_thresholds = envDBmodule.EnvironmentalImpact([2.0, 1.5, 15.0, 10.0, 3000])
+    users.append(user)
+  users.append(usermodule.User('F', 60, 165, 12, 'light')) # too young
+  users[-1].extra_qty_dict = extra_qty_dict
+  planner = CohortPlanner(nutrDB, envDB)
+  with tempfile.TemporaryDirectory() as directory:
+    start = time.time()
+    results = planner.planUsers(users, directory, MinimalMealRating=15)
+    duration = time.time() - start
+    nb_groups = len(planner.groupUsers(users, [result['meal_kcal'] for result in results]))
+    print(planner.cache.getStatistics()['misses'] == nb_groups and nb_groups < len(users)/4)
+    print(results[-1].get('error') == 'Invalid age.' and 'nb_meals' not in results[-1] and np.isnan(results[-1]['planned_kcal']))
+    all_same = True
+    for u in [0, 5, 7, 20, 40]:
+      if abs(results[u]['planned_kcal'] - results[u]['meal_kcal']) > KCAL_BUCKET/2 or results[u]['planned_kcal'] % KCAL_BUCKET != 0:
+        all_same = False
+      table = nutrDB.enumerateAllPossibleMealsWithQuantities(results[u]['planned_kcal'], users[u].extra_qty_dict, AsTable=True)
+      table.computeAllEnvironmentalImpacts(envDB)
+      view = table.asView()
+      if len(users[u].ratings) > 0:
+        view = view.filterBasedOnUserVeto(users[u].ratings).filterBasedOnMinimalMealSatisfaction(users[u].ratings, 15)
+      if users[u].env_thresholds is not None:
+        view = view.filterBasedOnEnvironmentalImpact(users[u].env_thresholds)
+      positions = [positions for positions in planner.groupUsers(users, [result['meal_kcal'] for result in results]).values() if u in positions][0]
+      views = planner.planGroup(users, positions, results[u]['meal_kcal'], 15)
+      if not np.array_equal(views[u].rows, view.rows) or not np.array_equal(views[u].table.food_indices, table.food_indices):
+        all_same = False
+      with open(results[u]['output_file']) as f:
+        if results[u]['nb_meals'] != len(view) or len(f.readlines()) != len(view):
+          all_same = False
+    print(all_same)
+  print('({0} users in {1} groups planned in {2:.2f} s)'.format(len(users), nb_groups, duration))
+  print('')
+
+  print('Unit test of the sharing of filters by CohortPlanner.planGroup:')
+  group_users = [usermodule.User('F', 30, 165, 60, 'light') for u in range(3*RATING_BLOCK_SIZE)]
+  for (u, user) in enumerate(group_users):
+    user.extra_qty_dict = extra_qty_dict
+    user.ratings = cohort_ratings[u % (RATING_BLOCK_SIZE + 10)] # more distinct ratings than a block
+    if u % 2 == 0:
+      user.env_thresholds = envDBmodule.EnvironmentalImpact([2.0, 1.5, 15.0, 10.0, 3000])
+  views = planner.planGroup(group_users, list(range(len(group_users))), 720, 15)
+  print(len(set(id(view) for view in views.values())) == len(set((u % (RATING_BLOCK_SIZE + 10), u % 2) for u in range(len(group_users)))))
+  table = planner.cache.getMealTable(720, extra_qty_dict)
+  all_same = True
+  for u in [0, 1, RATING_BLOCK_SIZE + 3, len(group_users) - 1]:
+    view = table.filterBasedOnUserVeto(group_users[u].ratings).filterBasedOnMinimalMealSatisfaction(group_users[u].ratings, 15)
+    if group_users[u].env_thresholds is not None:
+      view = view.filterBasedOnEnvironmentalImpact(group_users[u].env_thresholds)
+    if not np.array_equal(views[u].rows, view.rows):
+      all_same = False
+  print(all_same)
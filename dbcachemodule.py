@@ -0,0 +1,177 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import os
+import os.path
+import json
+import hashlib
+import numpy as np
+
+
+#############
+# Constants #
+#############
+
+# To be incremented whenever the way the XLSX files are parsed changes, so that old cache entries are ignored
+PARSER_VERSION = 1
+
+# Name of the cache directory created next to the source files (unless NOSHY_CACHE_DIR is set)
+CACHE_DIR_NAME = '.dbcache'
+
+
+########################
+# Function definitions #
+########################
+
+def getCacheDir(Filepath):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions: [none]
+  Postconditions: [none]
+  Result: the directory where the parsed contents of Filepath are cached: the value of the environment
+  variable NOSHY_CACHE_DIR if it is set, otherwise a directory called .dbcache next to Filepath
+  """
+  cache_dir = os.environ.get('NOSHY_CACHE_DIR', '')
+  if cache_dir == '':
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(Filepath)), CACHE_DIR_NAME)
+  return cache_dir
+
+
+def fileHash(Filepath):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Filepath is the path to an existing file
+  Postconditions: [none]
+  Result: the SHA-256 hash of the contents of the file, as a string of hexadecimal digits
+  """
+  sha = hashlib.sha256()
+  with open(Filepath, 'rb') as source_file:
+    for block in iter(lambda: source_file.read(1 << 20), b''):
+      sha.update(block)
+  return sha.hexdigest()
+
+
+def getCachePaths(Kind, Filepath, SourceHash):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Kind is a short string naming the parser (e.g. 'nutrition' or 'environment')
+  Postconditions: [none]
+  Result: a tuple (prefix, header_path, arrays_path) for the cache entry of Filepath; the key contains the
+  name of the source file, its hash and PARSER_VERSION, so that any change of one of them misses the cache
+  """
+  prefix = '{0}-{1}-'.format(Kind, os.path.basename(Filepath))
+  key = '{0}{1}-v{2}'.format(prefix, SourceHash[:24], PARSER_VERSION)
+  cache_dir = getCacheDir(Filepath)
+  return (prefix, os.path.join(cache_dir, key + '.json'), os.path.join(cache_dir, key + '.npz'))
+
+
+def loadParsedData(Kind, Filepath):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Filepath is the path to an existing file
+  Postconditions: [none]
+  Result: a tuple (header, arrays) previously stored by saveParsedData for the current contents of Filepath,
+  header being a dictionary and arrays a dictionary of numpy arrays; or None on a cache miss (no entry,
+  other source hash or parser version, unreadable entry)
+  """
+  source_hash = fileHash(Filepath)
+  (prefix, header_path, arrays_path) = getCachePaths(Kind, Filepath, source_hash)
+  if not (os.path.isfile(header_path) and os.path.isfile(arrays_path)):
+    return None
+  try:
+    with open(header_path, 'r') as header_file:
+      header = json.load(header_file)
+    if header.get('source_hash') != source_hash or header.get('parser_version') != PARSER_VERSION:
+      return None
+    with np.load(arrays_path, allow_pickle=False) as npz:
+      arrays = {name: npz[name] for name in npz.files}
+  except (OSError, ValueError, KeyError):
+    return None
+  return (header['data'], arrays)
+
+
+def saveParsedData(Kind, Filepath, Header, Arrays):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Header is a dictionary that can be encoded in JSON, Arrays a dictionary of numeric numpy arrays
+  Postconditions:
+    - the cache entry of the current contents of Filepath is written (arrays first, then the JSON header,
+      each through a temporary file renamed atomically, so that concurrent readers never see a partial entry)
+    - older entries for the same Kind and source file name are removed
+    - nothing happens (apart from a warning) if the cache directory cannot be written
+  Result: [none]
+  """
+  source_hash = fileHash(Filepath)
+  (prefix, header_path, arrays_path) = getCachePaths(Kind, Filepath, source_hash)
+  cache_dir = os.path.dirname(header_path)
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in os.listdir(cache_dir):
+      if name.startswith(prefix):
+        os.remove(os.path.join(cache_dir, name))
+    tmp_suffix = '.tmp{0}'.format(os.getpid())
+    with open(arrays_path + tmp_suffix, 'wb') as arrays_file:
+      np.savez(arrays_file, **Arrays)
+    os.replace(arrays_path + tmp_suffix, arrays_path)
+    with open(header_path + tmp_suffix, 'w') as header_file:
+      json.dump({'source_hash': source_hash, 'parser_version': PARSER_VERSION, 'data': Header}, header_file)
+    os.replace(header_path + tmp_suffix, header_path)
+  except OSError as e:
+    print('Warning: could not write the database cache in', cache_dir, '(' + str(e) + ')')
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import tempfile
+  import time
+  import nutritionDBmodule
+  import envDBmodule
+
+  os.environ['NOSHY_CACHE_DIR'] = tempfile.mkdtemp()
+
+  print('Unit test of the cache of NutritionDatabase.loadFromFile:')
+  nutr_path = 'poore2018/TableS1_augmented_with_FAO_data.xlsx'
+  parsed = nutritionDBmodule.NutritionDatabase(nutr_path, UseCache=False)
+  miss = nutritionDBmodule.NutritionDatabase(nutr_path)
+  start = time.time()
+  hit = nutritionDBmodule.NutritionDatabase(nutr_path)
+  duration = time.time() - start
+  print(loadParsedData('nutrition', nutr_path) is not None)
+  print(hit.getAllFoods() == parsed.getAllFoods() and hit.kcal_dict == parsed.kcal_dict and hit.gFat_dict == parsed.gFat_dict)
+  print('(loaded from cache in {0:.1f} ms)'.format(1000*duration))
+  print('')
+
+  print('Unit test of the cache of EnvironmentalDatabase.loadFromFile:')
+  env_path = 'poore2018/DataS2.xlsx'
+  parsed = envDBmodule.EnvironmentalDatabase(env_path, UseCache=False)
+  miss = envDBmodule.EnvironmentalDatabase(env_path)
+  hit = envDBmodule.EnvironmentalDatabase(env_path)
+  foods = [food for food in parsed.food_table.foods if isinstance(food, str)]
+  print(all(hit.getWaterUse(food) == parsed.getWaterUse(food) and hit.getLandUse(food) == parsed.getLandUse(food) for food in foods))
+  print('')
+
+  print('Unit test of the invalidation of the cache:')
+  PARSER_VERSION = PARSER_VERSION + 1 # entries written with the previous parser version must be ignored
+  print(loadParsedData('environment', env_path) is None)
@@ -0,0 +1,308 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import os
+import os.path
+import json
+import hashlib
+import collections
+import numpy as np
+
+
+# Local modules
+
+import kcalindexmodule
+import mealtablemodule
+
+
+#############
+# Constants #
+#############
+
+# To be incremented whenever the format of the files of the disk tier changes
+CACHE_VERSION = 1
+
+# Name of the directory of the disk tier created next to the source files by main.py
+CACHE_DIR_NAME = '.enumcache'
+
+# Default number of tables kept in the disk tier
+MAX_DISK_ENTRIES = 64
+
+
+##########################
+# Class EnumerationCache #
+##########################
+
+class EnumerationCache(object):
+
+  def __init__(self, NutrDB, EnvDB=None, MaxEntries=8, Directory=None, Rounding=1.0, UseKcalIndex=False, Dtype=np.float64,
+               MaxDiskEntries=MAX_DISK_ENTRIES):
+    """
+    Parameters passed in data mode: NutrDB, EnvDB, MaxEntries, Directory, Rounding, UseKcalIndex, Dtype, MaxDiskEntries
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - NutrDB is a complete and consistent NutritionDatabase
+      - if specified, EnvDB is an EnvironmentalDatabase consistent with NutrDB; the impacts of the cached meals
+        are then computed as well
+      - MaxEntries is a positive integer, the number of tables kept in memory
+      - if specified, Directory is the directory of the disk tier (created if needed), which keeps at most
+        MaxDiskEntries tables (a positive integer); the least recently used files are removed
+      - Rounding is a positive float: the kcal targets are rounded to a multiple of Rounding; if it is None, the
+        tables are computed for the exact targets
+      - if UseKcalIndex is True, the misses are computed with a KcalTargetIndex (one per distinct ExtraQtyDict)
+        instead of enumerateAllPossibleMealsWithQuantities
+    Postconditions:
+      - self is an empty cache; the hash of the contents of the databases is computed once and is part of
+        every key, so that tables computed from other versions of the databases are never returned
+    Result: self
+    """
+    self.nutrDB = NutrDB
+    self.envDB = EnvDB
+    self.max_entries = MaxEntries
+    self.directory = Directory
+    self.max_disk_entries = MaxDiskEntries
+    self.rounding = Rounding
+    self.use_kcal_index = UseKcalIndex
+    self.dtype = np.dtype(Dtype)
+    self.db_hash = NutrDB.food_table.contentHash()
+    if EnvDB is not None:
+      self.db_hash = self.db_hash + '-' + EnvDB.food_table.contentHash()
+    self.entries = collections.OrderedDict() # from the least to the most recently used
+    self.kcal_indices = {}
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+
+
+  def __len__(self):
+    return len(self.entries)
+
+
+  def roundTarget(self, MealKcalTarget):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - MealKcalTarget is a positive integer or float
+    Postconditions: [none]
+    Result: the float multiple of self.rounding closest to MealKcalTarget (MealKcalTarget itself if self.rounding
+    is None), the target for which the meals are computed
+    """
+    if self.rounding is None:
+      return float(MealKcalTarget)
+    return float(round(MealKcalTarget/self.rounding)*self.rounding)
+
+
+  def makeKey(self, MealKcalTarget, ExtraQtyDict):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - MealKcalTarget is a positive integer or float, ExtraQtyDict a dictionary of floats
+    Postconditions: [none]
+    Result: the hashable key (rounded target, frozen ExtraQtyDict, hash of the databases) of the table of these arguments
+    """
+    return (self.roundTarget(MealKcalTarget), frozenset((food, float(qty)) for (food, qty) in ExtraQtyDict.items()), self.db_hash)
+
+
+  def getMealTable(self, MealKcalTarget, ExtraQtyDict):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - MealKcalTarget is a positive integer or float
+      - ExtraQtyDict contains an entry for each food in self.nutrDB.extras
+    Postconditions:
+      - the table is looked for in memory, then in the disk tier (if any); on a miss, it is computed for the
+        rounded target and stored in both tiers
+      - the least recently used tables are evicted from memory to keep at most self.max_entries of them
+      - self.hits, self.disk_hits and self.misses are updated
+    Result: a MealTable of the valid meals (with their impacts if self.envDB is set); it is a copy of the
+    cached table, so that the caller can modify it (e.g. compute ratings)
+    """
+    key = self.makeKey(MealKcalTarget, ExtraQtyDict)
+    if key in self.entries:
+      self.hits += 1
+      self.entries.move_to_end(key)
+      return self.entries[key].copy()
+    table = self._loadFromDisk(key)
+    if table is not None:
+      self.disk_hits += 1
+    else:
+      self.misses += 1
+      table = self._compute(key[0], ExtraQtyDict)
+      self._saveToDisk(key, table)
+    self.entries[key] = table
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+    return table.copy()
+
+
+  def _compute(self, MealKcalTarget, ExtraQtyDict):
+    if self.use_kcal_index:
+      extra_key = frozenset(ExtraQtyDict.items())
+      if extra_key not in self.kcal_indices:
+        self.kcal_indices[extra_key] = kcalindexmodule.KcalTargetIndex(self.nutrDB, ExtraQtyDict, self.envDB)
+      return self.kcal_indices[extra_key].query(MealKcalTarget, self.dtype)
+    table = self.nutrDB.enumerateAllPossibleMealsWithQuantities(MealKcalTarget, ExtraQtyDict, AsTable=True, Dtype=self.dtype)
+    if self.envDB is not None:
+      table.computeAllEnvironmentalImpacts(self.envDB)
+    return table
+
+
+  def _getDiskPath(self, Key):
+    description = [CACHE_VERSION, Key[0], sorted(Key[1]), Key[2], self.use_kcal_index, self.dtype.str]
+    name = hashlib.sha256(json.dumps(description).encode('utf-8')).hexdigest()[:32]
+    return os.path.join(self.directory, name + '.npz')
+
+
+  def _loadFromDisk(self, Key):
+    if self.directory is None:
+      return None
+    path = self._getDiskPath(Key)
+    if not os.path.isfile(path):
+      return None
+    try:
+      with np.load(path, allow_pickle=False) as npz:
+        table = mealtablemodule.MealTable(self.nutrDB.food_table.foods, npz['food_indices'], npz['quantities'], npz['impacts'], Dtype=self.dtype)
+      os.utime(path) # the modification times order the files from the least to the most recently used
+      return table
+    except (OSError, ValueError, KeyError):
+      return None
+
+
+  def _saveToDisk(self, Key, Table):
+    if self.directory is None:
+      return
+    path = self._getDiskPath(Key)
+    try:
+      os.makedirs(self.directory, exist_ok=True)
+      tmp_path = path + '.tmp{0}'.format(os.getpid())
+      with open(tmp_path, 'wb') as npz_file:
+        np.savez(npz_file, food_indices=Table.food_indices, quantities=Table.quantities, impacts=Table.impacts)
+      os.replace(tmp_path, path)
+      self._evictFromDisk()
+    except OSError as e:
+      print('Warning: could not write the enumeration cache in', self.directory, '(' + str(e) + ')')
+
+
+  def _evictFromDisk(self):
+    # removes the least recently used files of the disk tier to keep at most self.max_disk_entries of them
+    paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.npz')]
+    if len(paths) <= self.max_disk_entries:
+      return
+    times = {}
+    for path in paths:
+      try:
+        times[path] = os.path.getmtime(path)
+      except OSError: # removed by another process
+        pass
+    for path in sorted(times, key=times.get)[:len(times) - self.max_disk_entries]:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+
+  def getStatistics(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: a dictionary containing the counters of self (hits, disk_hits, misses), the number of tables
+    in memory and the hit ratio (hits of both tiers over requests)
+    """
+    nb_requests = self.hits + self.disk_hits + self.misses
+    return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'entries': len(self.entries),
+            'hit_ratio': (self.hits + self.disk_hits)/nb_requests if nb_requests > 0 else 0.0}
+
+
+  def clear(self):
+    """
+    Parameters passed in data mode: [none]
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions:
+      - the memory tier is emptied (the disk tier and the counters are kept)
+    Result: [none]
+    """
+    self.entries.clear()
+    self.kcal_indices.clear()
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import shutil
+  import tempfile
+  import nutritionDBmodule
+  import envDBmodule
+
+  nutrDB = nutritionDBmodule.NutritionDatabase()
+  envDB = envDBmodule.EnvironmentalDatabase()
+  extra_qty_dict = {'Beet Sugar': 0.012, 'Coffee': 0.008, 'Dark Chocolate': 0.020}
+  directory = tempfile.mkdtemp()
+
+  print('Unit test of EnumerationCache hits and misses:')
+  cache = EnumerationCache(nutrDB, envDB, MaxEntries=2, Directory=directory)
+  first = cache.getMealTable(720.3, extra_qty_dict)
+  second = cache.getMealTable(719.8, dict(extra_qty_dict)) # same rounded target and extras
+  expected = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict, AsTable=True)
+  expected.computeAllEnvironmentalImpacts(envDB)
+  print(cache.hits == 1 and cache.misses == 1)
+  print(np.array_equal(second.quantities, expected.quantities) and np.array_equal(second.impacts, expected.impacts))
+  second.computeAllRatings({food: 3 for food in nutrDB.getAllFoods()})
+  print(cache.getMealTable(720, extra_qty_dict).total_rating == 0) # the cached table is not modified by the callers
+  print('')
+
+  print('Unit test of EnumerationCache LRU eviction:')
+  cache.getMealTable(500, extra_qty_dict)
+  cache.getMealTable(720, extra_qty_dict)
+  cache.getMealTable(1000, extra_qty_dict) # evicts 500, the least recently used
+  print(len(cache) == 2 and cache.makeKey(500, extra_qty_dict) not in cache.entries and cache.makeKey(720, extra_qty_dict) in cache.entries)
+  print('')
+
+  print('Unit test of the disk tier of EnumerationCache:')
+  other_cache = EnumerationCache(nutrDB, envDB, Directory=directory)
+  table = other_cache.getMealTable(500, extra_qty_dict)
+  print(other_cache.getStatistics()['disk_hits'] == 1 and other_cache.misses == 0)
+  print(np.array_equal(table.food_indices, cache._compute(500.0, extra_qty_dict).food_indices))
+  changed_extras = dict(extra_qty_dict)
+  changed_extras['Coffee'] = 0.010
+  other_cache.getMealTable(500, changed_extras)
+  print(other_cache.misses == 1)
+  bounded_directory = os.path.join(directory, 'bounded')
+  bounded_cache = EnumerationCache(nutrDB, envDB, Directory=bounded_directory, MaxDiskEntries=2)
+  for target in [500, 600, 700]:
+    bounded_cache.getMealTable(target, extra_qty_dict)
+  print(sorted(os.listdir(bounded_directory)) == sorted(os.path.basename(bounded_cache._getDiskPath(bounded_cache.makeKey(target, extra_qty_dict))) for target in [600, 700]))
+  print('')
+
+  print('Unit test of EnumerationCache without rounding:')
+  exact_cache = EnumerationCache(nutrDB, envDB, Rounding=None)
+  table = exact_cache.getMealTable(720.3, extra_qty_dict)
+  exact = nutrDB.enumerateAllPossibleMealsWithQuantities(720.3, extra_qty_dict, AsTable=True)
+  print(exact_cache.roundTarget(720.3) == 720.3 and np.array_equal(table.quantities, exact.quantities))
+  exact_cache.getMealTable(720, extra_qty_dict)
+  print(exact_cache.misses == 2)
+  print('')
+
+  print('Unit test of EnumerationCache with a KcalTargetIndex:')
+  index_cache = EnumerationCache(nutrDB, envDB, UseKcalIndex=True)
+  table = index_cache.getMealTable(720, extra_qty_dict)
+  print(np.array_equal(table.food_indices, expected.food_indices) and np.allclose(table.quantities, expected.quantities, rtol=1e-9, atol=1e-12))
+  shutil.rmtree(directory)
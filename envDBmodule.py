@@ -5,13 +5,16 @@
 
 # External librairies
 
-import pandas as pd
+import numpy as np
+# pandas (and openpyxl) are only imported by loadFromFile when the parsed data is not in the cache
 
 
 
 # Local modules
 
 import myutils
+import dbcachemodule
+import foodtablemodule
 
 
 #############################
@@ -301,9 +304,9 @@ class EnvironmentalImpact(object):
 
 class EnvironmentalDatabase(object):
 
-  def __init__(self, Filepath=''):
+  def __init__(self, Filepath='', UseCache=True):
     """
-    Parameters passed in data mode: Filepath
+    Parameters passed in data mode: Filepath, UseCache
     Parameters passed in data/result mode: [none]
     Parameters passed in result mode: self
     Preconditions:       
@@ -315,12 +318,14 @@ class EnvironmentalDatabase(object):
           - W : Median acidifying emissions across all producers, in gSO2eq. per retail unit
           - AC: Median eutrophying emissions across all producers, in gPO43-eq. per retail unit  
           - AO: Median stress-weighted water use across all producers, in L per retail unit.
+      - UseCache is passed to loadFromFile
     Postconditions:       
       - self.land_use_dict associates to each food the median land use across all producers, in sq meters per retail unit
       - self.GHG_emissions_dict associates to each food the median greenhouse gas emissions across all producers, in kgCO2eq. per retail unit
       - self.acidifying_emissions_dict associates to each food the median acidifying emissions across all producers, in gSO2eq. per retail unit
       - self.eutrophying_emissions_dict associates to each food the median eutrophying emissions across all producers, in gPO43-eq. per retail unit
       - self.water_use_dict associates to each food the median stress-weighted water use across all producers, in L per retail unit. 
+      - self.food_table is a FoodTable (see module foodtablemodule) holding the same data as the dictionaries
     Result: self
     """
     self.land_use_dict              = {}
@@ -328,10 +333,11 @@ class EnvironmentalDatabase(object):
     self.acidifying_emissions_dict  = {}
     self.eutrophying_emissions_dict = {}
     self.water_use_dict             = {}
+    self.food_table                 = None
     if Filepath == '':
       self.loadDefault()
     else:
-      self.loadFromFile(Filepath)  
+      self.loadFromFile(Filepath, UseCache)
 
 
 
@@ -449,11 +455,13 @@ class EnvironmentalDatabase(object):
                       'Eggs': 18621
                     }
 
+    self.buildFoodTable()
+
     
 
-  def loadFromFile(self, Filepath):
+  def loadFromFile(self, Filepath, UseCache=True):
     """
-    Parameters passed in data mode: Filepath
+    Parameters passed in data mode: Filepath, UseCache
     Parameters passed in data/result mode: self
     Parameters passed in result mode: [none]
     Preconditions:
@@ -471,18 +479,57 @@ class EnvironmentalDatabase(object):
       - self.acidifying_emissions_dict associates to each food the median acidifying emissions across all producers, in gSO2eq. per retail unit
       - self.eutrophying_emissions_dict associates to each food the median eutrophying emissions across all producers, in gPO43-eq. per retail unit
       - self.water_use_dict associates to each food the median stress-weighted water use across all producers, in L per retail unit.  
+      - if UseCache is True (default), the parsed contents are read from the cache of module dbcachemodule when it
+        holds an entry for the current contents of the file; otherwise the file is parsed and the cache entry is written
+    Result: [none]
+    """
+    columns = ['LandUse', 'GHGEmissions', 'AcidifyingEmissions', 'EutrophyingEmissions', 'WaterUse']
+    cached = dbcachemodule.loadParsedData('environment', Filepath) if UseCache else None
+    if cached is not None:
+      (header, arrays) = cached
+      products = header['products']
+      env_data = {column: arrays[column].tolist() for column in columns}
+    else:
+      import pandas as pd
+      env_data = pd.read_excel(Filepath, 
+        sheet_name='Results - Retail Weight',
+        skiprows=[0,1,46,47,48], # row 2 is used as a header maybe
+        usecols='A,E,K,W,AC,AO',
+        names=['Product'] + columns)
+      products = list(env_data['Product'])
+      if UseCache:
+        arrays = {column: np.array(env_data[column], dtype=float) for column in columns}
+        dbcachemodule.saveParsedData('environment', Filepath, {'products': products}, arrays)
+    self.land_use_dict              = dict(zip(products, env_data['LandUse']))
+    self.GHG_emissions_dict         = dict(zip(products, env_data['GHGEmissions']))
+    self.acidifying_emissions_dict  = dict(zip(products, env_data['AcidifyingEmissions']))
+    self.eutrophying_emissions_dict = dict(zip(products, env_data['EutrophyingEmissions']))
+    self.water_use_dict             = dict(zip(products, env_data['WaterUse']))
+    self.buildFoodTable()
+
+
+  def buildFoodTable(self):
+    """
+    Parameters passed in data mode: [none]
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions:
+      - self.food_table is a new frozen FoodTable built from the five dictionaries of self (foods have no category
+        here, see FoodTable.withImpacts to attach these impacts to the foods of a NutritionDatabase); 
+        missing values are stored as NaN
+      - this method must be called again if the dictionaries of self are modified
     Result: [none]
     """
-    env_data = pd.read_excel(Filepath, 
-      sheet_name='Results - Retail Weight',
-      skiprows=[0,1,46,47,48], # row 2 is used as a header maybe
-      usecols='A,E,K,W,AC,AO',
-      names=['Product', 'LandUse', 'GHGEmissions', 'AcidifyingEmissions', 'EutrophyingEmissions', 'WaterUse'])
-    self.land_use_dict              = dict(zip(env_data['Product'], env_data['LandUse']))
-    self.GHG_emissions_dict         = dict(zip(env_data['Product'], env_data['GHGEmissions']))
-    self.acidifying_emissions_dict  = dict(zip(env_data['Product'], env_data['AcidifyingEmissions']))
-    self.eutrophying_emissions_dict = dict(zip(env_data['Product'], env_data['EutrophyingEmissions']))
-    self.water_use_dict             = dict(zip(env_data['Product'], env_data['WaterUse']))
+    dicts = [self.land_use_dict, self.GHG_emissions_dict, self.acidifying_emissions_dict, self.eutrophying_emissions_dict, self.water_use_dict]
+    foods = []
+    for d in dicts:
+      for food in d:
+        if food not in foods:
+          foods.append(food)
+    nan = float('nan')
+    impacts = [ [d.get(food, nan) for d in dicts] for food in foods ]
+    self.food_table = foodtablemodule.FoodTable(foods, Impacts=impacts)
 
 
   def isConsistentWith(self, NutrDB):
@@ -521,12 +568,12 @@ class EnvironmentalDatabase(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Food is a string
-      - Food exists as a key in self.land_use_dict
+      - Food exists as a key in self.land_use_dict (the value is read from self.food_table)
       - Qty is a float
     Postconditions: [none]
     Result: land use (in square meters) of the given Qty of Food
     """
-    return (Qty*self.land_use_dict[Food])
+    return (Qty*self.food_table.impacts[self.food_table.food_ids[Food], foodtablemodule.LAND_USE])
 
   def getGHGEmissions(self, Food, Qty=1.0):
     """
@@ -535,12 +582,12 @@ class EnvironmentalDatabase(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Food is a string
-      - Food exists as a key in self.GHG_emissions_dict
+      - Food exists as a key in self.GHG_emissions_dict (the value is read from self.food_table)
       - Qty is a float
     Postconditions: [none]
     Result: amount of GHG emissions (kgCO2eq.) of the given Qty of Food
     """
-    return (Qty*self.GHG_emissions_dict[Food])
+    return (Qty*self.food_table.impacts[self.food_table.food_ids[Food], foodtablemodule.GHG_EMISSIONS])
 
   def getAcidifyingEmissions(self, Food, Qty=1.0):
     """
@@ -549,12 +596,12 @@ class EnvironmentalDatabase(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Food is a string
-      - Food exists as a key in self.acidifying_emissions_dict
+      - Food exists as a key in self.acidifying_emissions_dict (the value is read from self.food_table)
       - Qty is a float
     Postconditions: [none]
     Result: amount of acidifying emissions (gSO2eq.) of the given Qty of Food
     """
-    return (Qty*self.acidifying_emissions_dict[Food])
+    return (Qty*self.food_table.impacts[self.food_table.food_ids[Food], foodtablemodule.ACIDIFYING_EMISSIONS])
 
   def getEutrophyingEmissions(self, Food, Qty=1.0):
     """
@@ -563,12 +610,12 @@ class EnvironmentalDatabase(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Food is a string
-      - Food exists as a key in self.eutrophying_emissions_dict
+      - Food exists as a key in self.eutrophying_emissions_dict (the value is read from self.food_table)
       - Qty is a float
     Postconditions: [none]
     Result: amount of acidifying emissions (gPO43-eq.) of the given Qty of Food
     """
-    return (Qty*self.eutrophying_emissions_dict[Food])
+    return (Qty*self.food_table.impacts[self.food_table.food_ids[Food], foodtablemodule.EUTROPHYING_EMISSIONS])
 
   def getWaterUse(self, Food, Qty=1.0):
     """
@@ -577,12 +624,12 @@ class EnvironmentalDatabase(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Food is a string
-      - Food exists as a key in self.water_use_dict
+      - Food exists as a key in self.water_use_dict (the value is read from self.food_table)
       - Qty is a float
     Postconditions: [none]
     Result: stress-weighted freshwater use (in L) of the given Qty of Food
     """
-    return (Qty*self.water_use_dict[Food])
+    return (Qty*self.food_table.impacts[self.food_table.food_ids[Food], foodtablemodule.WATER_USE])
 
 
 
@@ -0,0 +1,258 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import numpy as np
+
+
+# Local modules
+
+import mealtablemodule
+
+
+#######################
+# Class FoodMealIndex #
+#######################
+
+class FoodMealIndex(object):
+
+  def __init__(self, Table):
+    """
+    Parameters passed in data mode: Table
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - Table is a MealTable whose food indices are not modified afterwards
+    Postconditions:
+      - self.offsets and self.meal_rows form an inverted index in CSR layout: the increasing rows of the meals
+        containing the food of index f are self.meal_rows[self.offsets[f]:self.offsets[f+1]]
+      - self.occurrences[self.offsets[f]:self.offsets[f+1]] gives, for each of these rows, the number of components
+        of the meal made of the food f (a food can be both a carb source and a fat source, for instance)
+      - self.nb_words is the number of 64-bit words of a bitset over the rows of Table
+    Result: self
+    """
+    self.table = Table
+    nb_meals = len(Table)
+    nb_foods = len(Table.foods)
+    food_indices = Table.food_indices.astype(np.intp)
+    # one (food, row) key per component of each meal, sorted by food then row; the repeated keys are merged
+    (pairs, occurrences) = np.unique(food_indices*nb_meals + np.arange(nb_meals)[:, None], return_counts=True)
+    self.offsets = np.zeros(nb_foods + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs // max(nb_meals, 1), minlength=nb_foods), out=self.offsets[1:])
+    self.meal_rows = (pairs % max(nb_meals, 1)).astype(np.int32 if nb_meals < 2**31 else np.int64)
+    self.occurrences = occurrences.astype(np.int8)
+    self.nb_words = -(-nb_meals // 64)
+
+
+  def __len__(self):
+    return len(self.table)
+
+
+  def getRowsContaining(self, Food):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Food is a string of self.table.foods
+    Postconditions: [none]
+    Result: the increasing int array of the rows of the meals containing Food
+    """
+    f = self.table.foods.index(Food)
+    return self.meal_rows[self.offsets[f]:self.offsets[f+1]]
+
+
+  def getBitset(self, Foods):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Foods is a list of strings of self.table.foods (the unknown foods are ignored)
+    Postconditions: [none]
+    Result: a packed bitset (array of self.nb_words uint64) whose bit r is set if the meal of row r contains
+    at least one of Foods
+    """
+    food_ids = {food: i for (i, food) in enumerate(self.table.foods)}
+    bits = np.zeros(self.nb_words*64, dtype=bool)
+    for food in Foods:
+      if food in food_ids:
+        f = food_ids[food]
+        bits[self.meal_rows[self.offsets[f]:self.offsets[f+1]]] = True
+    return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+  def getFullBitset(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: a packed bitset with the bits of all the rows of self.table set
+    """
+    bits = np.zeros(self.nb_words*64, dtype=bool)
+    bits[:len(self.table)] = True
+    return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+  def filterBasedOnUserVeto(self, FoodRatings, Bitset=None):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - FoodRatings is a dictionary associating a rating between 0 and 5 to each food
+      - if specified, Bitset is a packed bitset of the rows to filter (default: all the rows)
+    Postconditions:
+      - the rows of the meals containing a 0-rated food are subtracted from Bitset (bitwise and-not over
+        self.nb_words words): the cost depends on the number of meals containing the vetoed foods
+    Result: the packed bitset of the remaining rows
+    """
+    if Bitset is None:
+      Bitset = self.getFullBitset()
+    vetoed_foods = [food for (food, rating) in FoodRatings.items() if rating <= 0]
+    return Bitset & ~self.getBitset(vetoed_foods)
+
+
+  def computeRatings(self, FoodRatings):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - FoodRatings is a dictionary associating a rating between 0 and 5 to each food used by the meals
+    Postconditions: [none]
+    Result: the (N,) float array of the ratings of the meals, as MealTable.computeAllRatings
+    """
+    return mealtablemodule.computeRatingArray(self.table.food_indices, mealtablemodule.foodRatingVector(self.table.foods, FoodRatings))
+
+
+  def updateRatings(self, Ratings, Food, OldRating, NewRating):
+    """
+    Parameters passed in data mode: Food, OldRating, NewRating
+    Parameters passed in data/result mode: Ratings
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Ratings is the (N,) float array of the ratings of the meals of self.table, computed with OldRating for Food
+    Postconditions:
+      - only the ratings of the meals containing Food are updated: each of them changes by
+        (NewRating - OldRating) times the number of components of the meal made of Food
+    Result: [none]
+    """
+    f = self.table.foods.index(Food)
+    start = self.offsets[f]
+    end = self.offsets[f+1]
+    Ratings[self.meal_rows[start:end]] += (NewRating - OldRating)*self.occurrences[start:end]
+
+
+  def getView(self, Bitset):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Bitset is a packed bitset over the rows of self.table
+    Postconditions: [none]
+    Result: a MealView of the rows of Bitset
+    """
+    return mealtablemodule.MealView(self.table, bitsetToRows(Bitset, len(self.table)))
+
+
+
+########################
+# Function definitions #
+########################
+
+def bitsetToRows(Bitset, NbRows):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Bitset is a packed bitset (array of uint64, bit r of the bitset being bit r%64 of word r//64)
+  Postconditions: [none]
+  Result: the increasing int array of the rows r < NbRows whose bit is set
+  """
+  bits = np.unpackbits(np.ascontiguousarray(Bitset).view(np.uint8), bitorder='little', count=NbRows)
+  return np.flatnonzero(bits)
+
+
+def rowsToBitset(Rows, NbRows):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Rows is an int array of rows lower than NbRows
+  Postconditions: [none]
+  Result: the packed bitset whose bits are those of Rows
+  """
+  bits = np.zeros(-(-NbRows // 64)*64, dtype=bool)
+  bits[np.asarray(Rows, dtype=np.intp)] = True
+  return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+def countBits(Bitset):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Bitset is a packed bitset
+  Postconditions: [none]
+  Result: the number of bits set in Bitset
+  """
+  return int(np.unpackbits(np.ascontiguousarray(Bitset).view(np.uint8)).sum())
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import time
+  import nutritionDBmodule
+
+  nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+  extra_qty_dict = {food: 0.010 for food in nutrDB.extras}
+  meal_table = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict, AsTable=True)
+  food_index = FoodMealIndex(meal_table)
+  my_ratings = {food: 3 for food in nutrDB.getAllFoods()}
+  my_ratings['Coffee'] = 0
+  my_ratings['Eggs'] = 0
+
+  print('Unit test of FoodMealIndex.getRowsContaining:')
+  rows = food_index.getRowsContaining('Rice')
+  print(np.array_equal(rows, np.flatnonzero(np.any(meal_table.food_indices == meal_table.foods.index('Rice'), axis=1))))
+  print(food_index.offsets[-1] == len(food_index.meal_rows))
+  print('')
+
+  print('Unit test of FoodMealIndex.filterBasedOnUserVeto:')
+  bitset = food_index.filterBasedOnUserVeto(my_ratings)
+  expected = meal_table.filterBasedOnUserVeto(my_ratings)
+  print(countBits(bitset) == len(expected) and np.array_equal(food_index.getView(bitset).rows, expected.rows))
+  subset = rowsToBitset(np.arange(0, len(meal_table), 3), len(meal_table))
+  print(np.array_equal(bitsetToRows(food_index.filterBasedOnUserVeto(my_ratings, subset), len(meal_table)), expected.rows[expected.rows % 3 == 0]))
+  print('')
+
+  print('Unit test of FoodMealIndex.updateRatings:')
+  ratings = food_index.computeRatings(my_ratings)
+  food_index.updateRatings(ratings, 'Rice', my_ratings['Rice'], 5)
+  my_ratings['Rice'] = 5
+  print(np.array_equal(ratings, food_index.computeRatings(my_ratings)))
+  start = time.time()
+  for i in range(100):
+    food_index.updateRatings(ratings, 'Apples', 3, 4)
+    food_index.updateRatings(ratings, 'Apples', 4, 3)
+  duration_update = (time.time() - start)/200
+  start = time.time()
+  for i in range(20):
+    food_index.computeRatings(my_ratings)
+  duration_full = (time.time() - start)/20
+  print(np.array_equal(ratings, food_index.computeRatings(my_ratings)))
+  print('(one rating update: {0:.3f} ms, full recomputation: {1:.3f} ms)'.format(1000*duration_update, 1000*duration_full))
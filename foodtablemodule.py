@@ -0,0 +1,231 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import hashlib
+import json
+import numpy as np
+
+
+#############
+# Constants #
+#############
+
+# Columns of FoodTable.nutrients
+KCAL = 0
+GPROT = 1
+GCARB = 2
+GFAT = 3
+
+# Columns of FoodTable.impacts (same order as EnvironmentalImpact.toList())
+LAND_USE = 0
+GHG_EMISSIONS = 1
+ACIDIFYING_EMISSIONS = 2
+EUTROPHYING_EMISSIONS = 3
+WATER_USE = 4
+
+# Values of the column 'Type' of the FAOdata sheet, in the order of the meal components
+CATEGORIES = ['ProteinSource', 'CarbSource', 'FatSource', 'Vegetable', 'Fruit', 'Extra']
+
+
+###################
+# Class FoodTable #
+###################
+
+class FoodTable(object):
+
+  def __init__(self, Foods, Categories=None, Nutrients=None, Impacts=None):
+    """
+    Parameters passed in data mode: Foods, Categories, Nutrients, Impacts
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - Foods is a list of distinct strings; the integer id of a food is its position in Foods
+      - if specified, Categories is a list of the same length as Foods, containing one of the strings
+        of CATEGORIES (or None) for each food
+      - if specified, Nutrients is an (F,4) array of floats containing, for 1 retail unit of each food, the number of kcal,
+        of grams of protein, of grams of carbohydrates and of grams of fat (see constants KCAL, GPROT, GCARB, GFAT)
+      - if specified, Impacts is an (F,5) array of floats containing, for 1 retail unit of each food, the land use,
+        GHG emissions, acidifying emissions, eutrophying emissions and water use (see constants LAND_USE, ...)
+    Postconditions:
+      - the attributes of self are initialized; unspecified values are set to None (categories) or NaN (numbers)
+      - self.nutrients and self.impacts are C-contiguous and read-only, so that a FoodTable can be shared
+        between threads without locking; it can also be pickled to be sent to other processes
+      - self must not be modified after its creation: build a new FoodTable instead (see withImpacts)
+    Result: self
+    """
+    self.foods = tuple(Foods)
+    self.food_ids = {food: i for (i, food) in enumerate(self.foods)}
+    if len(self.food_ids) != len(self.foods):
+      raise ValueError('The foods of a FoodTable should be distinct.')
+    if Categories is None:
+      Categories = [None]*len(self.foods)
+    self.categories = tuple(Categories)
+    self.nutrients = self._frozenMatrix(Nutrients, 4)
+    self.impacts = self._frozenMatrix(Impacts, 5)
+
+
+  def _frozenMatrix(self, Values, NbColumns):
+    if Values is None:
+      matrix = np.full((len(self.foods), NbColumns), np.nan)
+    else:
+      matrix = np.array(Values, dtype=np.float64, order='C').reshape(len(self.foods), NbColumns)
+    matrix.setflags(write=False)
+    return matrix
+
+
+  def __reduce__(self):
+    # Rebuilding through __init__ makes the unpickled arrays read-only again
+    return (FoodTable, (self.foods, self.categories, np.asarray(self.nutrients), np.asarray(self.impacts)))
+
+
+  def __len__(self):
+    return len(self.foods)
+
+
+  def __contains__(self, Food):
+    return Food in self.food_ids
+
+
+  def getId(self, Food):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Food is a string existing in self.foods
+    Postconditions: [none]
+    Result: the integer id of Food (a KeyError is raised for unknown foods)
+    """
+    return self.food_ids[Food]
+
+
+  def getIds(self, Foods):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Foods is a list of strings, each of them existing in self.foods
+    Postconditions: [none]
+    Result: an int array containing the id of each food of Foods
+    """
+    return np.array([self.food_ids[food] for food in Foods], dtype=np.intp)
+
+
+  def getImpactsOf(self, Foods):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Foods is a list of strings
+    Postconditions: [none]
+    Result: a (len(Foods),5) array containing the impact row of each food of Foods (NaN for the foods unknown to self)
+    """
+    rows = np.full((len(Foods), 5), np.nan)
+    for (i, food) in enumerate(Foods):
+      if food in self.food_ids:
+        rows[i] = self.impacts[self.food_ids[food]]
+    return rows
+
+
+  def getFoodsOfCategory(self, Category):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Category is one of the strings of CATEGORIES
+    Postconditions: [none]
+    Result: the list of the foods of this category, in id order
+    """
+    return [food for (food, category) in zip(self.foods, self.categories) if category == Category]
+
+
+  def contentHash(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: the SHA-256 hash (string of hexadecimal digits) of the foods, categories, nutrients and impacts of self,
+    which identifies the version of the database the table was built from
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps([self.foods, self.categories], default=str).encode('utf-8'))
+    sha.update(self.nutrients.tobytes())
+    sha.update(self.impacts.tobytes())
+    return sha.hexdigest()
+
+
+  def withImpacts(self, EnvTable):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - EnvTable is a FoodTable holding environmental impacts (typically EnvDB.food_table)
+    Postconditions: [none]
+    Result: a new FoodTable with the same foods, ids, categories and nutrients as self, whose impacts are
+    taken from EnvTable (NaN for the foods that EnvTable does not know). This is the catalog that
+    NutritionDatabase and EnvironmentalDatabase computations can share.
+    """
+    return FoodTable(self.foods, self.categories, self.nutrients, EnvTable.getImpactsOf(self.foods))
+
+
+
+########################
+# Function definitions #
+########################
+
+def buildSharedFoodTable(NutrDB, EnvDB):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - NutrDB is a NutritionDatabase and EnvDB an EnvironmentalDatabase, both loaded
+  Postconditions: [none]
+  Result: a FoodTable whose ids are those of NutrDB.food_table, holding both the nutrients and the impacts of each food
+  """
+  return NutrDB.food_table.withImpacts(EnvDB.food_table)
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import pickle
+  import nutritionDBmodule
+  import envDBmodule
+
+  nutrDB = nutritionDBmodule.NutritionDatabase()
+  envDB = envDBmodule.EnvironmentalDatabase()
+  food_table = buildSharedFoodTable(nutrDB, envDB)
+
+  print('Unit test of FoodTable ids and categories:')
+  print(list(food_table.foods[:len(nutrDB.getAllFoods())]) == nutrDB.getAllFoods())
+  print(food_table.getFoodsOfCategory('FatSource') == nutrDB.fat_sources)
+  print('')
+
+  print('Unit test of FoodTable read-only matrices:')
+  try:
+    food_table.nutrients[0, KCAL] = 0
+  except ValueError:
+    print(True) # the nutrient matrix must not be writable
+  else:
+    print(False)
+  print(food_table.impacts[food_table.getId('Coffee'), GHG_EMISSIONS] == envDB.getGHGEmissions('Coffee'))
+  print('')
+
+  print('Unit test of FoodTable pickling:')
+  copy = pickle.loads(pickle.dumps(food_table))
+  print(copy.foods == food_table.foods and np.array_equal(copy.nutrients, food_table.nutrients) and not copy.impacts.flags.writeable)
+  print(copy.contentHash() == food_table.contentHash() and nutrDB.food_table.contentHash() != food_table.contentHash())
@@ -7,6 +7,7 @@ from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationTool
 import usermodule 
 import nutritionDBmodule
 import envDBmodule
+import enumcachemodule
 
 ####################################
 # Class View (inherits from tk.Tk) #
@@ -97,6 +98,9 @@ class Controller(object):
 
     self.meal_kcal_target = None
     self.all_valid_meals = None
+    # Users sharing an energy target (not rounded) and extra quantities share the same tables; the misses only
+    # need a stabbing query in the interval index of their extra quantities
+    self.meal_cache = enumcachemodule.EnumerationCache(self.nutrDB, self.envDB, Rounding=None, UseKcalIndex=True)
     self.view.mainloop()
 
 
@@ -115,7 +119,7 @@ class Controller(object):
     self.view.message2.config(text=str(self.meal_kcal_target)+' kcal')
 
   def computePossibleMeals(self):
-    self.all_valid_meals = self.nutrDB.enumerateAllPossibleMealsWithQuantities(self.meal_kcal_target, self.user.extra_qty_dict)
+    self.all_valid_meals = self.meal_cache.getMealTable(self.meal_kcal_target, self.user.extra_qty_dict)
 
   def drawHistograms(self):
     self.all_valid_meals.computeAllEnvironmentalImpacts(self.envDB)
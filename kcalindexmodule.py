@@ -0,0 +1,175 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import numpy as np
+
+
+# Local modules
+
+import mealtablemodule
+import nutritionDBmodule
+
+
+#########################
+# Class KcalTargetIndex #
+#########################
+
+class KcalTargetIndex(object):
+
+  def __init__(self, NutrDB, ExtraQtyDict, EnvDB=None):
+    """
+    Parameters passed in data mode: NutrDB, ExtraQtyDict, EnvDB
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - NutrDB is a complete and consistent NutritionDatabase
+      - ExtraQtyDict contains an entry for each food in NutrDB.extras
+      - if specified, EnvDB is an EnvironmentalDatabase consistent with NutrDB
+    Postconditions:
+      Meal.computeQuantities solves A.x = MealKcalTarget*c - d, so the quantities of a meal are affine in the
+      target, x = MealKcalTarget*u - v, and the meal is valid on exactly one interval of targets (where x >= 0).
+      For every meal that is valid for at least one target, self stores, sorted by lower bound:
+      - self.food_indices: (M,6) positions of its foods in self.foods (= NutrDB.food_table.foods)
+      - self.lower_bounds, self.upper_bounds: (M,) limits of its interval of valid targets (possibly infinite)
+      - self.quantity_slopes, self.quantity_offsets: (M,6) so that quantities = target*slopes + offsets
+      - self.impact_slopes, self.impact_offsets: (M,5) the same for the impacts (zeros if EnvDB is not given)
+      - self.meal_numbers: (M,) position of the meal in the order of enumerateAllPossibleMeals
+    Result: self
+    """
+    self.foods = NutrDB.food_table.foods
+    self.extra_qty_dict = dict(ExtraQtyDict)
+    self.has_impacts = EnvDB is not None
+    (triples, sides) = NutrDB.getCombinationGrids()
+    nutrients = NutrDB.food_table.nutrients
+    (vegetable_qty, fruit_qty, extra_qty) = NutrDB.getSideQuantities(sides, ExtraQtyDict)
+    side_qty = np.stack([vegetable_qty, fruit_qty, extra_qty], axis=1)
+
+    # a.x = target*c - d, with d the kcal brought by the macro-nutrients of the vegetable, fruit and extra,
+    # solved with the inverses of a cached by NutrDB
+    (inverses, singular) = NutrDB.getTripleInverses()
+    c = np.array([0.15, 0.55, 0.30])
+    kcal_factors = np.array([4, 4, 8.8])
+    side_nutrients = nutrients[sides][:, :, 1:4] # shape (S, 3 foods, 3 macro-nutrients)
+    d = kcal_factors*np.einsum('sk,skn->sn', side_qty, side_nutrients)
+
+    u = nutritionDBmodule.applyInverse(inverses, c)                            # shape (T, 3)
+    v = nutritionDBmodule.applyInverse(inverses[:, None, :, :], d[None, :, :])  # shape (T, S, 3)
+    u = np.broadcast_to(u[:, None, :], v.shape).reshape(-1, 3)
+    v = v.reshape(-1, 3)
+
+    # x_i >= 0  <=>  target*u_i >= v_i
+    with np.errstate(divide='ignore', invalid='ignore'):
+      ratios = v/u
+    lower = np.where(u > 0, ratios, -np.inf).max(axis=1)
+    upper = np.where(u < 0, ratios, np.inf).min(axis=1)
+    never = np.any((u == 0) & (v > 0), axis=1)
+    feasible = np.repeat(~singular, len(sides)) & ~never & (lower <= upper)
+
+    meal_numbers = np.flatnonzero(feasible)
+    order = np.argsort(lower[meal_numbers], kind='stable')
+    meal_numbers = meal_numbers[order]
+    (triple_numbers, side_numbers) = np.divmod(meal_numbers, len(sides))
+    self.meal_numbers = meal_numbers
+    self.lower_bounds = np.ascontiguousarray(lower[meal_numbers])
+    self.upper_bounds = np.ascontiguousarray(upper[meal_numbers])
+    self.food_indices = np.concatenate([triples[triple_numbers], sides[side_numbers]], axis=1)
+    self.quantity_slopes = np.zeros((len(meal_numbers), 6))
+    self.quantity_slopes[:, :3] = u[meal_numbers]
+    self.quantity_offsets = np.concatenate([-v[meal_numbers], side_qty[side_numbers]], axis=1)
+    self.impact_slopes = np.zeros((len(meal_numbers), 5))
+    self.impact_offsets = np.zeros((len(meal_numbers), 5))
+    if self.has_impacts:
+      impact_rows = mealtablemodule.getUsedImpactRows(EnvDB, self.foods, self.food_indices)
+      self.impact_slopes = mealtablemodule.computeImpactArray(self.food_indices, self.quantity_slopes, impact_rows)
+      self.impact_offsets = mealtablemodule.computeImpactArray(self.food_indices, self.quantity_offsets, impact_rows)
+
+
+  def __len__(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: the number of meals that are valid for at least one kcal target
+    """
+    return len(self.meal_numbers)
+
+
+  def findRows(self, MealKcalTarget):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - MealKcalTarget is a positive integer or float
+    Postconditions: [none]
+    Result: the int array of the rows of self whose interval contains MealKcalTarget (stabbing query), sorted
+    in the order of enumerateAllPossibleMeals. Only the rows whose lower bound is <= MealKcalTarget are scanned.
+    """
+    nb_candidates = np.searchsorted(self.lower_bounds, MealKcalTarget, side='right')
+    rows = np.flatnonzero(self.upper_bounds[:nb_candidates] >= MealKcalTarget)
+    return rows[np.argsort(self.meal_numbers[rows], kind='stable')]
+
+
+  def count(self, MealKcalTarget):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - MealKcalTarget is a positive integer or float
+    Postconditions: [none]
+    Result: the number of valid meals for MealKcalTarget
+    """
+    nb_candidates = np.searchsorted(self.lower_bounds, MealKcalTarget, side='right')
+    return int(np.count_nonzero(self.upper_bounds[:nb_candidates] >= MealKcalTarget))
+
+
+  def query(self, MealKcalTarget, Dtype=np.float64):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - MealKcalTarget is a positive integer or float
+    Postconditions: [none]
+    Result: a MealTable containing the same meals as NutrDB.enumerateAllPossibleMealsWithQuantities(MealKcalTarget, ExtraQtyDict),
+    whose quantities (and impacts, if EnvDB was given) are evaluated with one multiply-add instead of a new solve.
+    They agree with the solved ones up to rounding errors; a meal whose interval ends exactly at MealKcalTarget
+    may therefore be included by one method and not by the other.
+    """
+    rows = self.findRows(MealKcalTarget)
+    quantities = MealKcalTarget*self.quantity_slopes[rows] + self.quantity_offsets[rows]
+    impacts = MealKcalTarget*self.impact_slopes[rows] + self.impact_offsets[rows]
+    return mealtablemodule.MealTable(self.foods, self.food_indices[rows], quantities, impacts, Dtype=Dtype)
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import envDBmodule
+
+  nutrDB = nutritionDBmodule.NutritionDatabase()
+  envDB = envDBmodule.EnvironmentalDatabase()
+  extra_qty_dict = {'Beet Sugar': 0.012, 'Coffee': 0.008, 'Dark Chocolate': 0.020}
+  kcal_index = KcalTargetIndex(nutrDB, extra_qty_dict, envDB)
+
+  print('Unit test of KcalTargetIndex.query:')
+  all_same = True
+  for target in [250, 500, 720, 1000, 1500]:
+    expected = nutrDB.enumerateAllPossibleMealsWithQuantities(target, extra_qty_dict, AsTable=True)
+    expected.computeAllEnvironmentalImpacts(envDB)
+    meals = kcal_index.query(target)
+    if kcal_index.count(target) != len(expected) or not np.array_equal(meals.food_indices, expected.food_indices):
+      all_same = False
+    elif not (np.allclose(meals.quantities, expected.quantities, rtol=1e-9, atol=1e-12) and np.allclose(meals.impacts, expected.impacts, rtol=1e-9, atol=1e-12)):
+      all_same = False
+  print(all_same)
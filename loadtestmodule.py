@@ -0,0 +1,423 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import numpy as np
+
+
+# Local modules
+
+import usermodule
+import nutritionDBmodule
+import envDBmodule
+import servermodule
+
+
+
+#############
+# Constants #
+#############
+
+# Share of each endpoint in the requests generated by makeRequestMix
+ENDPOINT_MIX = {'/energy': 0.15, '/meals': 0.15, '/filter': 0.45, '/topk': 0.25}
+
+# Serving sizes of the extras (kg or L) shared by the generated users, and the share of the users using each of them:
+# like real users, most of them share a few typical serving sizes, so that the server keeps a few tables warm
+EXTRA_QUANTITY_PRESETS = [(0.010, 0.8), (0.005, 0.15), (0.020, 0.05)]
+
+# Interval (in s) between two samples of the memory and of the number of completed requests
+SAMPLING_INTERVAL = 0.25
+
+# Default limits of the regression gate (None: not checked)
+DEFAULT_LIMITS = {'max_p95_ms': None, 'max_p99_ms': None, 'min_throughput': None, 'max_error_rate': 0.0, 'max_memory_mb': None}
+
+
+
+########################
+# Function definitions #
+########################
+
+def makeRequestMix(NbRequests, NutrDB, Seed=0, Limit=10):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - NbRequests is a positive integer, NutrDB the NutritionDatabase of the server
+  Postconditions:
+    - the requests are drawn with a generator seeded with Seed, so that a mix can be replayed exactly: random
+      adult profiles (whose meal target is their main meal kcal target), extra quantities drawn from
+      EXTRA_QUANTITY_PRESETS, ratings with a few vetoes and thresholds between loose and selective
+  Result: a list of NbRequests tuples (path, body), the paths being drawn according to ENDPOINT_MIX
+  """
+  generator = np.random.default_rng(Seed)
+  paths = generator.choice(list(ENDPOINT_MIX), NbRequests, p=list(ENDPOINT_MIX.values()))
+  genders = generator.choice(['F', 'M'], NbRequests)
+  ages = generator.integers(18, 80, NbRequests)
+  body_weights = generator.normal(70, 12, NbRequests).clip(45, 130).round(1)
+  heights = generator.normal(170, 9, NbRequests).clip(150, 200).round()
+  levels = generator.choice(list(usermodule.PHYSICAL_ACTIVITY_FACTORS), NbRequests)
+  (bmr, daily_energy, breakfast_kcal, main_meal_kcal, errors) = usermodule.computeCohortEnergyRequirements(genders, ages, body_weights, heights, levels)
+  extra_quantities = generator.choice([qty for (qty, share) in EXTRA_QUANTITY_PRESETS], NbRequests, p=[share for (qty, share) in EXTRA_QUANTITY_PRESETS]).tolist()
+  all_foods = NutrDB.getAllFoods()
+  requests = []
+  for i in range(NbRequests):
+    profile = {'gender': str(genders[i]), 'age': int(ages[i]), 'body_weight': float(body_weights[i]), 'height': float(heights[i]),
+               'physical_activity_level': str(levels[i])}
+    if paths[i] == '/energy':
+      requests.append((paths[i], profile))
+      continue
+    body = {'meal_kcal': round(float(main_meal_kcal[i])), 'limit': Limit,
+            'extra_quantities': {extra: extra_quantities[i] for extra in NutrDB.extras}}
+    if paths[i] in ['/filter', '/topk']:
+      body['env_thresholds'] = (np.array([2.0, 1.5, 15.0, 10.0, 3000])*generator.uniform(0.7, 3.0)).tolist()
+      ratings = dict(zip(all_foods, generator.integers(1, 6, len(all_foods)).tolist()))
+      for food in generator.choice(all_foods, generator.integers(0, 3), replace=False).tolist():
+        ratings[food] = 0
+      body['ratings'] = ratings
+    if paths[i] == '/topk':
+      body['k'] = int(generator.choice([5, 10, 50]))
+      body['weights'] = generator.dirichlet(np.ones(5)).tolist()
+      body['rating_weight'] = float(generator.choice([0.0, 0.5]))
+    requests.append((paths[i], body))
+  return requests
+
+
+def getMemoryUsage(Pid=None):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - if specified, Pid is the process identifier of the server (default: the current process)
+  Postconditions: [none]
+  Result: the resident memory of the process in MB, read from /proc (Linux); if it is not available, the
+  peak resident memory of the current process, or NaN
+  """
+  try:
+    with open('/proc/' + (str(Pid) if Pid is not None else 'self') + '/status') as f:
+      for line in f:
+        if line.startswith('VmRSS:'):
+          return int(line.split()[1])/1024
+  except OSError:
+    pass
+  try:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/(1024*1024 if sys.platform == 'darwin' else 1024)
+  except ImportError:
+    return float('nan')
+
+
+async def _sendRequest(Reader, Writer, Host, Path, Body):
+  # sends one request on a keep-alive connection and returns the status of the response (its body is discarded)
+  data = json.dumps(Body).encode('utf-8')
+  Writer.write(('POST ' + Path + ' HTTP/1.1\r\nHost: ' + Host + '\r\nContent-Type: application/json\r\nContent-Length: '
+                + str(len(data)) + '\r\n\r\n').encode('ascii') + data)
+  await Writer.drain()
+  status = int((await Reader.readline()).split()[1])
+  length = 0
+  while True:
+    line = await Reader.readline()
+    if line in (b'\r\n', b'\n', b''):
+      break
+    if line.lower().startswith(b'content-length:'):
+      length = int(line.split(b':')[1])
+  await Reader.readexactly(length)
+  return status
+
+
+async def replayRequests(Host, Port, Requests, Concurrency, Counter=None):
+  """
+  Parameters passed in data mode: Host, Port, Requests, Concurrency
+  Parameters passed in data/result mode: Counter
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - a MealPlanningService server listens on (Host, Port)
+    - Requests is a list of tuples (path, body) returned by makeRequestMix, Concurrency a positive integer
+    - if specified, Counter is a list of one integer, incremented after each response (for the sampler)
+  Postconditions:
+    - Concurrency clients, each with its own keep-alive connection, send the requests in order, each client
+      sending its next request as soon as it received the previous response (closed loop)
+    - a client reconnects when its connection fails; if the server cannot be reached anymore, the client stops,
+      and the requests that are never sent keep the status 0 (so that checkReport reports the errors)
+  Result: a tuple (latencies, statuses, duration): the latency (s) and HTTP status of each request (0 if the
+  connection failed), and the total duration (s)
+  """
+  latencies = np.zeros(len(Requests))
+  statuses = np.zeros(len(Requests), dtype=np.int64)
+  next_request = [0]
+
+  async def client():
+    try:
+      (reader, writer) = await asyncio.open_connection(Host, Port)
+    except OSError:
+      return
+    try:
+      while next_request[0] < len(Requests):
+        i = next_request[0]
+        next_request[0] += 1
+        start = time.perf_counter()
+        try:
+          statuses[i] = await _sendRequest(reader, writer, Host, *Requests[i])
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+          writer.close()
+          try:
+            (reader, writer) = await asyncio.open_connection(Host, Port)
+          except OSError: # the server is down: this client stops
+            latencies[i] = time.perf_counter() - start
+            return
+        latencies[i] = time.perf_counter() - start
+        if Counter is not None:
+          Counter[0] += 1
+    finally:
+      writer.close()
+
+  start = time.perf_counter()
+  await asyncio.gather(*[client() for c in range(min(Concurrency, len(Requests)))])
+  return (latencies, statuses, time.perf_counter() - start)
+
+
+async def sampleProgress(Samples, Counter, StopEvent, Pid=None, Interval=SAMPLING_INTERVAL):
+  """
+  Parameters passed in data mode: Counter, StopEvent, Pid, Interval
+  Parameters passed in data/result mode: Samples
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Samples is a list, Counter the counter of replayRequests, StopEvent an asyncio.Event
+  Postconditions:
+    - until StopEvent is set, a dictionary (time, number of completed requests, memory of the server in MB) is
+      appended to Samples every Interval seconds
+  Result: [none]
+  """
+  start = time.perf_counter()
+  while not StopEvent.is_set():
+    Samples.append({'time': time.perf_counter() - start, 'completed': Counter[0], 'memory_mb': getMemoryUsage(Pid)})
+    try:
+      await asyncio.wait_for(StopEvent.wait(), Interval)
+    except asyncio.TimeoutError:
+      pass
+
+
+def summarizeLatencies(Latencies, Statuses, Duration, Paths):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Latencies, Statuses and Duration are returned by replayRequests, Paths is the list of the paths of the requests
+  Postconditions: [none]
+  Result: a dictionary containing the number of requests, the error rate (status other than 200), the throughput
+  (requests per second), the p50/p95/p99/max latencies in ms of the successful requests, overall and per endpoint
+  """
+  paths = np.asarray(Paths)
+  ok = (Statuses == 200)
+
+  def percentiles(Mask):
+    values = 1000*Latencies[Mask & ok]
+    if len(values) == 0:
+      return {'count': int(np.count_nonzero(Mask)), 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    (p50, p95, p99) = np.percentile(values, [50, 95, 99])
+    return {'count': int(np.count_nonzero(Mask)), 'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(values.max())}
+
+  summary = percentiles(np.ones(len(Latencies), dtype=bool))
+  summary['error_rate'] = float(1 - ok.mean()) if len(ok) > 0 else 0.0
+  summary['throughput'] = len(Latencies)/Duration if Duration > 0 else 0.0
+  summary['endpoints'] = {path: percentiles(paths == path) for path in sorted(set(Paths))}
+  return summary
+
+
+async def runLoadTest(Host, Port, Requests, ConcurrencyLevels, Pid=None, NbWarmupRequests=0):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - see replayRequests; ConcurrencyLevels is a list of positive integers
+  Postconditions:
+    - the first NbWarmupRequests requests are sent once by a single client and are not measured (they fill the
+      tables of the server); then all the requests are replayed at each concurrency level, while the memory of
+      the server and the number of completed requests are sampled
+  Result: a report (dictionary) containing a summary (see summarizeLatencies) and the samples of each level, and the
+  peak memory; the saturation point is the level after which the throughput stops increasing by more than 10%
+  """
+  if NbWarmupRequests > 0:
+    await replayRequests(Host, Port, Requests[:NbWarmupRequests], 1)
+  paths = [path for (path, body) in Requests]
+  levels = []
+  for concurrency in ConcurrencyLevels:
+    samples = []
+    counter = [0]
+    stop_event = asyncio.Event()
+    sampler = asyncio.ensure_future(sampleProgress(samples, counter, stop_event, Pid))
+    (latencies, statuses, duration) = await replayRequests(Host, Port, Requests, concurrency, counter)
+    stop_event.set()
+    await sampler
+    samples.append({'time': duration, 'completed': counter[0], 'memory_mb': getMemoryUsage(Pid)})
+    level = summarizeLatencies(latencies, statuses, duration, paths)
+    level['concurrency'] = concurrency
+    level['samples'] = samples
+    levels.append(level)
+  saturation = levels[-1]['concurrency'] if len(levels) > 0 else None
+  for (previous, level) in zip(levels, levels[1:]):
+    if level['throughput'] < 1.1*previous['throughput']:
+      saturation = previous['concurrency']
+      break
+  memory = [sample['memory_mb'] for level in levels for sample in level['samples']]
+  return {'nb_requests': len(Requests), 'levels': levels, 'saturation_concurrency': saturation,
+          'peak_memory_mb': max(memory) if len(memory) > 0 else None}
+
+
+def checkReport(Report, Limits):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Report is returned by runLoadTest, Limits is a dictionary with the keys of DEFAULT_LIMITS (None: not checked)
+  Postconditions: [none]
+  Result: the list of the violated limits (strings), empty if the report passes the regression gate; the latency
+  and throughput limits are checked at every level
+  """
+  violations = []
+  for level in Report['levels']:
+    name = 'concurrency ' + str(level['concurrency'])
+    for (key, limit) in [('p95_ms', Limits.get('max_p95_ms')), ('p99_ms', Limits.get('max_p99_ms'))]:
+      if limit is not None and (level[key] is None or level[key] > limit):
+        violations.append('{0}: {1} = {2} > {3}'.format(name, key, level[key], limit))
+    if Limits.get('min_throughput') is not None and level['throughput'] < Limits['min_throughput']:
+      violations.append('{0}: throughput = {1:.1f} < {2}'.format(name, level['throughput'], Limits['min_throughput']))
+    if Limits.get('max_error_rate') is not None and level['error_rate'] > Limits['max_error_rate']:
+      violations.append('{0}: error rate = {1:.4f} > {2}'.format(name, level['error_rate'], Limits['max_error_rate']))
+  if Limits.get('max_memory_mb') is not None and Report['peak_memory_mb'] is not None and Report['peak_memory_mb'] > Limits['max_memory_mb']:
+    violations.append('peak memory = {0:.1f} MB > {1}'.format(Report['peak_memory_mb'], Limits['max_memory_mb']))
+  return violations
+
+
+def printReport(Report):
+  print('{0:>11} {1:>10} {2:>9} {3:>9} {4:>9} {5:>9} {6:>7} {7:>11}'.format('concurrency', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'errors', 'memory MB'))
+  for level in Report['levels']:
+    print('{0:>11} {1:>10.1f} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>7.2%} {7:>11.1f}'.format(level['concurrency'], level['throughput'],
+          level['p50_ms'] or float('nan'), level['p95_ms'] or float('nan'), level['p99_ms'] or float('nan'), level['max_ms'] or float('nan'),
+          level['error_rate'], max(sample['memory_mb'] for sample in level['samples'])))
+  print('Saturation reached at concurrency', Report['saturation_concurrency'], '; peak memory {0:.1f} MB'.format(Report['peak_memory_mb'] or float('nan')))
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser(description='Load test of the meal planning service (servermodule): replays a mix of '
+                                               'profiles and threshold queries with asyncio clients over loopback, reports '
+                                               'the latency percentiles, throughput and memory, and exits with status 1 if '
+                                               'a limit is exceeded.')
+  parser.add_argument('--url', help='host:port of a running server (default: a server is started in this process)')
+  parser.add_argument('--server-pid', type=int, help='process identifier of the running server, for its memory')
+  parser.add_argument('--requests', type=int, default=500, help='number of requests replayed at each level')
+  parser.add_argument('--warmup', type=int, default=100, help='number of unmeasured requests sent first')
+  parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--kcal-bucket', type=float, default=25.0, help='rounding of the targets of the started server')
+  parser.add_argument('--max-tables', type=int, default=64, help='number of tables kept in memory by the started server')
+  parser.add_argument('--report', help='JSON file in which the report is written')
+  for key in DEFAULT_LIMITS:
+    parser.add_argument('--' + key.replace('_', '-'), type=float, default=DEFAULT_LIMITS[key])
+  parser.add_argument('--test', action='store_true', help='run the unit tests of this module instead')
+  arguments = parser.parse_args()
+
+  if arguments.test:
+
+    import socket
+
+    nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+
+    print('Unit test of makeRequestMix:')
+    requests = makeRequestMix(2000, nutrDB, Seed=3)
+    paths = [path for (path, body) in requests]
+    print(len(requests) == 2000 and requests == makeRequestMix(2000, nutrDB, Seed=3) and requests != makeRequestMix(2000, nutrDB, Seed=4))
+    print(all(abs(paths.count(path)/len(paths) - share) < 0.05 for (path, share) in ENDPOINT_MIX.items()))
+    print(all(body['meal_kcal'] > 0 and sorted(body['extra_quantities']) == sorted(nutrDB.extras) for (path, body) in requests if path != '/energy'))
+    print(all(len(body['env_thresholds']) == 5 and sorted(body['ratings']) == sorted(nutrDB.getAllFoods()) for (path, body) in requests if path in ['/filter', '/topk']))
+    print(all(sorted(body) == ['age', 'body_weight', 'gender', 'height', 'physical_activity_level'] for (path, body) in requests if path == '/energy'))
+    print('')
+
+    print('Unit test of summarizeLatencies:')
+    latencies = np.array([0.001, 0.002, 0.003, 0.004, 0.100, 0.050])
+    statuses = np.array([200, 200, 200, 200, 0, 400])
+    summary = summarizeLatencies(latencies, statuses, 2.0, ['/meals', '/meals', '/topk', '/topk', '/topk', '/filter'])
+    print(summary['count'] == 6 and abs(summary['error_rate'] - 2/6) < 1e-12 and summary['throughput'] == 3.0)
+    print(summary['max_ms'] == 4.0 and abs(summary['p50_ms'] - 2.5) < 1e-9) # the failed requests are not measured
+    print(summary['endpoints']['/meals']['count'] == 2 and summary['endpoints']['/topk']['max_ms'] == 4.0)
+    print(summary['endpoints']['/filter'] == {'count': 1, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None})
+    print(summarizeLatencies(np.zeros(0), np.zeros(0), 0.0, [])['error_rate'] == 0.0)
+    print('')
+
+    print('Unit test of checkReport:')
+    level = dict(summary, concurrency=4, samples=[])
+    report = {'nb_requests': 6, 'levels': [level], 'saturation_concurrency': 4, 'peak_memory_mb': 100.0}
+    print(len(checkReport(report, {})) == 0)
+    print(len(checkReport(report, DEFAULT_LIMITS)) == 1) # error rate
+    print(len(checkReport(report, {'max_p95_ms': 1.0, 'max_p99_ms': 100.0, 'min_throughput': 5.0, 'max_memory_mb': 50.0})) == 3)
+    print(len(checkReport({'levels': [dict(level, p95_ms=None)], 'peak_memory_mb': None}, {'max_p95_ms': 1000.0, 'max_memory_mb': 50.0})) == 1)
+    print('')
+
+    print('Unit test of replayRequests when the server is down:')
+    with socket.socket() as sock:
+      sock.bind(('127.0.0.1', 0))
+      closed_port = sock.getsockname()[1] # nothing listens on this port once the socket is closed
+    (latencies, statuses, duration) = asyncio.run(replayRequests('127.0.0.1', closed_port, requests[:20], 4))
+    print(np.all(statuses == 0))
+
+    async def replayOnDyingServer(Requests, Concurrency):
+      # replays Requests on a server which answers one request with 200, then closes and stops listening
+      async def handle(Reader, Writer):
+        header = await Reader.readuntil(b'\r\n\r\n')
+        length = [int(line.split(b':')[1]) for line in header.split(b'\r\n') if line.lower().startswith(b'content-length:')][0]
+        await Reader.readexactly(length)
+        Writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}')
+        await Writer.drain()
+        server.close()
+        Writer.close()
+      server = await asyncio.start_server(handle, '127.0.0.1', 0)
+      return await replayRequests('127.0.0.1', server.sockets[0].getsockname()[1], Requests, Concurrency)
+
+    (latencies, statuses, duration) = asyncio.run(replayOnDyingServer(requests[:20], 2))
+    print(1 <= np.count_nonzero(statuses == 200) <= 2 and np.count_nonzero(statuses == 0) >= 18)
+    level = dict(summarizeLatencies(latencies, statuses, duration, paths[:20]), concurrency=2, samples=[])
+    print(len(checkReport({'levels': [level], 'peak_memory_mb': None}, DEFAULT_LIMITS)) == 1)
+    sys.exit(0)
+
+  nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+  if arguments.url is None:
+    envDB = envDBmodule.EnvironmentalDatabase('poore2018/DataS2.xlsx')
+    server = servermodule.makeServer(servermodule.MealPlanningService(nutrDB, envDB, arguments.max_tables, arguments.kcal_bucket), Port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    (host, port) = server.server_address[:2]
+    pid = os.getpid()
+  else:
+    (host, port) = arguments.url.rsplit(':', 1)
+    port = int(port)
+    pid = arguments.server_pid
+
+  requests = makeRequestMix(arguments.requests, nutrDB, arguments.seed)
+  report = asyncio.run(runLoadTest(host, port, requests, arguments.concurrency, pid, min(arguments.warmup, len(requests))))
+  printReport(report)
+  if arguments.report is not None:
+    with open(arguments.report, 'w') as f:
+      json.dump(report, f, indent=2)
+
+  violations = checkReport(report, {key: getattr(arguments, key) for key in DEFAULT_LIMITS})
+  for violation in violations:
+    print('FAILED:', violation)
+  sys.exit(1 if len(violations) > 0 else 0)
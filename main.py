@@ -5,14 +5,18 @@
 # External librairies
 
 import os.path
+import bisect
 import calendar
+import itertools
 import random
+import numpy as np
 
 # Local modules
 
 import usermodule
 import nutritionDBmodule
 import envDBmodule
+import enumcachemodule
 import mealmodule
 import myutils
 
@@ -22,36 +26,84 @@ import myutils
 # Function definitions #
 ########################
 
+def computeSuffixLowerBounds(Impacts, NbMealsToAdd):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions: 
+    - Impacts is an (N,5) float array, NbMealsToAdd a non-negative int
+  Postconditions: [none]
+  Result: an array bounds of shape (NbMealsToAdd+1, N+1, 5), where bounds[r, j, d] is the sum of the r smallest
+  values of column d among Impacts[j:] (+inf when fewer than r rows are left). Since impacts are sorted separately
+  in each dimension, this is a lower bound of the impact of any r meals picked among the meals j, j+1, ...
+  """
+  nb_meals = len(Impacts)
+  bounds = np.full((NbMealsToAdd+1, nb_meals+1, 5), np.inf)
+  bounds[0] = 0
+  if NbMealsToAdd == 0:
+    return bounds
+  for d in range(5):
+    smallest = [] # sorted list of the NbMealsToAdd smallest values of the current suffix
+    for j in range(nb_meals-1, -1, -1):
+      bisect.insort(smallest, Impacts[j, d])
+      del smallest[NbMealsToAdd:]
+      partial_sums = list(itertools.accumulate(smallest))
+      bounds[1:len(partial_sums)+1, j, d] = partial_sums
+  return bounds
+
+
+def iterMealSets(Meals, NbMealsPerSet, EnvThresholds):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions: 
+    - Meals is a MealSet (or MealTable) whose meals have their environmental impact computed
+    - NbMealsPerSet is a positive int, EnvThresholds an instance of EnvironmentalImpact
+  Postconditions: [none]
+  Result: a generator yielding, one at a time, every MealSet of NbMealsPerSet distinct meals of Meals whose 
+  meals all have an impact strictly lower than EnvThresholds, and whose total impact is strictly lower than 
+  EnvThresholds. Each combination is produced once, with its meals in the order of Meals. The search shares
+  one running total between the branches and cuts a branch as soon as the total plus the cumulative lower
+  bound of the meals still to add (see computeSuffixLowerBounds) reaches a threshold.
+  """
+  thresholds = np.array(EnvThresholds.toList(), dtype=float)
+  all_impacts = Meals.getImpactArray()
+  restricted = np.flatnonzero(np.all(all_impacts < thresholds, axis=1))
+  impacts = all_impacts[restricted]
+  bounds = computeSuffixLowerBounds(impacts, NbMealsPerSet-1)
+  nb_meals = len(restricted)
+  chosen = []
+
+  def extend(Start, Total):
+    nb_left = NbMealsPerSet - len(chosen) - 1 # meals still to add after the next one
+    # candidates i >= Start such that Total + impact of i + lower bound of nb_left meals after i stays below the thresholds
+    feasible = np.all(Total + impacts[Start:nb_meals] + bounds[nb_left, Start+1:nb_meals+1] < thresholds, axis=1)
+    for i in (Start + np.flatnonzero(feasible)).tolist():
+      chosen.append(i)
+      if nb_left == 0:
+        meal_set = mealmodule.MealSet()
+        meal_set.addMeals([Meals[int(restricted[k])] for k in chosen])
+        yield meal_set
+      else:
+        yield from extend(i+1, Total + impacts[i])
+      chosen.pop()
+
+  if NbMealsPerSet > 0:
+    yield from extend(0, np.zeros(5))
+
+
 def buildMealSets(Meals, NbMealsPerSet, EnvThresholds):
-  meal_sets = []
-  
-  my_stack = []
-  my_restricted_meals = mealmodule.MealSet()
-  for m in Meals.meals:
-    if m.impact < EnvThresholds:
-      my_restricted_meals.addMeal(m)
-      my_meal_set = mealmodule.MealSet()
-      my_meal_set.addMeal(m)
-      my_stack.append(my_meal_set)
-  print(len(my_restricted_meals))
-
-  while len(my_stack)>0:
-    current_set = my_stack.pop()
-    if len(current_set) == NbMealsPerSet:
-      # we have found a complete meal set !
-      meal_sets.append(current_set)
-      print(current_set)
-    else:
-      # keep expanding the current set
-      for m in my_restricted_meals.meals:
-        new_impact = current_set.total_impact + m.impact
-        if new_impact < EnvThresholds:
-          if m not in current_set.meals:
-            new_set = current_set.deepcopy()
-            new_set.addMeal(m)
-            my_stack.append(new_set)
-         
-  return meal_sets
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions: see iterMealSets
+  Postconditions: [none]
+  Result: the list of all the MealSet instances yielded by iterMealSets
+  """
+  return list(iterMealSets(Meals, NbMealsPerSet, EnvThresholds))
 
 
 
@@ -78,7 +130,11 @@ if __name__ == "__main__":
   #user.setRatings(nutrDB)
   user.setExtraQuantities(nutrDB)
   
-  all_valid_meals_with_quantities = nutrDB.enumerateAllPossibleMealsWithQuantities(0.4*daily_energy_req, user.extra_qty_dict)
+  # The valid meals of a target are kept on disk, so that the next users sharing it skip the enumeration; the target
+  # is not rounded, the meals are computed for the exact energy requirement of the user
+  meal_cache = enumcachemodule.EnumerationCache(nutrDB, Directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), enumcachemodule.CACHE_DIR_NAME),
+                                                Rounding=None)
+  all_valid_meals_with_quantities = meal_cache.getMealTable(0.4*daily_energy_req, user.extra_qty_dict)
   print('There are', len(all_valid_meals_with_quantities), 'nutritionnally valid meals.')
 
   #all_valid_meals_with_quantities.computeAllRatings(user.ratings)
@@ -0,0 +1,350 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import os
+import os.path
+import sys
+import csv
+import json
+import math
+import time
+import argparse
+
+
+# Local modules
+
+import usermodule
+import nutritionDBmodule
+import envDBmodule
+import enumcachemodule
+import cohortmodule
+
+
+
+#############
+# Constants #
+#############
+
+# Order of the environmental thresholds, as in EnvironmentalImpact.toList
+THRESHOLD_NAMES = ['land_use', 'GHG_emissions', 'acidifying_emissions', 'eutrophying_emissions', 'water_use']
+
+# Physiological parameters of a profile, as in usermodule.readCohortFile
+PROFILE_PARAMETERS = ['gender', 'age', 'body_weight', 'height', 'physical_activity_level']
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_CONFIG = {'nutrition_database': os.path.join(SOURCE_DIRECTORY, 'poore2018', 'TableS1_augmented_with_FAO_data.xlsx'),
+                  'environmental_database': os.path.join(SOURCE_DIRECTORY, 'poore2018', 'DataS2.xlsx'),
+                  'cache_directory': os.path.join(SOURCE_DIRECTORY, enumcachemodule.CACHE_DIR_NAME),
+                  'output_directory': 'results',
+                  'kcal_bucket': cohortmodule.KCAL_BUCKET,
+                  'minimal_meal_rating': None,
+                  'defaults': {},
+                  'profiles': [],
+                  'profiles_csv': None}
+
+
+
+########################
+# Function definitions #
+########################
+
+def loadConfig(Filename):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Filename is a JSON file (.json) or a TOML file (.toml) containing a table with the keys of DEFAULT_CONFIG
+      (all optional): the paths of the databases, of the enumeration cache (None to disable its disk tier),
+      of the output directory and of a CSV file of profiles (see loadProfiles), the kcal bucket and minimal
+      meal rating of the CohortPlanner, the 'defaults' of the profiles and the list of 'profiles'
+  Postconditions:
+    - a ValueError exception is thrown if the file cannot be parsed or contains unknown keys
+    - the relative paths of the file are interpreted relatively to the directory of the file
+  Result: a dictionary containing every key of DEFAULT_CONFIG
+  """
+  with open(Filename, 'rb') as f:
+    try:
+      if Filename.lower().endswith('.toml'):
+        import tomllib # Python 3.11 or later
+        values = tomllib.load(f)
+      else:
+        values = json.loads(f.read().decode('utf-8'))
+    except ValueError as e:
+      raise ValueError('Could not parse ' + Filename + ': ' + str(e))
+  if not isinstance(values, dict):
+    raise ValueError('The configuration file ' + Filename + ' should contain a table.')
+  unknown_keys = [key for key in values if key not in DEFAULT_CONFIG]
+  if len(unknown_keys) > 0:
+    raise ValueError('Unknown keys in ' + Filename + ': ' + ', '.join(unknown_keys))
+  config = dict(DEFAULT_CONFIG)
+  config.update(values)
+  base_directory = os.path.dirname(os.path.abspath(Filename))
+  for key in ['nutrition_database', 'environmental_database', 'cache_directory', 'output_directory', 'profiles_csv']:
+    if key in values and values[key] is not None:
+      config[key] = os.path.join(base_directory, values[key])
+  return config
+
+
+def loadProfiles(Config):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Config is a dictionary returned by loadConfig; if Config['profiles_csv'] is not None, it is a CSV file with
+      a header line containing the columns of PROFILE_PARAMETERS and optionally a column name
+  Postconditions:
+    - a ValueError exception is thrown if the CSV file misses a column or if two profiles have the same name
+  Result: the list of the profiles (dictionaries) of Config['profiles'] followed by those of the CSV file, each of
+  them having a 'name' (by default, 'profile' followed by its position)
+  """
+  profiles = [dict(profile) for profile in Config['profiles']]
+  if Config['profiles_csv'] is not None:
+    with open(Config['profiles_csv'], newline='') as f:
+      reader = csv.DictReader(f)
+      missing = [column for column in PROFILE_PARAMETERS if column not in (reader.fieldnames or [])]
+      if len(missing) > 0:
+        raise ValueError('Missing columns in ' + Config['profiles_csv'] + ': ' + ', '.join(missing))
+      for line in reader:
+        profiles.append({column: line[column] for column in ['name'] + PROFILE_PARAMETERS if line.get(column)})
+  for (i, profile) in enumerate(profiles):
+    profile.setdefault('name', 'profile' + str(i))
+    profile['name'] = str(profile['name'])
+  names = [profile['name'] for profile in profiles]
+  if len(set(names)) != len(names):
+    raise ValueError('Several profiles have the same name.')
+  return profiles
+
+
+def makeUser(Profile, Defaults, NutrDB):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Profile and Defaults are dictionaries that may contain the keys of PROFILE_PARAMETERS, 'extra_quantities'
+      (a dictionary of the serving sizes of the extras), 'ratings' (a dictionary of the ratings of the foods,
+      which are finite numbers) and 'env_thresholds' (a list of 5 floats or a dictionary whose keys are
+      THRESHOLD_NAMES); the values of Profile take precedence over those of Defaults
+  Postconditions:
+    - nothing is asked to the user and no file is read or written (unlike the User.set* methods)
+  Result: a tuple (user, error): an instance of class User and None, or None and a string describing why the
+  profile is not valid (the physiological parameters themselves are checked by computeCohortEnergyRequirements)
+  """
+  values = dict(Defaults)
+  values.update(Profile)
+  user = usermodule.User()
+  for parameter in PROFILE_PARAMETERS:
+    if parameter not in values:
+      return (None, 'Missing ' + parameter + '.')
+    setattr(user, parameter, values[parameter])
+  for parameter in ['age', 'body_weight', 'height']:
+    try:
+      setattr(user, parameter, float(values[parameter]))
+    except (TypeError, ValueError):
+      return (None, 'Invalid ' + parameter + '.')
+  extra_qty_dict = values.get('extra_quantities', {})
+  if not isinstance(extra_qty_dict, dict):
+    return (None, 'Invalid extra quantities.')
+  missing_extras = [extra for extra in NutrDB.extras if extra not in extra_qty_dict]
+  if len(missing_extras) > 0:
+    return (None, 'Missing extra quantities: ' + ', '.join(missing_extras) + '.')
+  try:
+    user.extra_qty_dict = {extra: float(extra_qty_dict[extra]) for extra in NutrDB.extras}
+  except (TypeError, ValueError):
+    return (None, 'Invalid extra quantities.')
+  ratings = values.get('ratings', {})
+  if not isinstance(ratings, dict):
+    return (None, 'Invalid ratings.')
+  for rating in ratings.values():
+    # a rating is a finite number, as in servermodule (booleans are not numbers)
+    if isinstance(rating, bool) or not isinstance(rating, (int, float)):
+      return (None, 'Invalid ratings.')
+    try:
+      if not math.isfinite(rating):
+        return (None, 'Invalid ratings.')
+    except OverflowError:
+      return (None, 'Invalid ratings.')
+  user.ratings = dict(ratings)
+  thresholds = values.get('env_thresholds')
+  if thresholds is not None:
+    if isinstance(thresholds, dict):
+      if any(name not in thresholds for name in THRESHOLD_NAMES):
+        return (None, 'The environmental thresholds should define ' + ', '.join(THRESHOLD_NAMES) + '.')
+      thresholds = [thresholds[name] for name in THRESHOLD_NAMES]
+    try:
+      if isinstance(thresholds, str):
+        raise ValueError(thresholds)
+      if len(thresholds) != len(THRESHOLD_NAMES):
+        return (None, 'The environmental thresholds should be a list of 5 floats.')
+      user.env_thresholds = envDBmodule.EnvironmentalImpact([float(value) for value in thresholds])
+    except (TypeError, ValueError):
+      return (None, 'Invalid env_thresholds.')
+  return (user, None)
+
+
+def runBatch(Config):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Config is a dictionary returned by loadConfig
+  Postconditions:
+    - the databases are loaded once and all the valid profiles are planned with a CohortPlanner: the meals of
+      each of them are written in <name>.txt in Config['output_directory'], and a summary of every profile
+      (energy requirement, exact and planned meal targets, number of meals or error) in summary.json
+    - nothing is asked to the user and nothing is plotted
+  Result: the list of the results of the profiles (see CohortPlanner.planUsers), in the order of loadProfiles
+  """
+  start = time.time()
+  nutrDB = nutritionDBmodule.NutritionDatabase(Config['nutrition_database'])
+  envDB = envDBmodule.EnvironmentalDatabase(Config['environmental_database'])
+  if not nutrDB.isComplete() or not nutrDB.isConsistent() or not envDB.isConsistentWith(nutrDB):
+    raise ValueError('The nutritional and environmental databases are not consistent.')
+  profiles = loadProfiles(Config)
+  users = []
+  errors = []
+  for profile in profiles:
+    (user, error) = makeUser(profile, Config['defaults'], nutrDB)
+    errors.append(error)
+    if user is not None:
+      users.append(user)
+  planner = cohortmodule.CohortPlanner(nutrDB, envDB, Config['kcal_bucket'], Config['cache_directory'])
+  names = [profile['name'] for (profile, error) in zip(profiles, errors) if error is None]
+  planned = iter(planner.planUsers(users, Config['output_directory'], names, Config['minimal_meal_rating']))
+  results = [next(planned) if error is None else {'name': profile['name'], 'error': error} for (profile, error) in zip(profiles, errors)]
+  for result in results:
+    for key in ['daily_energy', 'meal_kcal', 'planned_kcal']:
+      if key in result and math.isnan(result[key]):
+        result[key] = None # JSON has no NaN
+  summary = {'nb_profiles': len(results), 'nb_errors': sum(1 for result in results if 'error' in result),
+             'duration': time.time() - start, 'cache': planner.cache.getStatistics(), 'profiles': results}
+  with open(os.path.join(Config['output_directory'], 'summary.json'), 'w') as f:
+    json.dump(summary, f, indent=2)
+  return results
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser(description='Plans the meals of many profiles without any interaction: the profiles, '
+                                               'their extra quantities, ratings and environmental thresholds are read from a '
+                                               'configuration file, and the results are written in an output directory.')
+  parser.add_argument('config', nargs='?', help='JSON (.json) or TOML (.toml) configuration file')
+  parser.add_argument('--output-directory', help='directory of the results (overrides the configuration file)')
+  parser.add_argument('--profiles-csv', help='CSV file of additional profiles (overrides the configuration file)')
+  parser.add_argument('--no-cache', action='store_true', help='do not keep the enumerated meals on disk')
+  parser.add_argument('--test', action='store_true', help='run the unit tests of this module instead')
+  arguments = parser.parse_args()
+
+  if arguments.test:
+
+    import shutil
+    import tempfile
+
+    nutrDB = nutritionDBmodule.NutritionDatabase(DEFAULT_CONFIG['nutrition_database'])
+    extra_qty_dict = {extra: 0.010 for extra in nutrDB.extras}
+    profile = {'name': 'a', 'gender': 'F', 'age': 30, 'body_weight': 60, 'height': 165, 'physical_activity_level': 'light'}
+    directory = tempfile.mkdtemp()
+
+    print('Unit test of loadConfig:')
+    with open(os.path.join(directory, 'config.json'), 'w') as f:
+      json.dump({'output_directory': 'out', 'kcal_bucket': 25, 'profiles': [profile]}, f)
+    config = loadConfig(os.path.join(directory, 'config.json'))
+    print(config['output_directory'] == os.path.join(directory, 'out') and config['kcal_bucket'] == 25)
+    print(config['nutrition_database'] == DEFAULT_CONFIG['nutrition_database'] and config['defaults'] == {})
+    with open(os.path.join(directory, 'config.toml'), 'w') as f:
+      f.write('minimal_meal_rating = 15\n[defaults]\nphysical_activity_level = "light"\n')
+    config_toml = loadConfig(os.path.join(directory, 'config.toml'))
+    print(config_toml['minimal_meal_rating'] == 15 and config_toml['defaults'] == {'physical_activity_level': 'light'})
+    for (name, content) in [('unknown.json', '{"output_dir": "out"}'), ('invalid.json', '{"profiles": ['), ('list.json', '[1, 2]')]:
+      with open(os.path.join(directory, name), 'w') as f:
+        f.write(content)
+      try:
+        loadConfig(os.path.join(directory, name))
+        print(False)
+      except ValueError:
+        print(True)
+    print('')
+
+    print('Unit test of loadProfiles:')
+    with open(os.path.join(directory, 'profiles.csv'), 'w') as f:
+      f.write('name,gender,age,body_weight,height,physical_activity_level\nb,M,40,80,180,moderate\n,F,25,55,160,light\n')
+    config['profiles_csv'] = os.path.join(directory, 'profiles.csv')
+    profiles = loadProfiles(config)
+    print([p['name'] for p in profiles] == ['a', 'b', 'profile2'] and profiles[1]['age'] == '40')
+    config['profiles'] = [profile, {'name': 'b'}]
+    try:
+      loadProfiles(config)
+      print(False)
+    except ValueError:
+      print(True)
+    with open(os.path.join(directory, 'incomplete.csv'), 'w') as f:
+      f.write('name,gender,age\nc,F,30\n')
+    try:
+      loadProfiles({'profiles': [], 'profiles_csv': os.path.join(directory, 'incomplete.csv')})
+      print(False)
+    except ValueError:
+      print(True)
+    print('')
+
+    print('Unit test of makeUser:')
+    (user, error) = makeUser(dict(profile, env_thresholds={name: 1.0 for name in THRESHOLD_NAMES}), {'extra_quantities': extra_qty_dict}, nutrDB)
+    print(error is None and user.age == 30.0 and user.extra_qty_dict == extra_qty_dict and user.env_thresholds.toList() == [1.0]*5)
+    print(makeUser(dict(profile, age='old'), {'extra_quantities': extra_qty_dict}, nutrDB) == (None, 'Invalid age.'))
+    print(makeUser({'name': 'c'}, {}, nutrDB) == (None, 'Missing gender.'))
+    print(makeUser(profile, {}, nutrDB)[1].startswith('Missing extra quantities'))
+    invalid_extras = dict(extra_qty_dict)
+    invalid_extras[nutrDB.extras[0]] = 'a spoon'
+    print(makeUser(dict(profile, extra_quantities=invalid_extras), {}, nutrDB) == (None, 'Invalid extra quantities.'))
+    print(makeUser(dict(profile, extra_quantities=[0.01]), {}, nutrDB) == (None, 'Invalid extra quantities.'))
+    for thresholds in [[1, 2, 'x', 4, 5], 7, '12345', {name: None for name in THRESHOLD_NAMES}]:
+      print(makeUser(dict(profile, env_thresholds=thresholds), {'extra_quantities': extra_qty_dict}, nutrDB) == (None, 'Invalid env_thresholds.'))
+    print(makeUser(dict(profile, env_thresholds=[1, 2, 3]), {'extra_quantities': extra_qty_dict}, nutrDB)[1].endswith('list of 5 floats.'))
+    for ratings in [{'Rice': 'x'}, {'Rice': True}, {'Rice': float('nan')}, {'Rice': float('inf')}, {'Rice': None}, [3]]:
+      print(makeUser(dict(profile, ratings=ratings), {'extra_quantities': extra_qty_dict}, nutrDB) == (None, 'Invalid ratings.'))
+    print(makeUser(dict(profile, ratings={'Rice': 3, 'Coffee': 0.5}), {'extra_quantities': extra_qty_dict}, nutrDB)[0].ratings == {'Rice': 3, 'Coffee': 0.5})
+    print('')
+
+    print('Unit test of runBatch with an invalid profile:')
+    config = dict(DEFAULT_CONFIG)
+    config.update({'output_directory': os.path.join(directory, 'results'), 'cache_directory': None,
+                   'defaults': {'extra_quantities': extra_qty_dict},
+                   'profiles': [profile, dict(profile, name='b', env_thresholds=[1, 2, 'x', 4, 5])]})
+    results = runBatch(config)
+    print(results[0]['nb_meals'] > 0 and os.path.isfile(results[0]['output_file']))
+    print(results[1] == {'name': 'b', 'error': 'Invalid env_thresholds.'})
+    with open(os.path.join(directory, 'results', 'summary.json')) as f:
+      print(json.load(f)['nb_errors'] == 1)
+    shutil.rmtree(directory)
+    sys.exit(0)
+
+  if arguments.config is None:
+    parser.error('the following arguments are required: config')
+
+  try:
+    config = loadConfig(arguments.config)
+    if arguments.output_directory is not None:
+      config['output_directory'] = arguments.output_directory
+    if arguments.profiles_csv is not None:
+      config['profiles_csv'] = arguments.profiles_csv
+    if arguments.no_cache:
+      config['cache_directory'] = None
+    results = runBatch(config)
+  except (OSError, ValueError) as e:
+    print('Error:', e, file=sys.stderr)
+    sys.exit(2)
+
+  nb_errors = sum(1 for result in results if 'error' in result)
+  print(len(results) - nb_errors, 'profiles planned,', nb_errors, 'errors; results written in', config['output_directory'])
+  sys.exit(1 if nb_errors > 0 else 0)
@@ -7,14 +7,15 @@
 
 import os.path
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+# matplotlib is only imported by drawImpactHistograms, so that headless computations do not pay for it
 
 # Local modules
 
 import myutils
 import nutritionDBmodule
 import envDBmodule
+import mealtablemodule
+import topkmodule
 
 
 ##############
@@ -95,6 +96,8 @@ class Meal(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Each meal component must exist as a key in NutrDB
+      - The protein, carb and fat sources of the meal must belong to NutrDB.protein_sources, NutrDB.carb_sources
+        and NutrDB.fat_sources respectively (their inverse is taken from NutrDB.getTripleInverse)
       - The extra must exist as a key in ExtraQtyDict
     Postconditions: 
       - self.is_nutritionally_valid is set to True if we can reach if MealKcalTarget with 
@@ -139,19 +142,23 @@ class Meal(object):
     # 4*(carb_from_prot_source + carb_from_carb_source + carb_from_fat_source + carb_from_vegetable + carb_from_fruit + carb_from_extra) = 0.63*MealKcalTarget
     # 8.8*(fat_from_prot_source + fat_from_carb_source + fat_from_fat_source + fat_from_vegetable + fat_from_fruit + fat_from_extra) = 0.25*MealKcalTarget
 
-    a = np.array([ [ 4*NutrDB.getGProt(self.protein_source), 4*NutrDB.getGProt(self.carb_source), 4*NutrDB.getGProt(self.fat_source) ],
-                   [ 4*NutrDB.getGCarb(self.protein_source), 4*NutrDB.getGCarb(self.carb_source), 4*NutrDB.getGCarb(self.fat_source) ],
-                   [ 8.8*NutrDB.getGFat(self.protein_source), 8.8*NutrDB.getGFat(self.carb_source), 8.8*NutrDB.getGFat(self.fat_source) ] ])
-    b = np.array([ 0.15*MealKcalTarget - 4*prot_from_vegetable - 4*prot_from_fruit - 4*prot_from_extra,
-                   0.55*MealKcalTarget - 4*carb_from_vegetable - 4*carb_from_fruit - 4*carb_from_extra,
-                   0.30*MealKcalTarget - 8.8*fat_from_vegetable - 8.8*fat_from_fruit - 8.8*fat_from_extra])
-    x = np.linalg.solve(a, b)
+    # The matrix a of this system only depends on the protein, carb and fat sources:
+    # a = [ [ 4*gProt(protein_source), 4*gProt(carb_source), 4*gProt(fat_source) ],
+    #       [ 4*gCarb(protein_source), 4*gCarb(carb_source), 4*gCarb(fat_source) ],
+    #       [ 8.8*gFat(protein_source), 8.8*gFat(carb_source), 8.8*gFat(fat_source) ] ]
+    # so its inverse is computed once per database (NaN if a is singular) and x = inverse.b
+    inverse = NutrDB.getTripleInverse(self.protein_source, self.carb_source, self.fat_source)
+    b = [ 0.15*MealKcalTarget - 4*prot_from_vegetable - 4*prot_from_fruit - 4*prot_from_extra,
+          0.55*MealKcalTarget - 4*carb_from_vegetable - 4*carb_from_fruit - 4*carb_from_extra,
+          0.30*MealKcalTarget - 8.8*fat_from_vegetable - 8.8*fat_from_fruit - 8.8*fat_from_extra ]
+    x = nutritionDBmodule.applyInverse(inverse, b)
 
     prot_source_qty = x[0]
     carb_source_qty = x[1]
     fat_source_qty = x[2]
 
-    if prot_source_qty < 0 or carb_source_qty < 0 or fat_source_qty < 0:
+    # a NaN quantity (singular system) fails these comparisons, so the meal is not valid
+    if not (prot_source_qty >= 0 and carb_source_qty >= 0 and fat_source_qty >= 0):
       self.is_nutritionally_valid = False
       # and we leave the self...._qty to None
     else:
@@ -195,10 +202,10 @@ class Meal(object):
     
     print(hrule)
 
-    sum_kcal = NutrDB.getKcal(self.protein_source, self.protein_source_qty) + NutrDB.getKcal(self.carb_source, self.carb_source_qty) + NutrDB.getKcal(self.fat_source, self.fat_source_qty) + NutrDB.getKcal(self.vegetable, self.vegetable_qty) + NutrDB.getKcal(self.fruit, self.fruit_qty) + NutrDB.getKcal(self.extra, self.extra_qty)  
-    sum_gprot = NutrDB.getGProt(self.protein_source, self.protein_source_qty) + NutrDB.getGProt(self.carb_source, self.carb_source_qty) + NutrDB.getGProt(self.fat_source, self.fat_source_qty) + NutrDB.getGProt(self.vegetable, self.vegetable_qty) + NutrDB.getGProt(self.fruit, self.fruit_qty) + NutrDB.getGProt(self.extra, self.extra_qty)  
-    sum_gcarb = NutrDB.getGCarb(self.protein_source, self.protein_source_qty) + NutrDB.getGCarb(self.carb_source, self.carb_source_qty) + NutrDB.getGCarb(self.fat_source, self.fat_source_qty) + NutrDB.getGCarb(self.vegetable, self.vegetable_qty) + NutrDB.getGCarb(self.fruit, self.fruit_qty) + NutrDB.getGCarb(self.extra, self.extra_qty)  
-    sum_gfat = NutrDB.getGFat(self.protein_source, self.protein_source_qty) + NutrDB.getGFat(self.carb_source, self.carb_source_qty) + NutrDB.getGFat(self.fat_source, self.fat_source_qty) + NutrDB.getGFat(self.vegetable, self.vegetable_qty) + NutrDB.getGFat(self.fruit, self.fruit_qty) + NutrDB.getGFat(self.extra, self.extra_qty)  
+    # One product of the quantities with the rows of the nutrient matrix of the meal foods
+    food_table = NutrDB.food_table
+    nutrients = food_table.nutrients[food_table.getIds(self.getFoods())]
+    (sum_kcal, sum_gprot, sum_gcarb, sum_gfat) = np.dot(np.array(self.getQuantities(), dtype=float), nutrients).tolist()
 
     template = 'TOTAL:' + 42*' ' + '{0:5.0f} kcal, {1:5.1f} g protein, {2:5.1f} g carb, {3:5.1f} g fat'
     print(template.format(sum_kcal, sum_gprot, sum_gcarb, sum_gfat))
@@ -212,27 +219,16 @@ class Meal(object):
     Parameters passed in data/result mode: [none]
     Parameters passed in result mode: [none]
     Preconditions: 
-      - each food of the meal must exist as a key in EnvDB
+      - each food of the meal must exist in EnvDB.food_table
       - the quantities of each food must have been defined
     Postconditions: 
       - self.impact contains the 5D environmental assessement of the meal (EnvironmentalImpact object) 
     Result: [none]
     """
-    land_use = 0
-    ghg = 0
-    acid = 0
-    eutroph = 0
-    water = 0
-    quantities = self.getQuantities()
-    foods = self.getFoods()
-    for i, food in enumerate(foods):
-      qty = quantities[i]
-      land_use += EnvDB.getLandUse(food, qty)
-      ghg += EnvDB.getGHGEmissions(food, qty)
-      acid += EnvDB.getAcidifyingEmissions(food, qty)
-      eutroph += EnvDB.getEutrophyingEmissions(food, qty)
-      water += EnvDB.getWaterUse(food, qty)
-    self.impact = envDBmodule.EnvironmentalImpact([land_use, ghg, acid, eutroph, water])
+    # One product of the quantities with the rows of the impact matrix of the meal foods
+    food_table = EnvDB.food_table
+    impacts = food_table.impacts[food_table.getIds(self.getFoods())]
+    self.impact = envDBmodule.EnvironmentalImpact(np.dot(np.array(self.getQuantities(), dtype=float), impacts).tolist())
 
 
 
@@ -444,6 +440,47 @@ class MealSet(object):
       self.total_impact = self.total_impact + m.impact
       self.total_rating = self.total_rating + m.rating
 
+  def getImpactArray(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: an (N,5) float array whose row i is self.meals[i].impact.toList()
+    """
+    return np.array([meal.impact.toList() for meal in self.meals], dtype=float).reshape(len(self.meals), 5)
+
+  def getFoodIndexArray(self, Foods):
+    """
+    Parameters passed in data mode: self, Foods
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - each food of each meal exists in the list Foods (a KeyError is raised otherwise)
+    Postconditions: [none]
+    Result: an (N,6) int array whose row i contains the positions in Foods of the foods of self.meals[i]
+    """
+    food_ids = {food: i for (i, food) in enumerate(Foods)}
+    return np.array([[food_ids[food] for food in meal.getFoods()] for meal in self.meals], dtype=np.intp).reshape(len(self.meals), 6)
+
+  def selectMeals(self, Mask):
+    """
+    Parameters passed in data mode: self, Mask
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - Mask is a list or array of len(self) Booleans
+    Postconditions: [none]
+    Result: a new MealSet containing the meals of self for which Mask is True, whose total impact and 
+    total rating are computed with one reduction each (instead of one addMeal per meal)
+    """
+    new_set = MealSet()
+    new_set.meals = [meal for (meal, keep) in zip(self.meals, np.asarray(Mask).tolist()) if keep]
+    new_set.total_impact = envDBmodule.EnvironmentalImpact(np.sum(new_set.getImpactArray(), axis=0).tolist())
+    new_set.total_rating = sum([meal.rating for meal in new_set.meals])
+    return new_set
+
   def saveToFile(self, Filename):
     """
     Parameters passed in data mode: self, Filename
@@ -466,17 +503,29 @@ class MealSet(object):
         output_file.write('\n')
 
 
-  def computeAllEnvironmentalImpacts(self, EnvDB):
+  def computeAllEnvironmentalImpacts(self, EnvDB, Batch=True):
     """
-    Parameters passed in data mode: EnvDB
+    Parameters passed in data mode: EnvDB, Batch
     Parameters passed in data/result mode: self
     Parameters passed in result mode: [none]
     Preconditions: 
      - each meal in self.meals must have its quantities set
     Postconditions: 
      - each meal has its environmental impact computed
+     - if Batch is True (default), the impacts of all meals are computed at once as an (N,5) array
+       (see mealtablemodule.computeImpactArray) and the total impact with a single reduction;
+       otherwise, Meal.computeEnvironmentalImpact is called for each meal
     Result: [none]
     """
+    if Batch:
+      food_table = EnvDB.food_table
+      food_indices = np.array([[food_table.food_ids[food] for food in meal.getFoods()] for meal in self.meals], dtype=np.intp).reshape(len(self.meals), 6)
+      quantities = np.array([meal.getQuantities() for meal in self.meals], dtype=float).reshape(len(self.meals), 6)
+      impacts = mealtablemodule.computeImpactArray(food_indices, quantities, food_table.impacts)
+      for (meal, impact) in zip(self.meals, impacts.tolist()):
+        meal.impact = envDBmodule.EnvironmentalImpact(impact)
+      self.total_impact = envDBmodule.EnvironmentalImpact(np.sum(impacts, axis=0).tolist())
+      return
     self.total_impact = envDBmodule.EnvironmentalImpact()
     for meal in self.meals:
       meal.computeEnvironmentalImpact(EnvDB)
@@ -495,39 +544,7 @@ class MealSet(object):
     Postconditions: A window opens, containing five histograms, one for each environmental indicator.
     Result: None
     """
-    impacts = []
-    for meal in self.meals:
-      impacts.append(meal.impact.toList())
-
-    df = pd.DataFrame(impacts, columns=['LandUse', 'GHGEmissions', 'AcidifyingEmissions', 'EutrophyingEmissions', 'WaterUse'])
-    myfig = plt.figure(figsize=(10, 10))
-    
-    axs = myfig.add_subplot(3, 2, 1)
-    axs.hist(df['LandUse'])
-    axs.set_xlabel('Land use (square meters)')
-
-
-    axs = myfig.add_subplot(3, 2, 2)
-    axs.hist(df['GHGEmissions'])
-    axs.set_xlabel('Greenhouse gas emissions (kg CO2 eq.)')
-
-    axs = myfig.add_subplot(3, 2, 3)
-    axs.hist(df['AcidifyingEmissions'])
-    axs.set_xlabel('Acidifying emissions (g SO2 eq.)')
-
-    axs = myfig.add_subplot(3, 2, 4)
-    axs.hist(df['EutrophyingEmissions'])
-    axs.set_xlabel('Eutrophying emissions (g PO43- eq.)')
-
-    axs = myfig.add_subplot(3, 2, 5)
-    axs.hist(df['WaterUse'])
-    axs.set_xlabel('Stress-weighted water use (L)')
-
-    if Type == 'standalone':
-      plt.show()
-      return None
-    elif Type == 'embedded':
-      return myfig
+    return drawImpactHistograms(self.getImpactArray(), Type)
 
 
   def filterBasedOnEnvironmentalImpact(self, Thresholds):
@@ -541,11 +558,8 @@ class MealSet(object):
     Postconditions: [none]
     Result: A MealSet containing the subset of self.meals whose impact is lower than Thresholds
     """
-    winning_meals = MealSet()
-    for meal in self.meals:
-      if meal.isEnvironmentFriendly(Thresholds):
-        winning_meals.addMeal(meal)
-    return winning_meals
+    mask = mealtablemodule.environmentFriendlyMask(self.getImpactArray(), Thresholds)
+    return self.selectMeals(mask)
 
 
   def computeAllRatings(self, FoodRatings):
@@ -560,10 +574,11 @@ class MealSet(object):
      - the mealset (self) has its total_rating computed
     Result: [none]
     """
-    self.total_rating = 0
-    for meal in self.meals:
-      meal.computeRating(FoodRatings)
-      self.total_rating = self.total_rating + meal.rating
+    foods = list(FoodRatings)
+    ratings = mealtablemodule.computeRatingArray(self.getFoodIndexArray(foods), mealtablemodule.foodRatingVector(foods, FoodRatings))
+    for (meal, rating) in zip(self.meals, ratings.tolist()):
+      meal.rating = rating
+    self.total_rating = sum(ratings.tolist())
 
 
   def filterBasedOnUserVeto(self, FoodRatings):
@@ -576,11 +591,10 @@ class MealSet(object):
     Postconditions: [none]
     Result: A MealSet containing the subset of self.meals that do not contain a 0-rated food
     """
-    winning_meals = MealSet()
-    for meal in self.meals:
-      if (not meal.containsAVetoedFood(FoodRatings)):
-        winning_meals.addMeal(meal)
-    return winning_meals
+    foods = list(FoodRatings)
+    vetoed_foods = (mealtablemodule.foodRatingVector(foods, FoodRatings) <= 0)
+    mask = ~np.any(vetoed_foods[self.getFoodIndexArray(foods)], axis=1)
+    return self.selectMeals(mask)
 
 
   def filterBasedOnMinimalMealSatisfaction(self, FoodRatings, MinimalMealRating):
@@ -595,11 +609,79 @@ class MealSet(object):
     equal to MinimalMealRating
     """
     self.computeAllRatings(FoodRatings)
-    winning_meals = MealSet()
-    for meal in self.meals:
-      if meal.rating >= MinimalMealRating:
-        winning_meals.addMeal(meal)
-    return winning_meals
+    mask = np.array([meal.rating for meal in self.meals], dtype=float) >= MinimalMealRating
+    return self.selectMeals(mask)
+
+
+  def getTopMeals(self, K, Weights, RatingWeight=0.0, Scales=None):
+    """
+    Parameters passed in data mode: self, K, Weights, RatingWeight, Scales
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - each meal in self.meals has its environmental impact computed (and its rating, if RatingWeight is not 0)
+     - Weights is a list of 5 non-negative floats, the weight of each indicator (same order as EnvironmentalImpact.toList())
+     - if specified, Scales is a list of 5 positive floats; by default, the mean impacts of the meals of self
+    Postconditions: [none]
+    Result: A MealSet containing the K meals of self with the lowest score (see topkmodule.computeScores: weighted
+    sum of the normalized impacts, minus RatingWeight times the normalized rating), sorted by increasing score
+    """
+    impacts = self.getImpactArray()
+    if Scales is None:
+      Scales = topkmodule.computeImpactScales(impacts)
+    ratings = np.array([meal.rating for meal in self.meals], dtype=float)
+    best = topkmodule.selectTopK(topkmodule.computeScores(impacts, Weights, Scales, ratings, RatingWeight), K)
+    top_meals = MealSet()
+    top_meals.meals = [self.meals[i] for i in best.tolist()]
+    top_meals.total_impact = envDBmodule.EnvironmentalImpact(np.sum(impacts[best], axis=0).tolist())
+    top_meals.total_rating = sum(ratings[best].tolist())
+    return top_meals
+
+
+########################
+# Function definitions #
+########################
+
+def drawImpactHistograms(Impacts, Type='standalone'):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions: 
+   - Impacts is an (N,5) array of meal impacts, with the same columns as EnvironmentalImpact.toList()
+  Postconditions: A window opens (if Type is 'standalone'), containing five histograms, one for each environmental indicator.
+  Result: None if Type is 'standalone', the matplotlib figure if Type is 'embedded'
+  """
+  import matplotlib.pyplot as plt
+  impacts = np.asarray(Impacts, dtype=float).reshape(-1, 5)
+  myfig = plt.figure(figsize=(10, 10))
+  
+  axs = myfig.add_subplot(3, 2, 1)
+  axs.hist(impacts[:, 0])
+  axs.set_xlabel('Land use (square meters)')
+
+
+  axs = myfig.add_subplot(3, 2, 2)
+  axs.hist(impacts[:, 1])
+  axs.set_xlabel('Greenhouse gas emissions (kg CO2 eq.)')
+
+  axs = myfig.add_subplot(3, 2, 3)
+  axs.hist(impacts[:, 2])
+  axs.set_xlabel('Acidifying emissions (g SO2 eq.)')
+
+  axs = myfig.add_subplot(3, 2, 4)
+  axs.hist(impacts[:, 3])
+  axs.set_xlabel('Eutrophying emissions (g PO43- eq.)')
+
+  axs = myfig.add_subplot(3, 2, 5)
+  axs.hist(impacts[:, 4])
+  axs.set_xlabel('Stress-weighted water use (L)')
+
+  if Type == 'standalone':
+    plt.show()
+    return None
+  elif Type == 'embedded':
+    return myfig
 
 
 ################
@@ -648,3 +730,54 @@ if __name__ == "__main__":
   # or, equivalently (procedural style): Meal.computeQuantities(my_meal, 0.4*daily_energy_req, extra_qty_dict)
   my_quantities = my_meal.getQuantities()
   print(myutils.approxEqualVect(my_quantities, [0.027161553, 0.1980991333, 0.01421888129, 0.125, 0.05, 0.008], releps, abseps))
+
+
+  print('Unit test of the batch path of MealSet.computeAllEnvironmentalImpacts:')
+  batch_meals = nutrDB.enumerateAllPossibleMealsWithQuantities(0.4*daily_energy_req, extra_qty_dict)
+  scalar_meals = nutrDB.enumerateAllPossibleMealsWithQuantities(0.4*daily_energy_req, extra_qty_dict)
+  batch_meals.computeAllEnvironmentalImpacts(envDB)
+  scalar_meals.computeAllEnvironmentalImpacts(envDB, Batch=False)
+  print(all(m1.impact == m2.impact for (m1, m2) in zip(batch_meals.meals, scalar_meals.meals)))
+  print(batch_meals.total_impact == scalar_meals.total_impact)
+  print('')
+
+
+  print('Unit test of the mask-based MealSet filters:')
+  my_ratings = {food: 3 for food in nutrDB.getAllFoods()}
+  my_ratings['Coffee'] = 0
+  my_ratings['Tofu'] = 5
+  not_vetoed = batch_meals.filterBasedOnUserVeto(my_ratings)
+  print(len(not_vetoed) == len([m for m in batch_meals.meals if not m.containsAVetoedFood(my_ratings)]))
+  liked = not_vetoed.filterBasedOnMinimalMealSatisfaction(my_ratings, 19)
+  print(len(liked) == len([m for m in not_vetoed.meals if m.protein_source == 'Tofu']))
+  my_thresholds = envDBmodule.EnvironmentalImpact([2.0, 1.5, 15.0, 10.0, 3000])
+  friendly = batch_meals.filterBasedOnEnvironmentalImpact(my_thresholds)
+  print(len(friendly) == len([m for m in batch_meals.meals if m.isEnvironmentFriendly(my_thresholds)]))
+  print('')
+
+
+  print('Unit test of MealSet.getTopMeals:')
+  batch_meals.computeAllRatings(my_ratings)
+  top_meals = batch_meals.getTopMeals(5, [0, 1, 0, 0, 0])
+  ghg = sorted(meal.impact.GHG_emissions for meal in batch_meals.meals)
+  print([meal.impact.GHG_emissions for meal in top_meals.meals] == ghg[:5])
+  best_rated = batch_meals.getTopMeals(1, [0, 0, 0, 0, 0], RatingWeight=1.0)
+  print(best_rated[0].rating == max(meal.rating for meal in batch_meals.meals))
+  print('')
+
+
+  print('Unit test of the import-time budget of the computation modules:')
+  # A headless run must not import the plotting and spreadsheet librairies, and must start quickly
+  import sys
+  import subprocess
+  import_time_budget = 0.5 # seconds
+  heavy_modules = ['pandas', 'matplotlib', 'openpyxl']
+  code = ('import sys, time\n'
+          'start = time.perf_counter()\n'
+          'import usermodule, nutritionDBmodule, envDBmodule, mealmodule, mealtablemodule, kcalindexmodule, foodtablemodule, dbcachemodule\n'
+          'print(time.perf_counter() - start)\n'
+          'print(" ".join(m for m in ' + repr(heavy_modules) + ' if m in sys.modules))\n')
+  result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+  lines = result.stdout.split('\n')
+  print(result.returncode == 0 and lines[1] == '')
+  print(result.returncode == 0 and float(lines[0]) < import_time_budget)
@@ -0,0 +1,422 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import os
+import os.path
+import json
+import hashlib
+import numpy as np
+
+
+# Local modules
+
+import envDBmodule
+import mealtablemodule
+import mealstreammodule
+import paretomodule
+import topkmodule
+
+
+#############
+# Constants #
+#############
+
+# To be incremented whenever the layout of the files of a store changes, so that old stores are rebuilt
+STORE_VERSION = 1
+
+# Number of meals read at once when a store is scanned
+CHUNK_SIZE = 65536
+
+# Columns of a store, each saved in a raw binary file named <column>.bin
+STORE_COLUMNS = ['food_indices', 'quantities', 'impacts']
+
+HEADER_NAME = 'header.json'
+
+
+###################
+# Class MealStore #
+###################
+
+class MealStore(object):
+
+  def __init__(self, Directory):
+    """
+    Parameters passed in data mode: Directory
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - Directory contains a store written by buildMealStore
+    Postconditions:
+      - the header of the store is read and its columns are opened as read-only numpy memmaps, so that
+        only the parts of the files that are actually scanned are loaded in memory
+      - self.impact_min, self.impact_max and self.impact_sum are the statistics of the impacts saved in the header
+    Result: self
+    """
+    self.directory = Directory
+    with open(os.path.join(Directory, HEADER_NAME), 'r') as header_file:
+      self.header = json.load(header_file)
+    self.key = self.header['key']
+    self.foods = self.header['foods']
+    self.nb_meals = self.header['nb_meals']
+    self.dtype = np.dtype(self.header['dtype'])
+    self.meal_kcal_target = self.header['meal_kcal_target']
+    self.impact_min = np.array(self.header['impact_min'])
+    self.impact_max = np.array(self.header['impact_max'])
+    self.impact_sum = np.array(self.header['impact_sum'])
+    dtypes = {'food_indices': np.dtype(self.header['index_dtype']), 'quantities': self.dtype, 'impacts': self.dtype}
+    widths = {'food_indices': 6, 'quantities': 6, 'impacts': 5}
+    for column in STORE_COLUMNS:
+      shape = (self.nb_meals, widths[column])
+      if self.nb_meals == 0:
+        array = np.zeros(shape, dtype=dtypes[column]) # numpy cannot map an empty file
+      else:
+        array = np.memmap(os.path.join(Directory, column + '.bin'), dtype=dtypes[column], mode='r', shape=shape)
+      setattr(self, column, array)
+
+
+  def __len__(self):
+    return self.nb_meals
+
+
+  def __str__(self):
+    return 'MealStore of {0} meals for {1} kcal in {2}'.format(self.nb_meals, self.meal_kcal_target, self.directory)
+
+
+  def getMeal(self, Index):
+    """
+    Parameters passed in data mode: self, Index
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Index is an int, -len(self) <= Index < len(self)
+    Postconditions: [none]
+    Result: a new Meal instance holding the foods, quantities and impact of row Index
+    """
+    return self.selectRows(np.array([Index % self.nb_meals])).getMeal(0)
+
+
+  def selectRows(self, Rows):
+    """
+    Parameters passed in data mode: self, Rows
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Rows is an increasing array of row indices of self
+    Postconditions: [none]
+    Result: a MealTable (in memory) containing the selected meals
+    """
+    rows = np.asarray(Rows, dtype=np.intp)
+    return mealtablemodule.MealTable(self.foods, self.food_indices[rows], self.quantities[rows], self.impacts[rows], Dtype=self.dtype)
+
+
+  def iterChunks(self, Rows=None, ChunkSize=CHUNK_SIZE):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - if specified, Rows is an increasing array of row indices of self
+    Postconditions: [none]
+    Result: a generator of tuples (rows, table), table being a MealTable holding at most ChunkSize meals of self
+    (all of them, or only those of Rows) and rows the positions of these meals in self. The chunks can be given
+    to the functions of mealstreammodule.
+    """
+    if Rows is None:
+      for start in range(0, self.nb_meals, ChunkSize):
+        rows = np.arange(start, min(start + ChunkSize, self.nb_meals))
+        yield (rows, mealtablemodule.MealTable(self.foods, self.food_indices[start:start+ChunkSize],
+          self.quantities[start:start+ChunkSize], self.impacts[start:start+ChunkSize], Dtype=self.dtype))
+    else:
+      rows = np.asarray(Rows, dtype=np.intp)
+      for start in range(0, len(rows), ChunkSize):
+        yield (rows[start:start+ChunkSize], self.selectRows(rows[start:start+ChunkSize]))
+
+
+  def filterBasedOnEnvironmentalImpact(self, Thresholds, Rows=None):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+     - Thresholds is an instance of class EnvironmentalImpact
+     - if specified, Rows is an increasing array of row indices of self, the meals to filter (default: all)
+    Postconditions: [none]
+    Result: the int array of the rows of the meals whose impact is lower or equal to Thresholds; if no meal
+    can pass (according to the minima saved in the header), the store is not even read
+    """
+    if self.nb_meals == 0 or not np.all(self.impact_min <= np.array(Thresholds.toList(), dtype=float)):
+      return np.zeros(0, dtype=np.intp)
+    selected = []
+    for (rows, table) in self.iterChunks(Rows):
+      selected.append(rows[mealtablemodule.environmentFriendlyMask(table.impacts, Thresholds)])
+    return np.concatenate(selected) if len(selected) > 0 else np.zeros(0, dtype=np.intp)
+
+
+  def filterBasedOnUserVeto(self, FoodRatings, Rows=None):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+     - FoodRatings is a dictionary associating a rating between 0 and 5 to each food
+     - if specified, Rows is an increasing array of row indices of self, the meals to filter (default: all)
+    Postconditions:
+     - a KeyError is raised if a meal contains a food without rating, as in MealView.filterBasedOnUserVeto
+    Result: the int array of the rows of the meals that do not contain a 0-rated food
+    """
+    rating_vector = mealtablemodule.foodRatingVector(self.foods, FoodRatings)
+    selected = [np.zeros(0, dtype=np.intp)]
+    for (rows, table) in self.iterChunks(Rows):
+      selected.append(rows[mealtablemodule.notVetoedMask(table.food_indices, rating_vector)])
+    return np.concatenate(selected)
+
+
+  def computeTotalImpact(self, Rows=None):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+     - if specified, Rows is an increasing array of row indices of self (default: all)
+    Postconditions: [none]
+    Result: an instance of class EnvironmentalImpact, the sum of the impacts of the selected meals
+    (taken from the header when all the meals are selected)
+    """
+    if Rows is None:
+      return envDBmodule.EnvironmentalImpact(self.impact_sum.tolist())
+    total = np.zeros(5)
+    for (rows, table) in self.iterChunks(Rows):
+      total += np.sum(table.impacts, axis=0, dtype=np.float64)
+    return envDBmodule.EnvironmentalImpact(total.tolist())
+
+
+  def computeParetoFront(self, Rows=None):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+     - if specified, Rows is an increasing array of row indices of self (default: all)
+    Postconditions:
+     - the front of each chunk is computed separately, then the fronts are merged (see paretomodule):
+       only one chunk and the fronts are in memory at once
+    Result: the int array of the rows of the selected meals that are not dominated by another selected meal
+    """
+    fronts = []
+    for (rows, table) in self.iterChunks(Rows):
+      mask = paretomodule.paretoFrontMask(table.impacts)
+      fronts.append((rows[mask], table.impacts[mask]))
+    return paretomodule.mergeParetoFronts(fronts)[0]
+
+
+  def getTopMeals(self, K, Weights, FoodRatings=None, RatingWeight=0.0, Rows=None):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+     - Weights is a list of 5 non-negative floats, the weight of each indicator
+     - if RatingWeight is not 0, FoodRatings is a dictionary associating a rating between 0 and 5 to each food
+     - if specified, Rows is an increasing array of row indices of self (default: all)
+    Postconditions:
+     - the impacts are normalized by the mean impacts saved in the header, so that the store is scanned only once;
+       each chunk is scored and merged into a TopKAccumulator (see topkmodule)
+    Result: a MealTable containing the K selected meals with the lowest score, sorted by increasing score
+    (their ratings are set if FoodRatings is given)
+    """
+    scales = topkmodule.computeImpactScales(self.impact_sum[None, :]/max(self.nb_meals, 1))
+    rating_vector = None if FoodRatings is None else mealtablemodule.foodRatingVector(self.foods, FoodRatings)
+    accumulator = topkmodule.TopKAccumulator(K)
+    for (rows, table) in self.iterChunks(Rows):
+      ratings = None if rating_vector is None else mealtablemodule.computeRatingArray(table.food_indices, rating_vector)
+      accumulator.add(rows, topkmodule.computeScores(table.impacts, Weights, scales, ratings, RatingWeight))
+    best = accumulator.rows
+    top_meals = self.selectRows(best)
+    if rating_vector is not None:
+      top_meals.ratings = mealtablemodule.computeRatingArray(top_meals.food_indices, rating_vector).astype(self.dtype)
+      top_meals.updateTotals()
+    return top_meals
+
+
+  def computeImpactHistogram(self, Rows=None, NbBins=10):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+     - if specified, Rows is an increasing array of row indices of self (default: all)
+    Postconditions: [none]
+    Result: an ImpactHistogram (see mealstreammodule) of the selected meals, whose edges are taken from the
+    statistics of the header; its method draw displays it as MealSet.drawEnvironmentalImpactHistograms
+    """
+    histogram = mealstreammodule.ImpactHistogram(self.impact_min, self.impact_max, NbBins)
+    for (rows, table) in self.iterChunks(Rows):
+      histogram.add(table.impacts)
+    return histogram
+
+
+
+########################
+# Function definitions #
+########################
+
+def computeStoreKey(NutrDB, EnvDB, MealKcalTarget, ExtraQtyDict, Dtype=np.float64):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - NutrDB is a NutritionDatabase and EnvDB an EnvironmentalDatabase, both loaded
+  Postconditions: [none]
+  Result: a string identifying the store of these arguments: the hash of the contents of both databases,
+  of the kcal target, of the quantities of the extras, of Dtype and of STORE_VERSION
+  """
+  sha = hashlib.sha256()
+  description = [NutrDB.food_table.contentHash(), EnvDB.food_table.contentHash(), float(MealKcalTarget),
+                 sorted((food, float(qty)) for (food, qty) in ExtraQtyDict.items()), np.dtype(Dtype).str, STORE_VERSION]
+  sha.update(json.dumps(description).encode('utf-8'))
+  return sha.hexdigest()[:32]
+
+
+def buildMealStore(Directory, NutrDB, EnvDB, MealKcalTarget, ExtraQtyDict, Dtype=np.float64, BatchSize=CHUNK_SIZE):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - NutrDB is a complete and consistent NutritionDatabase, EnvDB an EnvironmentalDatabase consistent with it
+    - MealKcalTarget is a positive integer or float, ExtraQtyDict contains an entry for each food in NutrDB.extras
+  Postconditions:
+    - the valid meals are enumerated batch by batch (see NutritionDatabase.iterValidMealBatches) and appended to
+      the column files of Directory, so that they are never all in memory at once
+    - the column files and then the header (key, foods, number of meals, dtypes and statistics of the impacts) are
+      written to temporary files named after the process and renamed atomically: a store that is being built
+      cannot be opened, and several processes can build the same store at once
+  Result: the MealStore opened on Directory
+  """
+  os.makedirs(Directory, exist_ok=True)
+  header_path = os.path.join(Directory, HEADER_NAME)
+  if os.path.isfile(header_path):
+    os.remove(header_path)
+  nb_meals = 0
+  impact_min = np.full(5, np.inf)
+  impact_max = np.full(5, -np.inf)
+  impact_sum = np.zeros(5)
+  index_dtype = np.min_scalar_type(max(len(NutrDB.food_table.foods)-1, 0))
+  tmp_suffix = '.tmp{0}'.format(os.getpid())
+  column_paths = {column: os.path.join(Directory, column + '.bin') for column in STORE_COLUMNS}
+  column_files = {column: open(column_paths[column] + tmp_suffix, 'wb') for column in STORE_COLUMNS}
+  try:
+    batches = NutrDB.iterValidMealBatches(MealKcalTarget, ExtraQtyDict, BatchSize=BatchSize, Dtype=Dtype)
+    for batch in mealstreammodule.withImpacts(batches, EnvDB):
+      for column in STORE_COLUMNS:
+        getattr(batch, column).tofile(column_files[column])
+      nb_meals += len(batch)
+      impact_min = np.minimum(impact_min, batch.impacts.min(axis=0))
+      impact_max = np.maximum(impact_max, batch.impacts.max(axis=0))
+      impact_sum += np.sum(batch.impacts, axis=0, dtype=np.float64)
+  finally:
+    for column_file in column_files.values():
+      column_file.close()
+  for column in STORE_COLUMNS:
+    os.replace(column_paths[column] + tmp_suffix, column_paths[column])
+  header = {'store_version': STORE_VERSION,
+            'key': computeStoreKey(NutrDB, EnvDB, MealKcalTarget, ExtraQtyDict, Dtype),
+            'foods': list(NutrDB.food_table.foods),
+            'nb_meals': nb_meals,
+            'dtype': np.dtype(Dtype).str,
+            'index_dtype': np.dtype(index_dtype).str,
+            'meal_kcal_target': float(MealKcalTarget),
+            'extra_qty_dict': {food: float(qty) for (food, qty) in ExtraQtyDict.items()},
+            'impact_min': impact_min.tolist() if nb_meals > 0 else [0.0]*5,
+            'impact_max': impact_max.tolist() if nb_meals > 0 else [0.0]*5,
+            'impact_sum': impact_sum.tolist()}
+  with open(header_path + tmp_suffix, 'w') as header_file:
+    json.dump(header, header_file)
+  os.replace(header_path + tmp_suffix, header_path)
+  return MealStore(Directory)
+
+
+def openMealStore(RootDirectory, NutrDB, EnvDB, MealKcalTarget, ExtraQtyDict, Dtype=np.float64):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions: see buildMealStore
+  Postconditions:
+    - the store of these arguments is looked for in the sub-directory of RootDirectory named after its key
+      (see computeStoreKey); it is built there if it does not exist, if it was written by another version
+      of this module or if it was not completely written
+  Result: a MealStore, reused across runs as long as the databases, the target and the extras do not change
+  """
+  key = computeStoreKey(NutrDB, EnvDB, MealKcalTarget, ExtraQtyDict, Dtype)
+  directory = os.path.join(RootDirectory, key)
+  try:
+    store = MealStore(directory)
+    if store.header.get('store_version') == STORE_VERSION and store.key == key:
+      return store
+  except (OSError, ValueError, KeyError):
+    pass
+  return buildMealStore(directory, NutrDB, EnvDB, MealKcalTarget, ExtraQtyDict, Dtype)
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import shutil
+  import tempfile
+  import time
+  import nutritionDBmodule
+
+  nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+  envDB = envDBmodule.EnvironmentalDatabase('poore2018/DataS2.xlsx')
+  extra_qty_dict = {food: 0.010 for food in nutrDB.extras}
+  meal_table = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict, AsTable=True)
+  meal_table.computeAllEnvironmentalImpacts(envDB)
+  my_thresholds = envDBmodule.EnvironmentalImpact([2.0, 1.5, 15.0, 10.0, 3000])
+  my_ratings = {food: 3 for food in nutrDB.getAllFoods()}
+  my_ratings['Coffee'] = 0
+  root_directory = tempfile.mkdtemp()
+
+  print('Unit test of buildMealStore and MealStore:')
+  store = openMealStore(root_directory, nutrDB, envDB, 720, extra_qty_dict)
+  print(len(store) == len(meal_table) and isinstance(store.impacts, np.memmap))
+  print(np.array_equal(store.food_indices, meal_table.food_indices) and np.array_equal(store.quantities, meal_table.quantities))
+  print(store.getMeal(-1).getFoods() == meal_table[-1].getFoods() and store.getMeal(5).impact == meal_table[5].impact)
+  print(not any('.tmp' in name for name in os.listdir(store.directory))) # the temporary files have been renamed
+  print('')
+
+  print('Unit test of the chunked scans of MealStore:')
+  rows = store.filterBasedOnEnvironmentalImpact(my_thresholds)
+  rows = store.filterBasedOnUserVeto(my_ratings, rows)
+  expected = meal_table.filterBasedOnEnvironmentalImpact(my_thresholds).filterBasedOnUserVeto(my_ratings)
+  print(np.array_equal(rows, expected.rows))
+  print(store.computeTotalImpact(rows) == expected.total_impact)
+  total = store.computeTotalImpact().toList()
+  print(np.allclose(total, meal_table.total_impact.toList(), rtol=1e-12))
+  print(store.computeImpactHistogram().counts.sum(axis=1).tolist() == [len(meal_table)]*5)
+  print(len(store.filterBasedOnEnvironmentalImpact(envDBmodule.EnvironmentalImpact([0, 0, 0, 0, 0]))) == 0)
+  print(np.array_equal(store.computeParetoFront(), meal_table.filterBasedOnParetoDominance().rows))
+  print(np.array_equal(store.computeParetoFront(rows), expected.filterBasedOnParetoDominance().rows))
+  scales = topkmodule.computeImpactScales(meal_table.impacts)
+  top_meals = store.getTopMeals(10, [1, 2, 0, 0, 1], my_ratings, RatingWeight=0.5)
+  meal_table.computeAllRatings({food: my_ratings.get(food, 0) for food in meal_table.foods})
+  expected_top = meal_table.getTopMeals(10, [1, 2, 0, 0, 1], RatingWeight=0.5, Scales=scales)
+  print(np.array_equal(top_meals.food_indices, expected_top.food_indices) and np.array_equal(top_meals.ratings, expected_top.ratings))
+  print('')
+
+  print('Unit test of the reuse of a MealStore across runs:')
+  start = time.time()
+  reopened = openMealStore(root_directory, nutrDB, envDB, 720, extra_qty_dict)
+  print(reopened.directory == store.directory and time.time() - start < 0.5)
+  other = openMealStore(root_directory, nutrDB, envDB, 700, extra_qty_dict)
+  print(other.directory != store.directory and len(os.listdir(root_directory)) == 2)
+  store = reopened = other = None
+  shutil.rmtree(root_directory)
@@ -0,0 +1,258 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import numpy as np
+
+
+# Local modules
+
+import envDBmodule
+import mealtablemodule
+
+
+#########################
+# Class ImpactHistogram #
+#########################
+
+class ImpactHistogram(object):
+
+  def __init__(self, Lows=None, Highs=None, NbBins=10):
+    """
+    Parameters passed in data mode: Lows, Highs, NbBins
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - if specified, Lows and Highs are lists of 5 floats (same columns as EnvironmentalImpact.toList()),
+        the limits of the bins of each indicator
+      - NbBins is a positive integer
+    Postconditions:
+      - self.counts is a (5,NbBins) int array of zeros; the edges of the bins are fixed when the limits are
+        known (immediately if Lows and Highs are given, otherwise from the first non-empty batch added),
+        so that the histogram is accumulated in constant memory
+    Result: self
+    """
+    self.nb_bins = NbBins
+    self.counts = np.zeros((5, NbBins), dtype=np.int64)
+    self.edges = None
+    self.minima = np.full(5, np.inf)
+    self.maxima = np.full(5, -np.inf)
+    if Lows is not None and Highs is not None:
+      self._setEdges(np.asarray(Lows, dtype=float), np.asarray(Highs, dtype=float))
+
+
+  def _setEdges(self, Lows, Highs):
+    Highs = np.where(Highs > Lows, Highs, Lows + 1) # avoid empty ranges, as np.histogram does
+    self.edges = np.linspace(Lows, Highs, self.nb_bins + 1, axis=1)
+
+
+  def __len__(self):
+    return int(self.counts[0].sum())
+
+
+  def add(self, Impacts):
+    """
+    Parameters passed in data mode: Impacts
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Impacts is an (N,5) array of meal impacts
+    Postconditions:
+      - the meals are counted in the bins of each indicator; the values outside the edges are counted in the
+        first or last bin (self.minima and self.maxima keep the true extreme values)
+    Result: [none]
+    """
+    impacts = np.asarray(Impacts, dtype=float).reshape(-1, 5)
+    if len(impacts) == 0:
+      return
+    self.minima = np.minimum(self.minima, impacts.min(axis=0))
+    self.maxima = np.maximum(self.maxima, impacts.max(axis=0))
+    if self.edges is None:
+      self._setEdges(impacts.min(axis=0), impacts.max(axis=0))
+    for d in range(5):
+      bins = np.searchsorted(self.edges[d], impacts[:, d], side='right') - 1
+      np.clip(bins, 0, self.nb_bins - 1, out=bins)
+      self.counts[d] += np.bincount(bins, minlength=self.nb_bins)
+
+
+  def draw(self, Type='standalone'):
+    """
+    Parameters passed in data mode: self, Type
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - at least one meal has been added
+    Postconditions: A window opens (if Type is 'standalone'), containing five histograms, as MealSet.drawEnvironmentalImpactHistograms
+    Result: None if Type is 'standalone', the matplotlib figure if Type is 'embedded'
+    """
+    import matplotlib.pyplot as plt
+    labels = ['Land use (square meters)', 'Greenhouse gas emissions (kg CO2 eq.)', 'Acidifying emissions (g SO2 eq.)',
+              'Eutrophying emissions (g PO43- eq.)', 'Stress-weighted water use (L)']
+    myfig = plt.figure(figsize=(10, 10))
+    for d in range(5):
+      axs = myfig.add_subplot(3, 2, d + 1)
+      axs.stairs(self.counts[d], self.edges[d], fill=True)
+      axs.set_xlabel(labels[d])
+    if Type == 'standalone':
+      plt.show()
+      return None
+    elif Type == 'embedded':
+      return myfig
+
+
+
+########################
+# Function definitions #
+########################
+
+def withImpacts(Batches, EnvDB):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Batches is an iterable of MealTables, typically NutrDB.iterValidMealBatches(...)
+  Postconditions:
+    - the impacts of each batch are computed when it is consumed
+    - a KeyError exception is thrown if a food used by a batch does not exist in EnvDB.food_table
+  Result: a generator of the same MealTables, with their impacts computed
+  """
+  for batch in Batches:
+    impact_rows = mealtablemodule.getUsedImpactRows(EnvDB, batch.foods, batch.food_indices)
+    batch.impacts = mealtablemodule.computeImpactArray(batch.food_indices, batch.quantities, impact_rows).astype(batch.dtype, copy=False)
+    batch.updateTotals()
+    yield batch
+
+
+def filterBatches(Batches, Thresholds=None, FoodRatings=None, MinimalMealRating=None):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Batches is an iterable of MealTables (with their impacts computed if Thresholds is specified)
+    - if specified, Thresholds is an instance of class EnvironmentalImpact
+    - if specified, FoodRatings is a dictionary associating a rating between 0 and 5 to each food
+    - MinimalMealRating is only used if FoodRatings is specified
+  Postconditions: [none]
+  Result: a generator of MealTables holding, for each batch, the meals that pass the filters of MealTable
+  (environmental thresholds, then user veto, then minimal satisfaction); empty batches are skipped
+  """
+  for batch in Batches:
+    view = batch.asView()
+    if Thresholds is not None:
+      view = view.filterBasedOnEnvironmentalImpact(Thresholds)
+    if FoodRatings is not None:
+      view = view.filterBasedOnUserVeto(FoodRatings)
+      if MinimalMealRating is not None:
+        view = view.filterBasedOnMinimalMealSatisfaction(FoodRatings, MinimalMealRating)
+    if len(view) > 0:
+      yield view.toTable()
+
+
+def accumulateHistogram(Batches, Histogram):
+  """
+  Parameters passed in data mode: Batches
+  Parameters passed in data/result mode: Histogram
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Batches is an iterable of MealTables with their impacts computed, Histogram an ImpactHistogram
+  Postconditions:
+    - the impacts of each batch are added to Histogram when the batch is consumed
+  Result: a generator of the same MealTables, so that other consumers can be chained after it
+  """
+  for batch in Batches:
+    Histogram.add(batch.impacts)
+    yield batch
+
+
+def saveBatchesToFile(Batches, Filename):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Batches is an iterable of MealTables
+  Postconditions:
+    - a text file named according to Filename is created or overwritten, with one line for each meal of each batch,
+      in the same format as MealSet.saveToFile; each batch is written as soon as it is produced
+  Result: a tuple (nb_meals, total_impact), the number of meals written and the sum of their impacts
+  (an instance of class EnvironmentalImpact)
+  """
+  nb_meals = 0
+  total_impact = np.zeros(5)
+  with open(Filename, 'w') as output_file:
+    for batch in Batches:
+      mealtablemodule.appendMealLines(output_file, batch.foods, batch.food_indices, batch.quantities)
+      nb_meals += len(batch)
+      total_impact += np.sum(batch.impacts, axis=0, dtype=np.float64)
+  return (nb_meals, envDBmodule.EnvironmentalImpact(total_impact.tolist()))
+
+
+def collectBatches(Batches, Foods, Dtype=np.float64):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Batches is an iterable of MealTables whose food indices refer to Foods
+  Postconditions: [none]
+  Result: a MealTable containing all the meals of the batches, in order (the memory is no longer bounded)
+  """
+  return mealtablemodule.concatenateTables(list(Batches), Foods, Dtype)
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import os
+  import tempfile
+  import tracemalloc
+  import nutritionDBmodule
+
+  nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+  envDB = envDBmodule.EnvironmentalDatabase('poore2018/DataS2.xlsx')
+  extra_qty_dict = {food: 0.010 for food in nutrDB.extras}
+  my_thresholds = envDBmodule.EnvironmentalImpact([2.0, 1.5, 15.0, 10.0, 3000])
+  meal_table = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict, AsTable=True)
+  meal_table.computeAllEnvironmentalImpacts(envDB)
+
+  print('Unit test of withImpacts and filterBatches:')
+  batches = filterBatches(withImpacts(nutrDB.iterValidMealBatches(720, extra_qty_dict, BatchSize=4096), envDB), my_thresholds)
+  streamed = collectBatches(batches, nutrDB.food_table.foods)
+  expected = meal_table.filterBasedOnEnvironmentalImpact(my_thresholds)
+  print(len(streamed) == len(expected) and np.array_equal(streamed.food_indices, expected.toTable().food_indices))
+  print(np.array_equal(streamed.impacts, expected.toTable().impacts))
+  print('')
+
+  print('Unit test of ImpactHistogram:')
+  edges = np.histogram_bin_edges(meal_table.impacts[:, 1], bins=10)
+  histogram = ImpactHistogram(meal_table.impacts.min(axis=0), meal_table.impacts.max(axis=0), NbBins=10)
+  for batch in accumulateHistogram(withImpacts(nutrDB.iterValidMealBatches(720, extra_qty_dict, BatchSize=4096), envDB), histogram):
+    pass
+  print(len(histogram) == len(meal_table))
+  print(np.array_equal(histogram.counts[1], np.histogram(meal_table.impacts[:, 1], bins=edges)[0]))
+  print('')
+
+  print('Unit test of saveBatchesToFile and of the peak memory of the pipeline:')
+  (handle, stream_path) = tempfile.mkstemp(suffix='.txt')
+  os.close(handle)
+  table_path = stream_path + '.table'
+  meal_table.saveToFile(table_path)
+  tracemalloc.start()
+  (nb_meals, total_impact) = saveBatchesToFile(withImpacts(nutrDB.iterValidMealBatches(720, extra_qty_dict, BatchSize=2048), envDB), stream_path)
+  (current, peak) = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  with open(stream_path) as f1, open(table_path) as f2:
+    print(nb_meals == len(meal_table) and f1.read() == f2.read())
+  print(abs(total_impact.GHG_emissions - meal_table.total_impact.GHG_emissions) < 1e-9*meal_table.total_impact.GHG_emissions)
+  print(peak < meal_table.nbytes()) # the pipeline never holds all the meals at once
+  print('(peak memory of the pipeline: {0:.1f} MB, size of the whole table: {1:.1f} MB)'.format(peak/1e6, meal_table.nbytes()/1e6))
+  os.remove(stream_path)
+  os.remove(table_path)
@@ -0,0 +1,774 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import numpy as np
+
+
+# Local modules
+
+import envDBmodule
+import mealmodule
+import paretomodule
+import topkmodule
+
+
+###################
+# Class MealTable #
+###################
+
+class MealTable(object):
+
+  def __init__(self, Foods, FoodIndices=None, Quantities=None, Impacts=None, Ratings=None, Dtype=np.float64):
+    """
+    Parameters passed in data mode: Foods, FoodIndices, Quantities, Impacts, Ratings, Dtype
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - Foods is a list of strings (typically NutrDB.getAllFoods()), the food indices of the table refer to it
+      - if specified, FoodIndices is an (N,6) array of ints, each row containing the positions in Foods of
+        (in the following order) the source of protein, the source of carbohydrates, the source of fat,
+        the vegetable, the fruit and the extra of a meal
+      - if specified, Quantities is an (N,6) array of floats, giving the quantity of each meal component
+        in the same units as in class NutritionDatabase (typically kg or L)
+      - if specified, Impacts is an (N,5) array of floats, with the same columns as EnvironmentalImpact.toList()
+      - if specified, Ratings is an (N,) array of floats
+      - Dtype is np.float64 (default) or np.float32, the latter halving the memory used by the float columns
+    Postconditions:
+      - the attributes of self are initialized; the columns that are not specified are filled with zeros
+      - self.food_indices uses the smallest unsigned int type able to index Foods
+    Result: self
+    """
+    self.foods = list(Foods)
+    self.dtype = np.dtype(Dtype)
+    index_dtype = np.min_scalar_type(max(len(self.foods)-1, 0))
+    if FoodIndices is None:
+      FoodIndices = np.zeros((0, 6))
+    nb_meals = len(FoodIndices)
+    self.food_indices = np.ascontiguousarray(FoodIndices, dtype=index_dtype).reshape(nb_meals, 6)
+    self.quantities = self._column(Quantities, nb_meals, 6)
+    self.impacts = self._column(Impacts, nb_meals, 5)
+    self.ratings = self._column(Ratings, nb_meals, None)
+    self.updateTotals()
+
+
+  def _column(self, Values, NbMeals, NbColumns):
+    shape = (NbMeals,) if NbColumns is None else (NbMeals, NbColumns)
+    if Values is None:
+      return np.zeros(shape, dtype=self.dtype)
+    return np.ascontiguousarray(Values, dtype=self.dtype).reshape(shape)
+
+
+  def updateTotals(self):
+    """
+    Parameters passed in data mode: [none]
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions:
+      - self.total_impact (EnvironmentalImpact) and self.total_rating are recomputed from the columns,
+        as in MealSet, with one reduction each
+    Result: [none]
+    """
+    self.total_impact = envDBmodule.EnvironmentalImpact(np.sum(self.impacts, axis=0, dtype=np.float64).tolist())
+    self.total_rating = float(np.sum(self.ratings, dtype=np.float64))
+
+
+  def __len__(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: an integer equal to the number of meals in the MealTable
+    """
+    return len(self.food_indices)
+
+
+  def __getitem__(self, Index):
+    """
+    Parameters passed in data mode: self, Index
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Index is an int, a slice, a boolean mask of length len(self) or an array of ints
+    Postconditions: [none]
+    Result: if Index is an int, the Meal at position Index (as in MealSet);
+    otherwise, a MealTable containing the selected rows
+    """
+    if isinstance(Index, (int, np.integer)):
+      return self.getMeal(Index)
+    return MealTable(self.foods, self.food_indices[Index], self.quantities[Index], self.impacts[Index], self.ratings[Index], self.dtype)
+
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self.getMeal(i)
+
+
+  def __str__(self):
+    return 'MealTable of {0} meals, {1}, {2}'.format(len(self), str(self.total_impact), self.total_rating)
+
+
+  def getMeal(self, Index):
+    """
+    Parameters passed in data mode: self, Index
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Index is an int, -len(self) <= Index < len(self)
+    Postconditions: [none]
+    Result: a new Meal instance holding the foods, quantities, impact and rating of row Index
+    """
+    foods = [self.foods[i] for i in self.food_indices[Index].tolist()]
+    meal = mealmodule.Meal(foods, self.quantities[Index].tolist())
+    meal.is_nutritionally_valid = True
+    meal.impact = envDBmodule.EnvironmentalImpact(self.impacts[Index].tolist())
+    meal.rating = self.ratings[Index].item()
+    return meal
+
+
+  def getFirst(self):
+    return self.getMeal(0)
+
+
+  def getFoodNames(self, Index):
+    """
+    Parameters passed in data mode: self, Index
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Index is an int, -len(self) <= Index < len(self)
+    Postconditions: [none]
+    Result: the list of the 6 food names of row Index, in the order of Meal.getFoods()
+    """
+    return [self.foods[i] for i in self.food_indices[Index].tolist()]
+
+
+  def toMealSet(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: a MealSet containing one Meal instance per row of self
+    """
+    meal_set = mealmodule.MealSet()
+    meal_set.meals = [self.getMeal(i) for i in range(len(self))]
+    meal_set.total_impact = self.total_impact.deepcopy()
+    meal_set.total_rating = self.total_rating
+    return meal_set
+
+
+  def copy(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: a new MealTable holding a copy of the columns of self
+    """
+    return MealTable(self.foods, self.food_indices.copy(), self.quantities.copy(), self.impacts.copy(), self.ratings.copy(), self.dtype)
+
+
+  def nbytes(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: the number of bytes used by the columns of self
+    """
+    return self.food_indices.nbytes + self.quantities.nbytes + self.impacts.nbytes + self.ratings.nbytes
+
+
+  def getImpactArray(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: the (N,5) array of the meal impacts, as MealSet.getImpactArray
+    """
+    return self.impacts
+
+
+  def computeAllEnvironmentalImpacts(self, EnvDB):
+    """
+    Parameters passed in data mode: EnvDB
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: 
+     - a KeyError exception is thrown if a food used by a meal does not exist in EnvDB.food_table
+     - self.impacts contains the environmental impact of each meal, self.total_impact their sum
+    Result: [none]
+    """
+    impact_rows = getUsedImpactRows(EnvDB, self.foods, self.food_indices)
+    self.impacts = computeImpactArray(self.food_indices, self.quantities, impact_rows).astype(self.dtype, copy=False)
+    self.updateTotals()
+
+
+  def drawEnvironmentalImpactHistograms(self, Type='standalone'):
+    """
+    Parameters passed in data mode: self, Type
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - self.impacts has been computed
+    Postconditions: see MealSet.drawEnvironmentalImpactHistograms
+    Result: None if Type is 'standalone', the matplotlib figure if Type is 'embedded'
+    """
+    return mealmodule.drawImpactHistograms(self.impacts, Type)
+
+
+  def computeAllRatings(self, FoodRatings):
+    """
+    Parameters passed in data mode: FoodRatings
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - FoodRatings is a dictionary associating a rating between 0 and 5 to each food used by the meals of self
+    Postconditions: 
+     - self.ratings contains the rating of each meal (sum of the ratings of its 6 foods), self.total_rating their sum
+    Result: [none]
+    """
+    self.ratings = computeRatingArray(self.food_indices, foodRatingVector(self.foods, FoodRatings)).astype(self.dtype, copy=False)
+    self.updateTotals()
+
+
+  def asView(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: a MealView selecting all the meals of self
+    """
+    return MealView(self, np.arange(len(self)))
+
+
+  def filterBasedOnEnvironmentalImpact(self, Thresholds):
+    """
+    Parameters passed in data mode: self, Thresholds
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - self.impacts has been computed
+     - Thresholds is an instance of class EnvironmentalImpact
+    Postconditions: [none]
+    Result: A MealView of the meals of self whose impact is lower or equal to Thresholds
+    """
+    return self.asView().filterBasedOnEnvironmentalImpact(Thresholds)
+
+
+  def filterBasedOnUserVeto(self, FoodRatings):
+    """
+    Parameters passed in data mode: self, FoodRatings
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - FoodRatings is a dictionary associating a rating between 0 and 5 to each food
+    Postconditions: [none]
+    Result: A MealView of the meals of self that do not contain a 0-rated food
+    """
+    return self.asView().filterBasedOnUserVeto(FoodRatings)
+
+
+  def filterBasedOnMinimalMealSatisfaction(self, FoodRatings, MinimalMealRating):
+    """
+    Parameters passed in data mode: FoodRatings, MinimalMealRating
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - FoodRatings is a dictionary associating a rating between 0 and 5 to each food
+    Postconditions: 
+     - the ratings of the meals of self are computed, as in MealSet.filterBasedOnMinimalMealSatisfaction
+    Result: A MealView of the meals of self that have a rating larger or equal to MinimalMealRating
+    """
+    return self.asView().filterBasedOnMinimalMealSatisfaction(FoodRatings, MinimalMealRating)
+
+
+  def filterBasedOnParetoDominance(self, NbLayers=1):
+    """
+    Parameters passed in data mode: self, NbLayers
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - self.impacts has been computed
+     - NbLayers is a positive integer
+    Postconditions: [none]
+    Result: A MealView of the meals of self that belong to the first NbLayers Pareto layers of their impacts
+    (NbLayers = 1: the meals that no other meal beats on all five indicators), see module paretomodule
+    """
+    return self.asView().filterBasedOnParetoDominance(NbLayers)
+
+
+  def getTopMeals(self, K, Weights, RatingWeight=0.0, Scales=None):
+    """
+    Parameters passed in data mode: self, K, Weights, RatingWeight, Scales
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: see MealSet.getTopMeals (the ratings are those of self.ratings)
+    Postconditions: [none]
+    Result: a MealTable containing the K meals of self with the lowest score, sorted by increasing score
+    """
+    return self.asView().getTopMeals(K, Weights, RatingWeight, Scales)
+
+
+  def saveToFile(self, Filename):
+    """
+    Parameters passed in data mode: self, Filename
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions:
+      - a text file named according to Filename is created or overwritten, with one line for each meal,
+        in the same format as MealSet.saveToFile
+    Result: None
+    """
+    writeMealLines(Filename, self.foods, self.food_indices, self.quantities)
+
+
+
+##################
+# Class MealView #
+##################
+
+class MealView(object):
+
+  def __init__(self, Table, Rows):
+    """
+    Parameters passed in data mode: Table, Rows
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - Table is a MealTable
+      - Rows is an increasing array of row indices of Table
+    Postconditions:
+      - self references Table without copying its columns: a MealView only stores the array of the selected rows,
+        so that chained filters narrow this array instead of copying meals at each stage
+      - self.total_impact and self.total_rating are computed as in MealSet
+    Result: self
+    """
+    self.table = Table
+    self.rows = np.asarray(Rows, dtype=np.intp)
+    self.foods = Table.foods
+    self.updateTotals()
+
+
+  def updateTotals(self):
+    self.total_impact = envDBmodule.EnvironmentalImpact(np.sum(self.table.impacts[self.rows], axis=0, dtype=np.float64).tolist())
+    self.total_rating = float(np.sum(self.table.ratings[self.rows], dtype=np.float64))
+
+
+  def __len__(self):
+    return len(self.rows)
+
+
+  def __getitem__(self, Index):
+    """
+    Parameters passed in data mode: self, Index
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Index is an int, a slice, a boolean mask of length len(self) or an array of ints
+    Postconditions: [none]
+    Result: if Index is an int, the Meal at position Index of the view; otherwise, a narrower MealView
+    """
+    if isinstance(Index, (int, np.integer)):
+      return self.table.getMeal(self.rows[Index])
+    return MealView(self.table, self.rows[Index])
+
+
+  def __iter__(self):
+    for row in self.rows.tolist():
+      yield self.table.getMeal(row)
+
+
+  def __str__(self):
+    return 'MealView of {0} meals, {1}, {2}'.format(len(self), str(self.total_impact), self.total_rating)
+
+
+  def getFirst(self):
+    return self.table.getMeal(self.rows[0])
+
+
+  def getImpactArray(self):
+    return self.table.impacts[self.rows]
+
+
+  def drawEnvironmentalImpactHistograms(self, Type='standalone'):
+    return mealmodule.drawImpactHistograms(self.getImpactArray(), Type)
+
+
+  def toTable(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: a MealTable containing a copy of the selected rows
+    """
+    return self.table[self.rows]
+
+
+  def toMealSet(self):
+    return self.toTable().toMealSet()
+
+
+  def filterBasedOnEnvironmentalImpact(self, Thresholds):
+    """
+    Parameters passed in data mode: self, Thresholds
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - the impacts of the table have been computed
+     - Thresholds is an instance of class EnvironmentalImpact
+    Postconditions: [none]
+    Result: A MealView of the meals of self whose impact is lower or equal to Thresholds
+    """
+    mask = environmentFriendlyMask(self.table.impacts[self.rows], Thresholds)
+    return MealView(self.table, self.rows[mask])
+
+
+  def filterBasedOnUserVeto(self, FoodRatings):
+    """
+    Parameters passed in data mode: self, FoodRatings
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - FoodRatings is a dictionary associating a rating between 0 and 5 to each food
+    Postconditions:
+     - a KeyError is raised if a meal of self contains a food without rating, as in Meal.containsAVetoedFood
+    Result: A MealView of the meals of self that do not contain a 0-rated food
+    """
+    mask = notVetoedMask(self.table.food_indices[self.rows], foodRatingVector(self.foods, FoodRatings))
+    return MealView(self.table, self.rows[mask])
+
+
+  def filterBasedOnMinimalMealSatisfaction(self, FoodRatings, MinimalMealRating):
+    """
+    Parameters passed in data mode: FoodRatings, MinimalMealRating
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - FoodRatings is a dictionary associating a rating between 0 and 5 to each food
+    Postconditions: 
+     - the ratings of the selected meals are computed and stored in the table
+    Result: A MealView of the meals of self that have a rating larger or equal to MinimalMealRating
+    """
+    ratings = computeRatingArray(self.table.food_indices[self.rows], foodRatingVector(self.foods, FoodRatings))
+    self.table.ratings[self.rows] = ratings
+    self.table.updateTotals()
+    self.updateTotals()
+    return MealView(self.table, self.rows[ratings >= MinimalMealRating])
+
+
+  def filterBasedOnParetoDominance(self, NbLayers=1):
+    """
+    Parameters passed in data mode: self, NbLayers
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+     - the impacts of the table have been computed
+     - NbLayers is a positive integer
+    Postconditions: [none]
+    Result: A MealView of the meals of self that belong to the first NbLayers Pareto layers of the impacts
+    of the meals of self
+    """
+    layers = paretomodule.paretoLayers(self.table.impacts[self.rows], NbLayers)
+    return MealView(self.table, self.rows[layers >= 0])
+
+
+  def getTopMeals(self, K, Weights, RatingWeight=0.0, Scales=None):
+    """
+    Parameters passed in data mode: self, K, Weights, RatingWeight, Scales
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: see MealSet.getTopMeals (by default, Scales are the mean impacts of the meals of self)
+    Postconditions: [none]
+    Result: a MealTable containing the K meals of self with the lowest score, sorted by increasing score
+    """
+    impacts = self.table.impacts[self.rows]
+    if Scales is None:
+      Scales = topkmodule.computeImpactScales(impacts)
+    scores = topkmodule.computeScores(impacts, Weights, Scales, self.table.ratings[self.rows], RatingWeight)
+    return self.table[self.rows[topkmodule.selectTopK(scores, K, self.rows)]]
+
+
+  def saveToFile(self, Filename):
+    writeMealLines(Filename, self.foods, self.table.food_indices[self.rows], self.table.quantities[self.rows])
+
+
+
+########################
+# Function definitions #
+########################
+
+def computeImpactArray(FoodIndices, Quantities, ImpactRows):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - FoodIndices is an (N,6) int array and Quantities an (N,6) float array, as in MealTable
+    - ImpactRows is an (F,5) float array, row i containing the impact of 1 retail unit of the food of index i
+  Postconditions: [none]
+  Result: an (N,5) float64 array containing the impact of each meal, i.e. the impact rows of its 6 foods
+  gathered and weighted by its quantities. The components are accumulated in the same order as 
+  Meal.computeEnvironmentalImpact, one column of the quantity matrix at a time.
+  """
+  impacts = np.zeros((len(FoodIndices), 5))
+  for k in range(FoodIndices.shape[1]):
+    impacts += Quantities[:, k, None]*ImpactRows[FoodIndices[:, k]]
+  return impacts
+
+
+def getUsedImpactRows(EnvDB, Foods, FoodIndices):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Foods is a list of F strings, FoodIndices an (N,6) int array of indices in Foods
+  Postconditions:
+    - a KeyError exception is thrown if a food used by FoodIndices does not exist in EnvDB.food_table, as
+      in Meal.computeEnvironmentalImpact
+  Result: the (F,5) array of the impact rows of Foods, as FoodTable.getImpactsOf (NaN only for the unused foods
+  unknown to EnvDB)
+  """
+  impact_rows = EnvDB.food_table.getImpactsOf(Foods)
+  for f in np.unique(FoodIndices):
+    if Foods[f] not in EnvDB.food_table.food_ids:
+      raise KeyError(Foods[f])
+  return impact_rows
+
+
+def environmentFriendlyMask(Impacts, Thresholds):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Impacts is an (N,5) float array, Thresholds an instance of class EnvironmentalImpact
+  Postconditions: [none]
+  Result: an (N,) boolean array, True for the rows whose components are all lower or equal to
+  their counterparts in Thresholds (the vectorized equivalent of EnvironmentalImpact.__le__)
+  """
+  return np.all(Impacts <= np.array(Thresholds.toList(), dtype=float), axis=1)
+
+
+def foodRatingVector(Foods, FoodRatings):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Foods is a list of strings, FoodRatings a dictionary associating a rating to foods
+  Postconditions: [none]
+  Result: a float array containing the rating of each food of Foods (NaN for the foods missing in FoodRatings)
+  """
+  return np.array([FoodRatings.get(food, np.nan) for food in Foods], dtype=float)
+
+
+def computeRatingArray(FoodIndices, RatingVector):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - FoodIndices is an (N,6) int array, RatingVector a float array returned by foodRatingVector
+  Postconditions: 
+    - a KeyError is raised if a meal contains a food without rating, as in Meal.computeRating
+  Result: an (N,) float array containing the sum of the ratings of the 6 foods of each meal
+  """
+  ratings = np.sum(RatingVector[FoodIndices], axis=1)
+  if np.any(np.isnan(ratings)):
+    raise KeyError('Some foods of the meals have no rating.')
+  return ratings
+
+
+def notVetoedMask(FoodIndices, RatingVector):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - FoodIndices is an (N,6) int array, RatingVector a float array returned by foodRatingVector
+  Postconditions: 
+    - a KeyError is raised if a meal contains a food without rating, as in computeRatingArray
+  Result: an (N,) boolean array, True for the meals that do not contain a 0-rated food
+  """
+  ratings = RatingVector[FoodIndices]
+  if np.any(np.isnan(ratings)):
+    raise KeyError('Some foods of the meals have no rating.')
+  return ~np.any(ratings <= 0, axis=1)
+
+
+def writeMealLines(Filename, Foods, FoodIndices, Quantities):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - FoodIndices and Quantities are (N,6) arrays as in MealTable, whose indices refer to Foods
+  Postconditions:
+    - a text file named according to Filename is created or overwritten, with one line for each meal,
+      in the same format as MealSet.saveToFile
+  Result: None
+  """
+  with open(Filename, 'w') as output_file:
+    appendMealLines(output_file, Foods, FoodIndices, Quantities)
+
+
+def appendMealLines(OutputFile, Foods, FoodIndices, Quantities):
+  """
+  Parameters passed in data mode: Foods, FoodIndices, Quantities
+  Parameters passed in data/result mode: OutputFile
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - OutputFile is a text file opened for writing
+    - FoodIndices and Quantities are (N,6) arrays as in MealTable, whose indices refer to Foods
+  Postconditions:
+    - one line per meal is written to OutputFile, in the same format as MealSet.saveToFile
+  Result: None
+  """
+  for (indices, qty) in zip(FoodIndices.tolist(), Quantities.tolist()):
+    mystrings = []
+    for i in range(len(indices)):
+      mystrings.append('{0:4.0f} g or mL of {1}'.format(1000*qty[i], Foods[indices[i]]))
+    OutputFile.write(', '.join(mystrings))
+    OutputFile.write('\n')
+
+
+def tableFromMealSet(Meals, Foods, Dtype=np.float64):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Meals is a MealSet whose meals have their quantities set
+    - each food of each meal exists in the list Foods
+  Postconditions: [none]
+  Result: a MealTable holding the foods, quantities, impacts and ratings of the meals of Meals
+  """
+  food_ids = {food: i for (i, food) in enumerate(Foods)}
+  food_indices = [[food_ids[food] for food in meal.getFoods()] for meal in Meals.meals]
+  quantities = [meal.getQuantities() for meal in Meals.meals]
+  impacts = [meal.impact.toList() for meal in Meals.meals]
+  ratings = [meal.rating for meal in Meals.meals]
+  return MealTable(Foods, food_indices, quantities, impacts, ratings, Dtype)
+
+
+def concatenateTables(Tables, Foods, Dtype=np.float64):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Tables is a list of MealTable instances whose food indices all refer to Foods
+  Postconditions: [none]
+  Result: a MealTable containing the rows of all the tables, in order
+  """
+  if len(Tables) == 0:
+    return MealTable(Foods, Dtype=Dtype)
+  return MealTable(Foods,
+    np.concatenate([t.food_indices for t in Tables]),
+    np.concatenate([t.quantities for t in Tables]),
+    np.concatenate([t.impacts for t in Tables]),
+    np.concatenate([t.ratings for t in Tables]),
+    Dtype)
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import nutritionDBmodule
+
+  nutrDB = nutritionDBmodule.NutritionDatabase()
+  extra_qty_dict = {'Beet Sugar': 0.012, 'Coffee': 0.008, 'Dark Chocolate': 0.020}
+  meal_set = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict)
+  meal_table = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict, AsTable=True)
+
+  print('Unit test of MealTable.__len__ and MealTable.__getitem__:')
+  print(len(meal_table) == len(meal_set))
+  print(meal_table[0].getFoods() == meal_set[0].getFoods() and meal_table[-1].getQuantities() == meal_set[-1].getQuantities())
+  print('')
+
+  print('Unit test of MealTable slicing and boolean selection:')
+  first_ten = meal_table[:10]
+  print(len(first_ten) == 10 and first_ten[9].getFoods() == meal_set[9].getFoods())
+  with_eggs = meal_table[meal_table.food_indices[:, 0] == meal_table.foods.index('Eggs')]
+  print(len(with_eggs) == len([m for m in meal_set.meals if m.protein_source == 'Eggs']))
+  print('')
+
+  print('Unit test of tableFromMealSet and the float32 mode:')
+  table32 = tableFromMealSet(meal_set, nutrDB.getAllFoods(), np.float32)
+  print(2*table32.quantities.nbytes == meal_table.quantities.nbytes)
+  print(np.allclose(table32.quantities, meal_table.quantities, rtol=1e-6))
+  print('')
+
+  print('Unit test of MealTable.computeAllEnvironmentalImpacts:')
+  envDB = envDBmodule.EnvironmentalDatabase()
+  meal_set.computeAllEnvironmentalImpacts(envDB, Batch=False)
+  meal_table.computeAllEnvironmentalImpacts(envDB)
+  print(all(meal_table[i].impact == meal_set[i].impact for i in range(len(meal_set))))
+  print(meal_table.total_impact == meal_set.total_impact)
+  unused_unknown = MealTable(meal_table.foods + ['Unknown food'], meal_table.food_indices[:2], meal_table.quantities[:2])
+  unused_unknown.computeAllEnvironmentalImpacts(envDB)
+  print(np.array_equal(unused_unknown.impacts, meal_table.impacts[:2]))
+  used_unknown = meal_table[:2]
+  used_unknown.foods[used_unknown.food_indices[0, 0]] = 'Unknown food'
+  try:
+    used_unknown.computeAllEnvironmentalImpacts(envDB)
+    print(False)
+  except KeyError:
+    print(True)
+  print('')
+
+  print('Unit test of the chained MealView filters:')
+  my_ratings = {food: 3 for food in nutrDB.getAllFoods()}
+  my_ratings['Coffee'] = 0
+  my_thresholds = envDBmodule.EnvironmentalImpact([2.0, 1.5, 15.0, 10.0, 3000])
+  view = meal_table.filterBasedOnEnvironmentalImpact(my_thresholds).filterBasedOnUserVeto(my_ratings)
+  expected = meal_set.filterBasedOnEnvironmentalImpact(my_thresholds).filterBasedOnUserVeto(my_ratings)
+  print(view.table is meal_table and len(view) == len(expected))
+  print(len(view) > 0 and view[0].getFoods() == expected[0].getFoods() and view.total_impact == expected.total_impact)
+  print(len(view.filterBasedOnMinimalMealSatisfaction(my_ratings, 18)) == len(view))
+  partial_ratings = dict(my_ratings)
+  del partial_ratings[meal_table.foods[meal_table.food_indices[0, 0]]]
+  try:
+    meal_table.filterBasedOnUserVeto(partial_ratings)
+    print(False)
+  except KeyError:
+    print(True)
+  print('')
+
+  print('Unit test of MealTable.filterBasedOnParetoDominance:')
+  front = meal_table.filterBasedOnParetoDominance()
+  impacts = meal_table.impacts
+  print(0 < len(front) < len(meal_table))
+  print(not np.any([np.any(paretomodule.dominates(impacts, impacts[row])) for row in front.rows[:50]]))
+  two_layers = view.filterBasedOnParetoDominance(2)
+  print(len(two_layers) > len(view.filterBasedOnParetoDominance()) and np.all(np.isin(two_layers.rows, view.rows)))
+  print('')
+
+  print('Unit test of MealTable.getTopMeals:')
+  top_meals = meal_table.getTopMeals(10, [1, 1, 0, 0, 1])
+  expected_top = meal_set.getTopMeals(10, [1, 1, 0, 0, 1])
+  print([meal.getFoods() for meal in top_meals] == [meal.getFoods() for meal in expected_top.meals])
+  print(np.all(np.isin(view.getTopMeals(5, [0, 0, 1, 0, 0]).food_indices, view.toTable().food_indices)))
@@ -5,13 +5,18 @@
 
 # External librairies
 
-import pandas as pd
+import concurrent.futures
+import numpy as np
+# pandas (and openpyxl) are only imported by loadFromFile when the parsed data is not in the cache
 
 
 # Local modules
 
 import myutils
+import dbcachemodule
+import foodtablemodule
 import mealmodule
+import mealtablemodule
 
 ###########################
 # Class NutritionDatabase #
@@ -19,20 +24,25 @@ import mealmodule
 
 class NutritionDatabase(object):
 
-  def __init__(self, Filepath=''):
+  def __init__(self, Filepath='', UseCache=True):
     """
-    Parameters passed in data mode: Filepath
+    Parameters passed in data mode: Filepath, UseCache
     Parameters passed in data/result mode: [none]
     Parameters passed in result mode: self
     Preconditions: 
       - Filepath, when given, is the path to an XLSX file containing a sheet called 'FAOdata'
       - In this sheet, the first line contains the headers 'Product', 'Type', 'kcalPerRetailUnit', 'gProteinPerRetailUnit', 'gCarbPerRetailUnit', 'gFatPerRetailUnit' 
+      - UseCache is passed to loadFromFile
     Postconditions:       
       - self.protein_sources, self.carb_sources, self.fat_sources, self.vegetables, self.fruits and self.extras are non-empty lists of strings
       - self.kcal_dict associates to each food the number of kcal brought by 1 retail unit (1kg or 1L) of that food
       - self.gProt_dict associates to each food the number of grams of protein brought by 1 retail unit (1kg or 1L) of that food
       - self.gCarb_dict associates to each food the number of grams of carbohydrates brought by 1 retail unit (1kg or 1L) of that food
       - self.gFat_dict associates to each food the number of grams of fat brought by 1 retail unit (1kg or 1L) of that food
+      - self.food_table is a FoodTable (see module foodtablemodule) holding the same data as the dictionaries
+      - self.triple_inverses caches the result of getTripleInverses (None until it is first called)
+      - self.triple_positions associates to each protein, carb and fat source its position in its list
+        (None until getTripleInverses is first called)
     Result: self
     """
     self.protein_sources = []
@@ -45,10 +55,13 @@ class NutritionDatabase(object):
     self.gProt_dict = {}
     self.gCarb_dict = {}
     self.gFat_dict = {}
+    self.food_table = None
+    self.triple_inverses = None
+    self.triple_positions = None
     if Filepath == '':
       self.loadDefault()
     else:
-      self.loadFromFile(Filepath)
+      self.loadFromFile(Filepath, UseCache)
   
   def loadDefault(self):
     """
@@ -147,19 +160,23 @@ class NutritionDatabase(object):
                   'Root Vegetables': 81.6,
                   'Other Vegetables': 36.6}
 
+    self.buildFoodTable()
 
 
 
 
-  def loadFromFile(self, Filepath):
+
+  def loadFromFile(self, Filepath, UseCache=True):
     """
-    Parameters passed in data mode: Filepath
+    Parameters passed in data mode: Filepath, UseCache
     Parameters passed in data/result mode: self
     Parameters passed in result mode: [none]
     Preconditions: 
       - Filepath is the path to an XLSX file containing a sheet called 'FAOdata'
       - In this sheet, the first line contains the headers 'Product', 'Type', 'kcalPerRetailUnit', 'gProteinPerRetailUnit', 'gCarbPerRetailUnit', 'gFatPerRetailUnit' 
     Postconditions:       
+      - if UseCache is True (default), the parsed contents are read from the cache of module dbcachemodule when it
+        holds an entry for the current contents of the file; otherwise the file is parsed and the cache entry is written
       - self.protein_sources, self.carb_sources, self.fat_sources, self.vegetables, self.fruits and self.extras are non-empty lists of strings
       - self.kcal_dict associates to each food the number of kcal brought by 1 retail unit (1kg or 1L) of that food
       - self.gProt_dict associates to each food the number of grams of protein brought by 1 retail unit (1kg or 1L) of that food
@@ -167,17 +184,76 @@ class NutritionDatabase(object):
       - self.gFat_dict associates to each food the number of grams of fat brought by 1 retail unit (1kg or 1L) of that food
     Result: [none]
     """
-    nutr_data = pd.read_excel(Filepath, sheet_name='FAOdata')
-    self.protein_sources = list(nutr_data[nutr_data['Type']=='ProteinSource']['Product'])
-    self.carb_sources    = list(nutr_data[nutr_data['Type']=='CarbSource']['Product'])
-    self.fat_sources     = list(nutr_data[nutr_data['Type']=='FatSource']['Product'])
-    self.vegetables      = list(nutr_data[nutr_data['Type']=='Vegetable']['Product'])
-    self.fruits          = list(nutr_data[nutr_data['Type']=='Fruit']['Product'])
-    self.extras          = list(nutr_data[nutr_data['Type']=='Extra']['Product'])
-    self.kcal_dict  = dict(zip(nutr_data['Product'], nutr_data['kcalPerRetailUnit']))
-    self.gProt_dict = dict(zip(nutr_data['Product'], nutr_data['gProteinPerRetailUnit']))
-    self.gFat_dict  = dict(zip(nutr_data['Product'], nutr_data['gFatPerRetailUnit']))
-    self.gCarb_dict = dict(zip(nutr_data['Product'], nutr_data['gCarbPerRetailUnit']))
+    cached = dbcachemodule.loadParsedData('nutrition', Filepath) if UseCache else None
+    if cached is not None:
+      (header, arrays) = cached
+      products = header['products']
+      self.protein_sources = header['protein_sources']
+      self.carb_sources    = header['carb_sources']
+      self.fat_sources     = header['fat_sources']
+      self.vegetables      = header['vegetables']
+      self.fruits          = header['fruits']
+      self.extras          = header['extras']
+      self.kcal_dict  = dict(zip(products, arrays['kcal'].tolist()))
+      self.gProt_dict = dict(zip(products, arrays['gProt'].tolist()))
+      self.gFat_dict  = dict(zip(products, arrays['gFat'].tolist()))
+      self.gCarb_dict = dict(zip(products, arrays['gCarb'].tolist()))
+    else:
+      import pandas as pd
+      nutr_data = pd.read_excel(Filepath, sheet_name='FAOdata')
+      self.protein_sources = list(nutr_data[nutr_data['Type']=='ProteinSource']['Product'])
+      self.carb_sources    = list(nutr_data[nutr_data['Type']=='CarbSource']['Product'])
+      self.fat_sources     = list(nutr_data[nutr_data['Type']=='FatSource']['Product'])
+      self.vegetables      = list(nutr_data[nutr_data['Type']=='Vegetable']['Product'])
+      self.fruits          = list(nutr_data[nutr_data['Type']=='Fruit']['Product'])
+      self.extras          = list(nutr_data[nutr_data['Type']=='Extra']['Product'])
+      self.kcal_dict  = dict(zip(nutr_data['Product'], nutr_data['kcalPerRetailUnit']))
+      self.gProt_dict = dict(zip(nutr_data['Product'], nutr_data['gProteinPerRetailUnit']))
+      self.gFat_dict  = dict(zip(nutr_data['Product'], nutr_data['gFatPerRetailUnit']))
+      self.gCarb_dict = dict(zip(nutr_data['Product'], nutr_data['gCarbPerRetailUnit']))
+      if UseCache:
+        products = list(self.kcal_dict)
+        header = {'products': products, 'protein_sources': self.protein_sources, 'carb_sources': self.carb_sources, 
+                  'fat_sources': self.fat_sources, 'vegetables': self.vegetables, 'fruits': self.fruits, 'extras': self.extras}
+        arrays = {'kcal': np.array([self.kcal_dict[p] for p in products], dtype=float),
+                  'gProt': np.array([self.gProt_dict[p] for p in products], dtype=float),
+                  'gFat': np.array([self.gFat_dict[p] for p in products], dtype=float),
+                  'gCarb': np.array([self.gCarb_dict[p] for p in products], dtype=float)}
+        dbcachemodule.saveParsedData('nutrition', Filepath, header, arrays)
+    self.buildFoodTable()
+
+
+  def buildFoodTable(self):
+    """
+    Parameters passed in data mode: [none]
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions:
+      - self.food_table is a new frozen FoodTable built from the food lists and the four dictionaries of self:
+        the foods of self.getAllFoods() come first (in this order), followed by the other foods of self.kcal_dict;
+        missing values are stored as NaN
+      - this method must be called again if the lists or dictionaries of self are modified
+      - the cached inverses and positions of getTripleInverses are discarded
+    Result: [none]
+    """
+    foods = []
+    categories = []
+    category_lists = [self.protein_sources, self.carb_sources, self.fat_sources, self.vegetables, self.fruits, self.extras]
+    for (category, category_foods) in zip(foodtablemodule.CATEGORIES, category_lists):
+      for food in category_foods:
+        if food not in foods:
+          foods.append(food)
+          categories.append(category)
+    for food in self.kcal_dict:
+      if food not in foods:
+        foods.append(food)
+        categories.append(None)
+    nan = float('nan')
+    nutrients = [ [self.kcal_dict.get(food, nan), self.gProt_dict.get(food, nan), self.gCarb_dict.get(food, nan), self.gFat_dict.get(food, nan)] for food in foods ]
+    self.food_table = foodtablemodule.FoodTable(foods, categories, nutrients)
+    self.triple_inverses = None
+    self.triple_positions = None
 
     
   def isComplete(self):
@@ -242,12 +318,12 @@ class NutritionDatabase(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Food is a string
-      - Food exists as a key in self.kcal_dict
+      - Food exists as a key in self.kcal_dict (the value is read from self.food_table)
       - Qty is a float, expressed in the same units used in self (typically kg or L)
     Postconditions: [none]
     Result: number of calories brought by the given Qty of Food
     """
-    return (Qty*self.kcal_dict[Food])
+    return (Qty*self.food_table.nutrients[self.food_table.food_ids[Food], foodtablemodule.KCAL])
 
   def getGProt(self, Food, Qty=1.0):
     """
@@ -256,12 +332,12 @@ class NutritionDatabase(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Food is a string
-      - Food exists as a key in self.gProt_dict
+      - Food exists as a key in self.gProt_dict (the value is read from self.food_table)
       - Qty is a float, expressed in the same units used in self (typically kg or L)
     Postconditions: [none]
     Result: number of grams of proteins brought by the given Qty of Food
     """
-    return (Qty*self.gProt_dict[Food])
+    return (Qty*self.food_table.nutrients[self.food_table.food_ids[Food], foodtablemodule.GPROT])
 
   def getGCarb(self, Food, Qty=1.0):
     """
@@ -270,12 +346,12 @@ class NutritionDatabase(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Food is a string
-      - Food exists as a key in self.gCarb_dict
+      - Food exists as a key in self.gCarb_dict (the value is read from self.food_table)
       - Qty is a float, expressed in the same units used in self (typically kg or L)
     Postconditions: [none]
     Result: number of grams of carbohydrates brought by the given Qty of Food
     """
-    return (Qty*self.gCarb_dict[Food])
+    return (Qty*self.food_table.nutrients[self.food_table.food_ids[Food], foodtablemodule.GCARB])
 
   def getGFat(self, Food, Qty=1.0):
     """
@@ -284,12 +360,12 @@ class NutritionDatabase(object):
     Parameters passed in result mode: [none]
     Preconditions: 
       - Food is a string
-      - Food exists as a key in self.gFat_dict
+      - Food exists as a key in self.gFat_dict (the value is read from self.food_table)
       - Qty is a float, expressed in the same units used in self (typically kg or L)
     Postconditions: [none]
     Result: number of grams of fat brought by the given Qty of Food
     """
-    return (Qty*self.gFat_dict[Food])
+    return (Qty*self.food_table.nutrients[self.food_table.food_ids[Food], foodtablemodule.GFAT])
 
   def getStringDesc(self, Food, Qty=1.0):
     """
@@ -334,7 +410,156 @@ class NutritionDatabase(object):
     return all_meals
 
 
-  def enumerateAllPossibleMealsWithQuantities(self, MealKcalTarget, ExtraQtyDict):
+  def getNutrientMatrix(self, Foods):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - Foods is a list of strings, each of them existing as a key in the four dictionaries in self
+    Postconditions: [none]
+    Result: a numpy array of shape (len(Foods), 4) whose row i contains the number of kcal, grams of protein,
+    grams of carbohydrates and grams of fat (in this order) brought by 1 retail unit of Foods[i], gathered from self.food_table
+    """
+    return self.food_table.nutrients[self.food_table.getIds(Foods)]
+
+
+  def getCombinationGrids(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - the database (self) is complete and consistent
+    Postconditions:
+      - a ValueError exception is thrown if a food belongs to several categories (the positions in
+        self.getAllFoods() would then no longer be the ids of self.food_table, which de-duplicates the foods)
+        or if self.food_table is out of date
+    Result: a tuple (triples, sides) of int arrays, containing the positions in self.getAllFoods() of:
+      - triples: every (protein source, carb source, fat source), shape (P*C*F, 3)
+      - sides: every (vegetable, fruit, extra), shape (V*Fr*E, 3)
+    both in the order of the nested loops of enumerateAllPossibleMeals, so that meal number
+    t*len(sides) + s is made of triples[t] and sides[s]
+    """
+    all_foods = self.getAllFoods()
+    duplicates = sorted(set(food for food in all_foods if all_foods.count(food) > 1))
+    if len(duplicates) > 0:
+      raise ValueError('Foods listed in several categories: ' + ', '.join(duplicates) + '.')
+    if list(self.food_table.foods[:len(all_foods)]) != all_foods:
+      raise ValueError('The food table is out of date, buildFoodTable should be called.')
+    categories = [self.protein_sources, self.carb_sources, self.fat_sources, self.vegetables, self.fruits, self.extras]
+    sizes = [len(category) for category in categories]
+    offsets = np.cumsum([0] + sizes[:-1])
+    triples = (np.indices(sizes[:3]).reshape(3, -1).T + offsets[:3])
+    sides = (np.indices(sizes[3:]).reshape(3, -1).T + offsets[3:])
+    return (triples, sides)
+
+
+  def getMacroNutrientMatrices(self, Triples):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - Triples is an int array of shape (T, 3) as returned by getCombinationGrids
+    Postconditions: [none]
+    Result: a float array of shape (T, 3, 3) containing, for each triple, the matrix of Meal.computeQuantities
+    (kcal brought by the proteins, carbohydrates and fat of 1 retail unit of each of the three foods)
+    """
+    nutrients = self.food_table.nutrients
+    a = np.empty((len(Triples), 3, 3))
+    a[:, 0, :] = 4*nutrients[Triples, foodtablemodule.GPROT]
+    a[:, 1, :] = 4*nutrients[Triples, foodtablemodule.GCARB]
+    a[:, 2, :] = 8.8*nutrients[Triples, foodtablemodule.GFAT]
+    return a
+
+
+  def getTripleNumbers(self, Triples):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - Triples is an int array of shape (T, 3) whose rows are rows of the triples of getCombinationGrids
+    Postconditions: [none]
+    Result: the int array of the positions of the rows of Triples in the triples of getCombinationGrids
+    """
+    nb_prot = len(self.protein_sources)
+    nb_carb = len(self.carb_sources)
+    nb_fat = len(self.fat_sources)
+    return (Triples[:, 0]*nb_carb + (Triples[:, 1] - nb_prot))*nb_fat + (Triples[:, 2] - nb_prot - nb_carb)
+
+
+  def getTripleInverses(self):
+    """
+    Parameters passed in data mode: [none]
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - the database (self) is complete and consistent
+    Postconditions:
+      - the result is computed at the first call and cached in self.triple_inverses (see buildFoodTable)
+      - self.triple_positions is built at the same time, for getTripleInverse
+    Result: a tuple (inverses, is_singular) where inverses is a read-only (T,3,3) float array containing the inverse
+    of the matrix of Meal.computeQuantities of each triple of getCombinationGrids, and is_singular a (T,) boolean
+    array, True for the triples whose matrix is singular or contains NaN (their inverse is filled with NaN, so
+    that the quantities computed with it are NaN, hence invalid)
+    """
+    if self.triple_inverses is None:
+      (triples, sides) = self.getCombinationGrids()
+      a = self.getMacroNutrientMatrices(triples)
+      is_singular = np.any(np.isnan(a), axis=(1, 2))
+      a[is_singular] = np.eye(3)
+      is_singular |= (np.linalg.det(a) == 0)
+      a[is_singular] = np.eye(3)
+      inverses = np.linalg.inv(a)
+      inverses[is_singular] = np.nan
+      inverses.setflags(write=False)
+      is_singular.setflags(write=False)
+      self.triple_inverses = (inverses, is_singular)
+      self.triple_positions = {}
+      for sources in [self.protein_sources, self.carb_sources, self.fat_sources]:
+        for (position, food) in enumerate(sources):
+          self.triple_positions[food] = position
+    return self.triple_inverses
+
+
+  def getTripleInverse(self, ProteinSource, CarbSource, FatSource):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - ProteinSource, CarbSource and FatSource belong to self.protein_sources, self.carb_sources and self.fat_sources
+        (a KeyError is raised for a food that is in none of these lists)
+    Postconditions: [none]
+    Result: the inverse of the matrix of Meal.computeQuantities for this triple, as a list of 3 lists of 3 floats
+    (filled with NaN if the matrix is singular), taken from getTripleInverses
+    """
+    (inverses, is_singular) = self.getTripleInverses()
+    positions = self.triple_positions
+    number = (positions[ProteinSource]*len(self.carb_sources) + positions[CarbSource])*len(self.fat_sources) + positions[FatSource]
+    return inverses[number].tolist()
+
+
+  def getSideQuantities(self, Sides, ExtraQtyDict):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - Sides is an int array of shape (S, 3) as returned by getCombinationGrids
+      - ExtraQtyDict contains an entry for each food in self.extras
+    Postconditions: [none]
+    Result: a tuple of three float arrays of shape (S,) containing the quantities of vegetable (200g),
+    of fruit (100g) and of extra (taken from ExtraQtyDict) of each side
+    """
+    all_foods = self.getAllFoods()
+    extra_qty = np.array([ExtraQtyDict[all_foods[i]] for i in Sides[:, 2].tolist()], dtype=float)
+    return (np.full(len(Sides), 0.200), np.full(len(Sides), 0.100), extra_qty)
+
+
+  def computeAllQuantities(self, MealKcalTarget, ExtraQtyDict):
     """
     Parameters passed in data mode: [all]
     Parameters passed in data/result mode: [none]
@@ -344,10 +569,173 @@ class NutritionDatabase(object):
       - MealKcalTarget is a positive integer or float 
       - ExtraQtyDict contains an entry for each food in self.extras
     Postconditions: [none]
-    Result: An instance of class MealSet containing the set of all meals that can be assembled to reach MealKcalTarget
+    Result: a tuple (food_indices, quantities, is_valid) describing all possible meals, in the same order
+    as enumerateAllPossibleMeals:
+      - food_indices is an (N,6) int array, each row containing the position in self.getAllFoods() of the 
+        source of protein, the source of carbohydrates, the source of fat, the vegetable, the fruit and the extra
+      - quantities is an (N,6) float array containing the quantities computed as in Meal.computeQuantities
+      - is_valid is an (N,) boolean array, False for the meals whose system is singular or whose solution
+        contains a negative quantity (the quantities of these meals are meaningless)
+    The systems are solved with the cached inverses of getTripleInverses, with exactly the same floating-point
+    operations as the meal-by-meal path (see applyInverse).
+    """
+    (triples, sides) = self.getCombinationGrids()
+    return self.computeQuantitiesOfTriples(triples, sides, MealKcalTarget, ExtraQtyDict)
+
+
+  def computeQuantitiesOfTriples(self, Triples, Sides, MealKcalTarget, ExtraQtyDict):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - the database (self) is complete and consistent
+      - Triples and Sides are int arrays as returned by getCombinationGrids (Triples may be any slice of them)
+      - MealKcalTarget is a positive integer or float 
+      - ExtraQtyDict contains an entry for each food in self.extras
+    Postconditions: [none]
+    Result: the tuple (food_indices, quantities, is_valid) of computeAllQuantities, restricted to the meals
+    made of one of the Triples and one of the Sides (len(Triples)*len(Sides) rows, triple-major). Each system
+    is solved independently, so the result does not depend on how the triples are split into blocks.
+    """
+    nutrients = self.getNutrientMatrix(self.getAllFoods())
+    gprot = nutrients[:, 1]
+    gcarb = nutrients[:, 2]
+    gfat = nutrients[:, 3]
+
+    # The inverse of the 3x3 matrix of each (protein, carb, fat) triple is computed once per database
+    (inverses, is_singular) = self.getTripleInverses()
+    inverses = inverses[self.getTripleNumbers(Triples)]
+
+    # One right-hand side per (vegetable, fruit, extra) triple
+    (vegetable_qty, fruit_qty, extra_qty) = self.getSideQuantities(Sides, ExtraQtyDict)
+    veg, fruit, extra = Sides[:, 0], Sides[:, 1], Sides[:, 2]
+    b = np.empty((len(Sides), 3))
+    b[:, 0] = 0.15*MealKcalTarget - 4*(vegetable_qty*gprot[veg]) - 4*(fruit_qty*gprot[fruit]) - 4*(extra_qty*gprot[extra])
+    b[:, 1] = 0.55*MealKcalTarget - 4*(vegetable_qty*gcarb[veg]) - 4*(fruit_qty*gcarb[fruit]) - 4*(extra_qty*gcarb[extra])
+    b[:, 2] = 0.30*MealKcalTarget - 8.8*(vegetable_qty*gfat[veg]) - 8.8*(fruit_qty*gfat[fruit]) - 8.8*(extra_qty*gfat[extra])
+
+    x = applyInverse(inverses[:, None, :, :], b[None, :, :]).reshape(-1, 3)   # shape (nb triples * nb sides, 3)
+
+    food_indices = np.concatenate([np.repeat(Triples, len(Sides), axis=0), np.tile(Sides, (len(Triples), 1))], axis=1)
+    quantities = np.concatenate([x, np.tile(np.stack([vegetable_qty, fruit_qty, extra_qty], axis=1), (len(Triples), 1))], axis=1)
+    is_valid = np.all(x >= 0, axis=1) # False for the singular systems, whose x is NaN
+
+    # Just a quick check that we actually reach the calorie target
+    sum_kcal = np.sum(quantities[is_valid]*nutrients[food_indices[is_valid], 0], axis=1)
+    absdiff = np.abs(sum_kcal - MealKcalTarget)
+    assert(np.all((absdiff <= 1e-6) | (absdiff < 1e-3*np.maximum(np.abs(sum_kcal), abs(MealKcalTarget)))))
+    return (food_indices, quantities, is_valid)
+
+
+  def iterValidMealBatches(self, MealKcalTarget, ExtraQtyDict, BatchSize=10000, AsMeals=False, Dtype=np.float64):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - the database (self) is complete and consistent
+      - MealKcalTarget is a positive integer or float 
+      - ExtraQtyDict contains an entry for each food in self.extras
+      - BatchSize is a positive integer
+    Postconditions:
+      - the combinations are solved by blocks of about BatchSize meals, so that the memory used does not
+        depend on the number of possible meals (see module mealstreammodule to consume the batches)
+    Result: a generator of MealTables (of MealSets if AsMeals is True) of exactly BatchSize valid meals,
+    except the last one which may be smaller. Their concatenation contains the same meals, with the same
+    quantities and in the same order, as enumerateAllPossibleMealsWithQuantities(MealKcalTarget, ExtraQtyDict).
+    """
+    (triples, sides) = self.getCombinationGrids()
+    nb_triples_per_block = max(1, BatchSize // max(len(sides), 1))
+    pending = [] # (food_indices, quantities) of the valid meals not yet yielded
+    nb_pending = 0
+    for start in range(0, len(triples), nb_triples_per_block):
+      (food_indices, quantities, is_valid) = self.computeQuantitiesOfTriples(triples[start:start+nb_triples_per_block], sides, MealKcalTarget, ExtraQtyDict)
+      pending.append((food_indices[is_valid], quantities[is_valid]))
+      nb_pending += int(np.count_nonzero(is_valid))
+      while nb_pending >= BatchSize or (nb_pending > 0 and start + nb_triples_per_block >= len(triples)):
+        food_indices = np.concatenate([block[0] for block in pending])
+        quantities = np.concatenate([block[1] for block in pending])
+        batch = mealtablemodule.MealTable(self.food_table.foods, food_indices[:BatchSize], quantities[:BatchSize], Dtype=Dtype)
+        pending = [(food_indices[BatchSize:], quantities[BatchSize:])]
+        nb_pending = len(pending[0][0])
+        yield batch.toMealSet() if AsMeals else batch
+
+
+  def computeValidQuantities(self, MealKcalTarget, ExtraQtyDict, NbWorkers=1):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - the database (self) is complete and consistent
+      - MealKcalTarget is a positive integer or float 
+      - ExtraQtyDict contains an entry for each food in self.extras
+      - NbWorkers is a positive integer
+    Postconditions:
+      - if NbWorkers > 1, the (protein, carb, fat) triples are split into shards, one per protein source (or more,
+        so that there are at least NbWorkers shards), which are solved by a pool of NbWorkers processes
+    Result: a tuple (food_indices, quantities, nb_meals) where food_indices and quantities are the rows of
+    computeAllQuantities for the valid meals only, in the order of enumerateAllPossibleMeals whatever NbWorkers,
+    and nb_meals is the number of possible meals (valid or not)
+    """
+    (triples, sides) = self.getCombinationGrids()
+    if NbWorkers <= 1:
+      (food_indices, quantities, is_valid) = self.computeQuantitiesOfTriples(triples, sides, MealKcalTarget, ExtraQtyDict)
+      return (food_indices[is_valid], quantities[is_valid], len(is_valid))
+
+    # triples are sorted by protein source, so each shard is a contiguous range of triples
+    boundaries = np.flatnonzero(np.diff(triples[:, 0])) + 1
+    shards = np.split(np.arange(len(triples)), boundaries)
+    nb_splits = -(-NbWorkers // len(shards))
+    shards = [piece for shard in shards for piece in np.array_split(shard, min(nb_splits, len(shard)))]
+    tasks = [(triples[shard], sides, MealKcalTarget, ExtraQtyDict) for shard in shards]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=NbWorkers, initializer=_initWorker, initargs=(self,)) as executor:
+      results = list(executor.map(_solveShard, tasks)) # map returns the results in the order of the shards
+    food_indices = np.concatenate([result[0] for result in results])
+    quantities = np.concatenate([result[1] for result in results])
+    return (food_indices, quantities, len(triples)*len(sides))
+
+
+  def enumerateAllPossibleMealsWithQuantities(self, MealKcalTarget, ExtraQtyDict, Batch=True, AsTable=False, Dtype=np.float64, NbWorkers=1):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: 
+      - the database (self) is complete and consistent
+      - MealKcalTarget is a positive integer or float 
+      - ExtraQtyDict contains an entry for each food in self.extras
+      - if Batch is True (default), all quantities are computed at once with computeAllQuantities;
+        otherwise, Meal.computeQuantities is called for each meal
+      - if AsTable is True, the meals are returned as a columnar MealTable (see module mealtablemodule),
+        whose float columns use Dtype (np.float64 or np.float32)
+      - if NbWorkers > 1, the batch computation is shared between NbWorkers processes (see computeValidQuantities);
+        the result is the same as with NbWorkers = 1, and Batch is then ignored
+    Postconditions: [none]
+    Result: An instance of class MealSet (or MealTable if AsTable is True) containing the set of all meals 
+    that can be assembled to reach MealKcalTarget
     """
     all_valid_meals_with_quantities = mealmodule.MealSet()
     nb_impossible_meals = 0
+    if Batch or AsTable or NbWorkers > 1:
+      (food_indices, quantities, nb_meals) = self.computeValidQuantities(MealKcalTarget, ExtraQtyDict, NbWorkers)
+      if AsTable:
+        nb_impossible_meals = nb_meals - len(food_indices)
+        print('There were', nb_impossible_meals, 'impossible meals (', 100*nb_impossible_meals/nb_meals, '%).')
+        return mealtablemodule.MealTable(self.food_table.foods, food_indices, quantities, Dtype=Dtype)
+      all_foods = self.getAllFoods()
+      valid_meals = []
+      for (indices, qty) in zip(food_indices.tolist(), quantities.tolist()):
+        meal = mealmodule.Meal([all_foods[i] for i in indices], qty)
+        meal.is_nutritionally_valid = True
+        valid_meals.append(meal)
+      all_valid_meals_with_quantities.addMeals(valid_meals)
+      nb_impossible_meals = nb_meals - len(valid_meals)
+      fraction_impossible = nb_impossible_meals / nb_meals
+      print('There were', nb_impossible_meals, 'impossible meals (', 100*fraction_impossible, '%).')
+      return all_valid_meals_with_quantities
+
     for prot_source in self.protein_sources:
       for carb in self.carb_sources:
         for fat in self.fat_sources:
@@ -373,6 +761,54 @@ class NutritionDatabase(object):
 
 
 
+########################
+# Function definitions #
+########################
+
+def applyInverse(Inverse, B):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Inverse is an array of shape (..., 3, 3) (or a list of 3 lists of 3 floats) and B an array of
+      shape (..., 3) (or a list of 3 floats), broadcastable together
+  Postconditions: [none]
+  Result: the product Inverse.B, of shape (..., 3), written out term by term so that a single meal (with floats)
+  and a whole batch (with arrays) go through exactly the same floating-point operations
+  """
+  if isinstance(B, list):
+    return [Inverse[i][0]*B[0] + Inverse[i][1]*B[1] + Inverse[i][2]*B[2] for i in range(3)]
+  return np.stack([Inverse[..., i, 0]*B[..., 0] + Inverse[..., i, 1]*B[..., 1] + Inverse[..., i, 2]*B[..., 2] for i in range(3)], axis=-1)
+
+
+# Database used by the worker processes of computeValidQuantities (set once per process by _initWorker)
+_worker_database = None
+
+
+def _initWorker(NutrDB):
+  global _worker_database
+  _worker_database = NutrDB
+
+
+def _solveShard(Task):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Task is a tuple (triples, sides, MealKcalTarget, ExtraQtyDict), see computeQuantitiesOfTriples
+    - _initWorker has been called in this process
+  Postconditions: [none]
+  Result: a tuple (food_indices, quantities) of the valid meals of the shard (module-level, so that it can be
+  sent to the worker processes)
+  """
+  (triples, sides, meal_kcal_target, extra_qty_dict) = Task
+  (food_indices, quantities, is_valid) = _worker_database.computeQuantitiesOfTriples(triples, sides, meal_kcal_target, extra_qty_dict)
+  return (food_indices[is_valid], quantities[is_valid])
+
+
+
 ################
 # Main program #
 ################
@@ -410,3 +846,59 @@ if __name__ == "__main__":
   print('Here is the last one.')
   (all_valid_meals_with_quantities[-1]).printNutritionalInfo(myDB)
 
+  print('')
+
+
+  print('Unit test of the batch path of enumerateAllPossibleMealsWithQuantities:')
+  scalar_meals = myDB.enumerateAllPossibleMealsWithQuantities(0.4*daily_energy_req, extra_qty_dict, Batch=False)
+  same_meals = (len(scalar_meals) == len(all_valid_meals_with_quantities))
+  for (m1, m2) in zip(scalar_meals.meals, all_valid_meals_with_quantities.meals):
+    if m1.getFoods() != m2.getFoods() or m1.getQuantities() != m2.getQuantities():
+      same_meals = False
+      break
+  print(same_meals)
+  print('')
+
+
+  print('Unit test of NutritionDatabase.getCombinationGrids:')
+  (triples, sides) = myDB.getCombinationGrids()
+  print(list(myDB.food_table.foods[:len(myDB.getAllFoods())]) == myDB.getAllFoods())
+  print([myDB.getAllFoods()[i] for i in triples[-1]] == [myDB.protein_sources[-1], myDB.carb_sources[-1], myDB.fat_sources[-1]])
+  overlapping_DB = NutritionDatabase()
+  overlapping_DB.fruits = overlapping_DB.fruits + [overlapping_DB.vegetables[0]]
+  overlapping_DB.buildFoodTable()
+  try:
+    overlapping_DB.getCombinationGrids()
+    print(False)
+  except ValueError:
+    print(True)
+  print('')
+
+
+  print('Unit test of NutritionDatabase.getTripleInverse:')
+  (inverses, is_singular) = myDB.getTripleInverses()
+  print(myDB.getTripleInverse(myDB.protein_sources[-1], myDB.carb_sources[-1], myDB.fat_sources[-1]) == inverses[-1].tolist())
+  try:
+    myDB.getTripleInverse('Unknown food', myDB.carb_sources[0], myDB.fat_sources[0])
+    print(False)
+  except KeyError:
+    print(True)
+  print('')
+
+
+  print('Unit test of NutritionDatabase.iterValidMealBatches:')
+  meal_table = myDB.enumerateAllPossibleMealsWithQuantities(0.4*daily_energy_req, extra_qty_dict, AsTable=True)
+  batches = list(myDB.iterValidMealBatches(0.4*daily_energy_req, extra_qty_dict, BatchSize=1000))
+  print(all(len(batch) == 1000 for batch in batches[:-1]) and 0 < len(batches[-1]) <= 1000)
+  print(np.array_equal(np.concatenate([batch.food_indices for batch in batches]), meal_table.food_indices))
+  print(np.array_equal(np.concatenate([batch.quantities for batch in batches]), meal_table.quantities))
+  first_batch = next(myDB.iterValidMealBatches(0.4*daily_energy_req, extra_qty_dict, BatchSize=10, AsMeals=True))
+  print(len(first_batch) == 10 and first_batch[9].getQuantities() == all_valid_meals_with_quantities[9].getQuantities())
+  print('')
+
+
+  print('Unit test of the parallel mode of enumerateAllPossibleMealsWithQuantities:')
+  parallel_table = myDB.enumerateAllPossibleMealsWithQuantities(0.4*daily_energy_req, extra_qty_dict, AsTable=True, NbWorkers=4)
+  print(np.array_equal(parallel_table.food_indices, meal_table.food_indices) and np.array_equal(parallel_table.quantities, meal_table.quantities))
+  parallel_meals = myDB.enumerateAllPossibleMealsWithQuantities(0.4*daily_energy_req, extra_qty_dict, NbWorkers=3)
+  print(len(parallel_meals) == len(all_valid_meals_with_quantities) and parallel_meals[-1].getQuantities() == all_valid_meals_with_quantities[-1].getQuantities())
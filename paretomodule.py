@@ -0,0 +1,196 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import numpy as np
+
+
+#############
+# Constants #
+#############
+
+# Number of candidates compared at once with the current front (memory: 2 x BLOCK_SIZE x front size booleans)
+BLOCK_SIZE = 256
+
+# Number of rows of the front (those of lowest scores, which dominate the most rows) compared first with each
+# block, so that most of its rows are discarded before the comparison with the rest of the front
+NB_PRUNING_ROWS = 64
+
+
+########################
+# Function definitions #
+########################
+
+def dominates(A, B):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - A and B are arrays of impacts of the same length (or broadcastable arrays of impact rows)
+  Postconditions: [none]
+  Result: True (or a boolean array) where A dominates B, i.e. A is lower or equal to B on every indicator
+  and strictly lower on at least one of them
+  """
+  A = np.asarray(A)
+  B = np.asarray(B)
+  return np.all(A <= B, axis=-1) & np.any(A < B, axis=-1)
+
+
+def _dominanceMatrix(Candidates, Rows):
+  # (len(Candidates), len(Rows)) boolean matrix of dominates(Candidates[i], Rows[j]), built one indicator
+  # at a time to avoid a 3-dimensional temporary array
+  weak = np.ones((len(Candidates), len(Rows)), dtype=bool)
+  strict = np.zeros((len(Candidates), len(Rows)), dtype=bool)
+  for d in range(Rows.shape[1]):
+    weak &= (Candidates[:, None, d] <= Rows[None, :, d])
+    strict |= (Candidates[:, None, d] < Rows[None, :, d])
+  return weak & strict
+
+
+def paretoFrontMask(Impacts, BlockSize=BLOCK_SIZE):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Impacts is an (N,D) float array (typically the (N,5) impacts of a MealTable)
+  Postconditions:
+    - sort-filter skyline: the rows are visited by increasing sum of their normalized values, so that a row can
+      only be dominated by rows visited before it; each block of rows is compared with the front found so far
+      and with the previous rows of the block. The cost is O(N x size of the front) instead of O(N^2).
+  Result: an (N,) boolean array, True for the non-dominated rows (the Pareto front, or skyline). Rows with NaN
+  are never in the front; identical rows are all kept.
+  """
+  impacts = np.asarray(Impacts, dtype=np.float64)
+  mask = np.zeros(len(impacts), dtype=bool)
+  finite = np.flatnonzero(~np.any(np.isnan(impacts), axis=1))
+  if len(finite) == 0:
+    return mask
+  values = impacts[finite]
+  spans = values.max(axis=0) - values.min(axis=0)
+  scores = np.sum((values - values.min(axis=0))/np.where(spans > 0, spans, 1), axis=1)
+  # rows with the same score (possibly rounded) are visited in lexicographic order of their values, so that a row
+  # is still visited after the rows that dominate it
+  order = np.lexsort(tuple(values.T[::-1]) + (scores,))
+  values = values[order]
+  front = np.zeros((0, impacts.shape[1]))
+  front_positions = []
+  for start in range(0, len(values), BlockSize):
+    block = values[start:start+BlockSize]
+    # a row of the block is dominated by a row of the current front...
+    dominated = np.any(_dominanceMatrix(front[:NB_PRUNING_ROWS], block), axis=0)
+    candidates = np.flatnonzero(~dominated)
+    dominated[candidates] = np.any(_dominanceMatrix(front[NB_PRUNING_ROWS:], block[candidates]), axis=0)
+    # ...or by another row of the block (by transitivity, it does not matter whether that row is itself dominated)
+    candidates = np.flatnonzero(~dominated)
+    dominated[candidates] = np.any(_dominanceMatrix(block[candidates], block[candidates]), axis=0)
+    kept = np.flatnonzero(~dominated)
+    front = np.concatenate([front, block[kept]])
+    front_positions.append(start + kept)
+  mask[finite[order[np.concatenate(front_positions)]]] = True
+  return mask
+
+
+def paretoLayers(Impacts, NbLayers=None, BlockSize=BLOCK_SIZE):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Impacts is an (N,D) float array
+    - if specified, NbLayers is a positive integer
+  Postconditions:
+    - the front is peeled repeatedly: layer 0 is the Pareto front, layer 1 the front of the remaining rows, etc.;
+      only the first NbLayers layers are computed if NbLayers is specified
+  Result: an (N,) int array containing the layer of each row, or -1 for the rows beyond the computed layers
+  (and for the rows with NaN)
+  """
+  impacts = np.asarray(Impacts, dtype=np.float64)
+  layers = np.full(len(impacts), -1, dtype=np.int64)
+  remaining = np.flatnonzero(~np.any(np.isnan(impacts), axis=1))
+  layer = 0
+  while len(remaining) > 0 and (NbLayers is None or layer < NbLayers):
+    in_front = paretoFrontMask(impacts[remaining], BlockSize)
+    layers[remaining[in_front]] = layer
+    remaining = remaining[~in_front]
+    layer += 1
+  return layers
+
+
+def mergeParetoFronts(Fronts):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Fronts is a list of tuples (rows, impacts), each of them being the Pareto front of a chunk of the same
+      table: rows the int array of the positions of its meals in the table, impacts their (n,D) impacts
+  Postconditions: [none]
+  Result: a tuple (rows, impacts), the Pareto front of the union of the chunks (which is included in the
+  union of their fronts), the rows being sorted
+  """
+  if len(Fronts) == 0:
+    return (np.zeros(0, dtype=np.intp), np.zeros((0, 5)))
+  rows = np.concatenate([front[0] for front in Fronts])
+  impacts = np.concatenate([front[1] for front in Fronts])
+  mask = paretoFrontMask(impacts)
+  order = np.argsort(rows[mask], kind='stable')
+  return (rows[mask][order], impacts[mask][order])
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import time
+
+  def bruteForceFrontMask(Impacts):
+    mask = np.ones(len(Impacts), dtype=bool)
+    for i in range(len(Impacts)):
+      mask[i] = not np.any(dominates(Impacts, Impacts[i]))
+    return mask
+
+  generator = np.random.default_rng(0)
+
+  print('Unit test of paretoFrontMask:')
+  all_same = True
+  for (nb_rows, nb_dims) in [(1, 5), (50, 2), (700, 3), (3000, 5)]:
+    impacts = generator.random((nb_rows, nb_dims))
+    impacts[::7] = impacts[::7].round(1) # ties and duplicates
+    if not np.array_equal(paretoFrontMask(impacts, BlockSize=64), bruteForceFrontMask(impacts)):
+      all_same = False
+  print(all_same)
+  with_nan = generator.random((20, 5))
+  with_nan[3, 2] = np.nan
+  others = np.delete(np.arange(20), 3)
+  print(not paretoFrontMask(with_nan)[3] and np.array_equal(paretoFrontMask(with_nan)[others], bruteForceFrontMask(with_nan[others])))
+  rounded_scores = np.array([[0.5, 1e-17], [0.5, 0.0], [0.0, 1.0], [1.0, 0.0]]) # the first row is dominated by the second one, with the same rounded score
+  print(np.array_equal(paretoFrontMask(rounded_scores, BlockSize=1), bruteForceFrontMask(rounded_scores)))
+  print('')
+
+  print('Unit test of paretoLayers:')
+  impacts = generator.random((2000, 5))
+  layers = paretoLayers(impacts)
+  print(np.all(layers >= 0) and np.array_equal(layers == 0, paretoFrontMask(impacts)))
+  print(np.array_equal(paretoFrontMask(impacts[layers >= 1]), (layers[layers >= 1] == 1)))
+  print(np.all(paretoLayers(impacts, NbLayers=2)[layers >= 2] == -1))
+  print('')
+
+  print('Unit test of mergeParetoFronts:')
+  chunks = [np.arange(start, min(start + 300, len(impacts))) for start in range(0, len(impacts), 300)]
+  fronts = [(rows[paretoFrontMask(impacts[rows])], impacts[rows][paretoFrontMask(impacts[rows])]) for rows in chunks]
+  (rows, front) = mergeParetoFronts(fronts)
+  print(np.array_equal(rows, np.flatnonzero(paretoFrontMask(impacts))))
+  print('')
+
+  print('Performance of paretoFrontMask on 200000 rows:')
+  impacts = generator.random((200000, 5))
+  start = time.time()
+  mask = paretoFrontMask(impacts)
+  print('{0} non-dominated rows found in {1:.2f} s'.format(int(mask.sum()), time.time() - start))
@@ -0,0 +1,164 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import numpy as np
+
+
+# Local modules
+
+import mealtablemodule
+
+
+##########################
+# Class ImpactRangeIndex #
+##########################
+
+class ImpactRangeIndex(object):
+
+  def __init__(self, Table):
+    """
+    Parameters passed in data mode: Table
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - Table is a MealTable whose impacts have been computed, and which is not modified afterwards
+    Postconditions:
+      - for each of the five indicators, self.orders[d] contains the rows of Table sorted by increasing impact d
+        and self.sorted_impacts[d] the corresponding impacts (the rows with NaN come last)
+      - the index is built once (5 sorts) and can then answer any number of threshold queries
+    Result: self
+    """
+    self.table = Table
+    nb_meals = len(Table)
+    row_dtype = np.int32 if nb_meals < 2**31 else np.int64
+    self.orders = []
+    self.sorted_impacts = []
+    for d in range(Table.impacts.shape[1]):
+      order = np.argsort(Table.impacts[:, d], kind='stable').astype(row_dtype)
+      self.orders.append(order)
+      self.sorted_impacts.append(np.ascontiguousarray(Table.impacts[order, d]))
+
+
+  def __len__(self):
+    return len(self.table)
+
+
+  def getPrefixLengths(self, Thresholds):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Thresholds is an instance of class EnvironmentalImpact
+    Postconditions: [none]
+    Result: an int array containing, for each indicator d, the number of meals whose impact d is lower or equal
+    to its threshold (one binary search per indicator)
+    """
+    thresholds = Thresholds.toList()
+    return np.array([np.searchsorted(self.sorted_impacts[d], thresholds[d], side='right') for d in range(len(self.orders))])
+
+
+  def query(self, Thresholds):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Thresholds is an instance of class EnvironmentalImpact
+    Postconditions:
+      - only the meals of the shortest prefix (the indicator whose threshold is the most selective) are read and
+        checked against the other thresholds, so that the cost depends on the selectivity of the query and not
+        on the size of the table
+    Result: the increasing int array of the rows of the meals whose impact is lower or equal to Thresholds
+    (the same rows as filterBasedOnEnvironmentalImpact)
+    """
+    lengths = self.getPrefixLengths(Thresholds)
+    d = int(np.argmin(lengths))
+    candidates = np.sort(self.orders[d][:lengths[d]]).astype(np.intp)
+    mask = mealtablemodule.environmentFriendlyMask(self.table.impacts[candidates], Thresholds)
+    return candidates[mask]
+
+
+  def count(self, Thresholds):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Thresholds is an instance of class EnvironmentalImpact
+    Postconditions: [none]
+    Result: the number of meals whose impact is lower or equal to Thresholds (computed as in query, without sorting)
+    """
+    lengths = self.getPrefixLengths(Thresholds)
+    d = int(np.argmin(lengths))
+    candidates = self.orders[d][:lengths[d]]
+    return int(np.count_nonzero(mealtablemodule.environmentFriendlyMask(self.table.impacts[candidates], Thresholds)))
+
+
+  def filterBasedOnEnvironmentalImpact(self, Thresholds):
+    """
+    Parameters passed in data mode: self, Thresholds
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+     - Thresholds is an instance of class EnvironmentalImpact
+    Postconditions: [none]
+    Result: A MealView of the meals of the table whose impact is lower or equal to Thresholds, as
+    MealTable.filterBasedOnEnvironmentalImpact, computed with query
+    """
+    return mealtablemodule.MealView(self.table, self.query(Thresholds))
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import time
+  import envDBmodule
+  import nutritionDBmodule
+
+  nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+  envDB = envDBmodule.EnvironmentalDatabase('poore2018/DataS2.xlsx')
+  extra_qty_dict = {food: 0.010 for food in nutrDB.extras}
+  meal_table = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict, AsTable=True)
+  meal_table.computeAllEnvironmentalImpacts(envDB)
+  range_index = ImpactRangeIndex(meal_table)
+
+  print('Unit test of ImpactRangeIndex.query and ImpactRangeIndex.count:')
+  generator = np.random.default_rng(0)
+  quantiles = np.quantile(meal_table.impacts, generator.random((200, 5)), axis=0)
+  all_same = True
+  for i in range(len(quantiles)):
+    thresholds = envDBmodule.EnvironmentalImpact(np.diagonal(quantiles[i]).tolist())
+    expected = meal_table.filterBasedOnEnvironmentalImpact(thresholds)
+    if not np.array_equal(range_index.query(thresholds), expected.rows) or range_index.count(thresholds) != len(expected):
+      all_same = False
+  print(all_same)
+  exact = envDBmodule.EnvironmentalImpact(meal_table.impacts[123].tolist()) # the thresholds are inclusive
+  print(123 in range_index.query(exact).tolist())
+  print(range_index.count(envDBmodule.EnvironmentalImpact([0, 0, 0, 0, 0])) == 0)
+  print('')
+
+  print('Unit test of ImpactRangeIndex.filterBasedOnEnvironmentalImpact:')
+  my_thresholds = envDBmodule.EnvironmentalImpact([2.0, 1.5, 15.0, 10.0, 3000])
+  view = range_index.filterBasedOnEnvironmentalImpact(my_thresholds)
+  print(view.table is meal_table and view.total_impact == meal_table.filterBasedOnEnvironmentalImpact(my_thresholds).total_impact)
+  print('')
+
+  print('Performance of 1000 selective queries:')
+  strict = envDBmodule.EnvironmentalImpact(np.quantile(meal_table.impacts, 0.05, axis=0).tolist())
+  start = time.time()
+  for i in range(1000):
+    range_index.count(strict)
+  duration_index = time.time() - start
+  start = time.time()
+  for i in range(1000):
+    np.count_nonzero(mealtablemodule.environmentFriendlyMask(meal_table.impacts, strict))
+  duration_scan = time.time() - start
+  print('per query: {0:.3f} ms with the index, {1:.3f} ms with a scan'.format(duration_index, duration_scan)) # 1000 queries: seconds = ms per query
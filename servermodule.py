@@ -0,0 +1,521 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import sys
+import math
+import json
+import time
+import argparse
+import threading
+import collections
+import http.server
+import numpy as np
+
+
+# Local modules
+
+import usermodule
+import nutritionDBmodule
+import envDBmodule
+import enumcachemodule
+import mealtablemodule
+import rangeindexmodule
+import topkmodule
+
+
+
+#############
+# Constants #
+#############
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8321
+
+# Default and maximal number of meals returned by a request
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 10000
+
+# Maximal size (in bytes) of the body of a request
+MAX_BODY_SIZE = 1 << 20
+
+
+
+#############################
+# Class MealPlanningService #
+#############################
+
+class MealPlanningService(object):
+
+  def __init__(self, NutrDB, EnvDB, MaxEntries=16, KcalBucket=1.0, Directory=None, Dtype=np.float64):
+    """
+    Parameters passed in data mode: NutrDB, EnvDB, MaxEntries, KcalBucket, Directory, Dtype
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - NutrDB is a complete and consistent NutritionDatabase, EnvDB an EnvironmentalDatabase consistent with it
+      - MaxEntries is the number of tables kept in memory, KcalBucket the rounding of the targets and Directory
+        the optional disk tier, as in EnumerationCache
+    Postconditions:
+      - self holds the warm state shared by all the requests: the databases, and for each (rounded target, extra
+        quantities) the table of the valid meals with their impacts and its ImpactRangeIndex
+      - the tables are computed once, then only read: their columns are made read-only, so that
+        concurrent requests can use them without any copy or lock
+    Result: self
+    """
+    self.nutrDB = NutrDB
+    self.envDB = EnvDB
+    self.max_entries = MaxEntries
+    self.cache = enumcachemodule.EnumerationCache(NutrDB, EnvDB, MaxEntries=1, Directory=Directory, Rounding=KcalBucket, UseKcalIndex=True, Dtype=Dtype)
+    self.entries = collections.OrderedDict() # (table, range index), from the least to the most recently used
+    self.lock = threading.Lock() # protects self.entries and the counters
+    self.compute_lock = threading.Lock()
+    self.start_time = time.time()
+    self.nb_requests = 0
+
+
+  def getEntry(self, MealKcalTarget, ExtraQtyDict):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - MealKcalTarget is a positive float, ExtraQtyDict a dictionary containing every extra of self.nutrDB
+    Postconditions:
+      - the table of these arguments is computed if needed; the least recently used tables are evicted
+    Result: a tuple (table, range_index) of a read-only MealTable and its ImpactRangeIndex
+    """
+    key = self.cache.makeKey(MealKcalTarget, ExtraQtyDict)
+    with self.lock:
+      if key in self.entries:
+        self.entries.move_to_end(key)
+        return self.entries[key]
+    # the misses are computed one at a time (the enumeration cache is not thread-safe), without blocking the hits
+    with self.compute_lock:
+      with self.lock:
+        if key in self.entries:
+          return self.entries[key]
+      table = self.cache.getMealTable(MealKcalTarget, ExtraQtyDict)
+      for column in [table.food_indices, table.quantities, table.impacts, table.ratings]:
+        column.setflags(write=False)
+      entry = (table, rangeindexmodule.ImpactRangeIndex(table))
+      with self.lock:
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+          self.entries.popitem(last=False)
+      return entry
+
+
+  def getStatus(self, Request):
+    with self.lock:
+      return {'uptime': time.time() - self.start_time, 'nb_requests': self.nb_requests, 'nb_tables': len(self.entries),
+              'cache': self.cache.getStatistics()}
+
+
+  def computeEnergyRequirements(self, Request):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Request is a dictionary containing either the physiological parameters of a user (gender, age,
+        body_weight, height, physical_activity_level) or a list 'profiles' of such dictionaries
+    Postconditions:
+      - a ValueError exception is thrown if a parameter is missing
+    Result: a dictionary containing, for each profile, its BMR, daily energy, breakfast and main meal targets
+    (None if invalid) and the list of its invalid parameters
+    """
+    profiles = Request['profiles'] if 'profiles' in Request else [Request]
+    columns = []
+    for parameter in ['gender', 'age', 'body_weight', 'height', 'physical_activity_level']:
+      if any(parameter not in profile for profile in profiles):
+        raise ValueError('Missing ' + parameter + '.')
+      values = [profile[parameter] for profile in profiles]
+      if parameter in ['age', 'body_weight', 'height']:
+        values = [value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan for value in values]
+      columns.append(values)
+    (bmr, daily_energy, breakfast_kcal, main_meal_kcal, errors) = usermodule.computeCohortEnergyRequirements(*columns)
+    results = []
+    for i in range(len(profiles)):
+      results.append({'bmr': _toJSONFloat(bmr[i]), 'daily_energy': _toJSONFloat(daily_energy[i]),
+                      'breakfast_kcal': _toJSONFloat(breakfast_kcal[i]), 'main_meal_kcal': _toJSONFloat(main_meal_kcal[i]),
+                      'errors': [field for field in ['gender', 'age', 'body_weight', 'height', 'physical_activity_level'] if errors[field][i]]})
+    return {'profiles': results} if 'profiles' in Request else results[0]
+
+
+  def getMeals(self, Request):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Request is a dictionary containing 'meal_kcal' (a positive float) and 'extra_quantities' (a dictionary of
+        the serving sizes of all the extras), and optionally 'limit' and 'offset' (the page of meals returned)
+    Postconditions: see _parseTarget
+    Result: a dictionary containing the number of valid meals of the target and the meals of the page
+    """
+    (table, range_index) = self.getEntry(*self._parseTarget(Request))
+    return self._describeRows(table, np.arange(len(table)), Request)
+
+
+  def filterMeals(self, Request):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Request contains the keys of getMeals, and optionally 'env_thresholds' (see _parseThresholds) and
+        'ratings' (a dictionary of the ratings of the foods, to remove the meals containing a 0-rated food)
+    Postconditions: [none]
+    Result: a dictionary containing the number of valid meals below the thresholds and without vetoed foods,
+    their total impact, and the meals of the page
+    """
+    (table, range_index) = self.getEntry(*self._parseTarget(Request))
+    view = self._filterView(table, range_index, Request)
+    result = self._describeRows(table, view.rows, Request)
+    result['total_impact'] = view.total_impact.toList()
+    return result
+
+
+  def getTopMeals(self, Request):
+    """
+    Parameters passed in data mode: [all]
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Request contains the keys of filterMeals, and 'k' (the number of meals), 'weights' (5 non-negative floats)
+        and optionally 'rating_weight' (which requires 'ratings'), as MealSet.getTopMeals
+    Postconditions:
+      - the ratings are computed for this request only: the shared table is not modified
+    Result: a dictionary containing the k best meals (the lowest scores) among the filtered meals and their scores
+    """
+    (table, range_index) = self.getEntry(*self._parseTarget(Request))
+    view = self._filterView(table, range_index, Request)
+    weights = Request.get('weights', [1, 1, 1, 1, 1])
+    if not isinstance(weights, list) or len(weights) != 5:
+      raise ValueError('The weights should be a list of 5 floats.')
+    weights = [_parseNumber(weight, 'weights') for weight in weights]
+    if any(weight < 0 for weight in weights):
+      raise ValueError('weights should be non-negative.')
+    rating_weight = _parseNumber(Request.get('rating_weight', 0.0), 'rating_weight')
+    k = _parseNumber(Request.get('k', 10), 'k', Integer=True)
+    if k < 0 or k > MAX_LIMIT:
+      raise ValueError('k should be between 0 and ' + str(MAX_LIMIT) + '.')
+    ratings = None
+    if rating_weight != 0:
+      if 'ratings' not in Request:
+        raise ValueError('A rating weight requires ratings.')
+      ratings = mealtablemodule.computeRatingArray(table.food_indices[view.rows], mealtablemodule.foodRatingVector(table.foods, Request['ratings']))
+    impacts = table.impacts[view.rows]
+    scores = topkmodule.computeScores(impacts, weights, topkmodule.computeImpactScales(impacts), ratings, rating_weight)
+    best = topkmodule.selectTopK(scores, k, view.rows)
+    result = self._describeRows(table, view.rows[best], {'limit': len(best)})
+    result['count'] = len(view)
+    result['scores'] = scores[best].tolist()
+    return result
+
+
+  def _parseTarget(self, Request):
+    # (meal target, extra quantities) of a request, or a ValueError if they are missing or not valid
+    if 'meal_kcal' not in Request:
+      raise ValueError('meal_kcal should be a positive number.')
+    meal_kcal = _parseNumber(Request['meal_kcal'], 'meal_kcal')
+    if not meal_kcal > 0:
+      raise ValueError('meal_kcal should be a positive number.')
+    extra_qty_dict = Request.get('extra_quantities', {})
+    if not isinstance(extra_qty_dict, dict):
+      raise ValueError('extra_quantities should be a dictionary.')
+    missing_extras = [extra for extra in self.nutrDB.extras if extra not in extra_qty_dict]
+    if len(missing_extras) > 0:
+      raise ValueError('Missing extra quantities: ' + ', '.join(missing_extras) + '.')
+    quantities = {extra: _parseNumber(extra_qty_dict[extra], 'The quantity of ' + extra) for extra in self.nutrDB.extras}
+    negative_extras = [extra for extra in self.nutrDB.extras if quantities[extra] < 0]
+    if len(negative_extras) > 0:
+      raise ValueError('Negative extra quantities: ' + ', '.join(negative_extras) + '.')
+    return (meal_kcal, quantities)
+
+
+  def _filterView(self, Table, RangeIndex, Request):
+    # MealView of the meals of Table below the thresholds and without the vetoed foods of the request
+    if Request.get('env_thresholds') is not None:
+      view = RangeIndex.filterBasedOnEnvironmentalImpact(_parseThresholds(Request['env_thresholds']))
+    else:
+      view = Table.asView()
+    if Request.get('ratings') is not None:
+      if not isinstance(Request['ratings'], dict):
+        raise ValueError('ratings should be a dictionary.')
+      view = view.filterBasedOnUserVeto(Request['ratings'])
+    return view
+
+
+  def _describeRows(self, Table, Rows, Request):
+    # page of the meals of Rows described as JSON values
+    limit = _parseNumber(Request.get('limit', DEFAULT_LIMIT), 'limit', Integer=True)
+    offset = _parseNumber(Request.get('offset', 0), 'offset', Integer=True)
+    if limit < 0 or limit > MAX_LIMIT or offset < 0:
+      raise ValueError('limit should be between 0 and ' + str(MAX_LIMIT) + ' and offset should be non-negative.')
+    page = Rows[offset:offset+limit]
+    meals = []
+    for (food_indices, quantities, impacts) in zip(Table.food_indices[page].tolist(), Table.quantities[page].tolist(), Table.impacts[page].tolist()):
+      meals.append({'foods': [Table.foods[f] for f in food_indices], 'quantities': quantities, 'impact': impacts})
+    return {'count': len(Rows), 'offset': offset, 'meals': meals}
+
+
+
+############################
+# Class MealRequestHandler #
+############################
+
+class MealRequestHandler(http.server.BaseHTTPRequestHandler):
+
+  # POST endpoints, associated to the methods of MealPlanningService taking the JSON body of the request
+  ROUTES = {'/energy': 'computeEnergyRequirements', '/meals': 'getMeals', '/filter': 'filterMeals', '/topk': 'getTopMeals'}
+
+  protocol_version = 'HTTP/1.1' # keep-alive connections
+
+  def do_GET(self):
+    if self.path == '/status':
+      self._reply(200, self.server.service.getStatus({}))
+    else:
+      self._reply(404, {'error': 'Unknown endpoint ' + self.path + '.'})
+
+
+  def do_POST(self):
+    if self.path not in self.ROUTES:
+      self._reply(404, {'error': 'Unknown endpoint ' + self.path + '.'})
+      return
+    try:
+      length = int(self.headers.get('Content-Length', 0))
+    except ValueError:
+      length = -1
+    if length < 0:
+      self.close_connection = True # the body cannot be delimited
+      self._reply(400, {'error': 'Invalid Content-Length.'})
+      return
+    if length > MAX_BODY_SIZE:
+      self.close_connection = True
+      self._reply(413, {'error': 'Request too large.'})
+      return
+    try:
+      request = json.loads(self.rfile.read(length) or b'{}')
+      if not isinstance(request, dict):
+        raise ValueError('The body of the request should be a JSON object.')
+      result = getattr(self.server.service, self.ROUTES[self.path])(request)
+    except (ValueError, KeyError, TypeError) as e:
+      self._reply(400, {'error': str(e).strip("'")})
+      return
+    except Exception as e: # the client always gets an answer, and the server keeps serving
+      http.server.BaseHTTPRequestHandler.log_message(self, 'Error on %s: %r', self.path, e) # logged even if not verbose
+      self._reply(500, {'error': 'Internal error.'})
+      return
+    with self.server.service.lock:
+      self.server.service.nb_requests += 1
+    self._reply(200, result)
+
+
+  def _reply(self, Status, Result):
+    body = json.dumps(Result).encode('utf-8')
+    self.send_response(Status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  def log_message(self, Format, *Args):
+    if self.server.verbose:
+      http.server.BaseHTTPRequestHandler.log_message(self, Format, *Args)
+
+
+
+########################
+# Function definitions #
+########################
+
+def _toJSONFloat(Value):
+  # float of Value, None if it is NaN (JSON has no NaN)
+  return None if math.isnan(Value) else float(Value)
+
+
+def _parseNumber(Value, Name, Integer=False):
+  # Value as a float (an int if Integer), or a ValueError if it is not a finite number (booleans are not numbers)
+  if isinstance(Value, bool) or not isinstance(Value, (int, float)):
+    raise ValueError(Name + ' should be a number.')
+  try:
+    number = float(Value)
+  except OverflowError:
+    number = math.inf
+  if not math.isfinite(number):
+    raise ValueError(Name + ' should be a finite number.')
+  return int(Value) if Integer else number
+
+
+def _parseThresholds(Values):
+  # EnvironmentalImpact of a list of 5 floats or of a dictionary of the 5 indicators
+  names = ['land_use', 'GHG_emissions', 'acidifying_emissions', 'eutrophying_emissions', 'water_use']
+  if isinstance(Values, dict):
+    Values = [Values[name] for name in names]
+  if len(Values) != len(names):
+    raise ValueError('env_thresholds should be a list of 5 floats.')
+  return envDBmodule.EnvironmentalImpact([float(value) for value in Values])
+
+
+def makeServer(Service, Host=DEFAULT_HOST, Port=DEFAULT_PORT, Verbose=False):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Service is an instance of MealPlanningService
+  Postconditions:
+    - the server is bound to (Host, Port) (Port 0 picks a free port, see server.server_address) but does not
+      serve requests until its serve_forever method is called; each request is handled in its own thread
+  Result: a ThreadingHTTPServer answering the JSON requests of MealRequestHandler with Service
+  """
+  server = http.server.ThreadingHTTPServer((Host, Port), MealRequestHandler)
+  server.daemon_threads = True
+  server.service = Service
+  server.verbose = Verbose
+  return server
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser(description='Local HTTP/JSON meal planning service: the databases and the tables of valid '
+                                               'meals are loaded once and shared by all the requests. Endpoints: GET /status, '
+                                               'POST /energy, /meals, /filter and /topk.')
+  parser.add_argument('--host', default=DEFAULT_HOST)
+  parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+  parser.add_argument('--max-tables', type=int, default=16, help='number of tables of valid meals kept in memory')
+  parser.add_argument('--kcal-bucket', type=float, default=1.0, help='rounding of the meal targets (kcal)')
+  parser.add_argument('--preload', type=float, nargs='*', default=[], help='meal targets computed at start-up (with extras of 0.01)')
+  parser.add_argument('--verbose', action='store_true', help='log every request')
+  parser.add_argument('--test', action='store_true', help='run the unit tests of this module instead of serving')
+  arguments = parser.parse_args()
+
+  if arguments.test:
+
+    import http.client
+    import concurrent.futures
+
+    nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+    envDB = envDBmodule.EnvironmentalDatabase('poore2018/DataS2.xlsx')
+    extra_qty_dict = {extra: 0.010 for extra in nutrDB.extras}
+    my_ratings = {food: 3 for food in nutrDB.getAllFoods()}
+    my_ratings['Coffee'] = 0
+    my_thresholds = [2.0, 1.5, 15.0, 10.0, 3000]
+    service = MealPlanningService(nutrDB, envDB, MaxEntries=4, KcalBucket=None)
+    server = makeServer(service, Port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def post(Path, Body, Method='POST'):
+      # (status, JSON answer) of a request sent on a new connection; Body is a dictionary or raw bytes
+      connection = http.client.HTTPConnection(*server.server_address[:2], timeout=60)
+      body = Body if isinstance(Body, bytes) else json.dumps(Body).encode('utf-8')
+      connection.request(Method, Path, body=body if Method == 'POST' else None)
+      response = connection.getresponse()
+      result = (response.status, json.loads(response.read()))
+      connection.close()
+      return result
+
+    request = {'meal_kcal': 720, 'extra_quantities': extra_qty_dict}
+
+    print('Unit test of the endpoints of MealRequestHandler:')
+    (status, result) = post('/status', None, 'GET')
+    print(status == 200 and result['nb_requests'] == 0 and result['nb_tables'] == 0)
+    table = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict, AsTable=True)
+    table.computeAllEnvironmentalImpacts(envDB)
+    served_table = service.getEntry(720, extra_qty_dict)[0] # the impacts of the KcalTargetIndex, equal up to rounding
+    print(np.allclose(served_table.impacts, table.impacts, rtol=1e-9) and np.array_equal(served_table.food_indices, table.food_indices))
+    (status, result) = post('/energy', {'gender': 'F', 'age': 30, 'body_weight': 60, 'height': 165, 'physical_activity_level': 'light'})
+    user = usermodule.User('F', 60, 165, 30, 'light')
+    print(status == 200 and result['errors'] == [] and abs(result['daily_energy'] - user.dailyEnergyRequirement()) < 1e-6)
+    (status, result) = post('/energy', {'profiles': [{'gender': 'F', 'age': 30, 'body_weight': 60, 'height': 165, 'physical_activity_level': 'light'},
+                                                     {'gender': 'F', 'age': True, 'body_weight': 60, 'height': 165, 'physical_activity_level': 'light'}]})
+    print(status == 200 and result['profiles'][0]['errors'] == [] and result['profiles'][1]['errors'] == ['age'])
+    (status, result) = post('/meals', dict(request, limit=5, offset=2))
+    print(status == 200 and result['count'] == len(table) and result['offset'] == 2 and len(result['meals']) == 5)
+    print(result['meals'][0]['foods'] == table[2].getFoods() and np.allclose(result['meals'][0]['quantities'], table.quantities[2], rtol=1e-9, atol=1e-12))
+    (status, result) = post('/filter', dict(request, env_thresholds=my_thresholds, ratings=my_ratings, limit=50, offset=100))
+    expected = served_table.copy().filterBasedOnEnvironmentalImpact(envDBmodule.EnvironmentalImpact(my_thresholds)).filterBasedOnUserVeto(my_ratings)
+    print(status == 200 and result['count'] == len(expected) and [meal['foods'] for meal in result['meals']] == [expected[i].getFoods() for i in range(100, 150)])
+    (status, result) = post('/topk', dict(request, k=5, weights=[1, 2, 0, 0, 1], ratings=my_ratings, rating_weight=0.5))
+    rated_table = served_table.copy()
+    rated_table.computeAllRatings(my_ratings)
+    expected_top = rated_table.filterBasedOnUserVeto(my_ratings).getTopMeals(5, [1, 2, 0, 0, 1], RatingWeight=0.5)
+    print(status == 200 and [meal['foods'] for meal in result['meals']] == [meal.getFoods() for meal in expected_top])
+    print(post('/unknown', request)[0] == 404 and post('/unknown', None, 'GET')[0] == 404)
+    print(post('/status', None, 'GET')[1]['nb_requests'] == 5)
+    print('')
+
+    print('Unit test of the error paths of MealRequestHandler:')
+    print(post('/meals', b'{"meal_kcal": Infinity, "extra_quantities": ' + json.dumps(extra_qty_dict).encode('utf-8') + b'}')[0] == 400)
+    print(post('/meals', dict(request, meal_kcal=True))[0] == 400 and post('/meals', dict(request, meal_kcal=-720))[0] == 400)
+    print(post('/meals', dict(request, meal_kcal='720'))[0] == 400 and post('/meals', {'extra_quantities': extra_qty_dict})[0] == 400)
+    print(post('/meals', b'{"meal_kcal": 720, "limit": 1e400, "extra_quantities": ' + json.dumps(extra_qty_dict).encode('utf-8') + b'}')[0] == 400)
+    print(post('/meals', dict(request, limit=10**400))[0] == 400 and post('/meals', dict(request, offset=float('nan')))[0] == 400)
+    print(post('/meals', dict(request, limit=-1))[0] == 400 and post('/meals', dict(request, offset=True))[0] == 400)
+    print(post('/topk', dict(request, k=float('inf')))[0] == 400 and post('/topk', dict(request, k=-1))[0] == 400)
+    print(post('/topk', dict(request, weights=[1, 1, 1, 1, -1]))[0] == 400 and post('/topk', dict(request, rating_weight=1))[0] == 400)
+    print(post('/meals', dict(request, extra_quantities={extra: -5 for extra in nutrDB.extras}))[0] == 400)
+    print(post('/meals', dict(request, extra_quantities={extra: 'a spoon' for extra in nutrDB.extras}))[0] == 400)
+    print(post('/meals', {'meal_kcal': 720})[0] == 400 and post('/meals', b'[720]')[0] == 400 and post('/meals', b'{')[0] == 400)
+    print(post('/filter', dict(request, env_thresholds=[1, 2]))[0] == 400 and post('/filter', dict(request, ratings=[0]))[0] == 400)
+    print(post('/filter', dict(request, ratings={'Coffee': 0}))[0] == 400) # the other foods are not rated
+    print(post('/energy', {'gender': 'F'})[0] == 400)
+    service.getMeals = lambda Request: 1/0 # an unexpected exception
+    (status, result) = post('/meals', request)
+    print(status == 500 and result == {'error': 'Internal error.'})
+    del service.getMeals
+    print(post('/meals', request)[0] == 200) # the server still answers
+    print('')
+
+    print('Unit test of the read-only shared tables under concurrent requests:')
+    targets = [720, 760, 800]
+    snapshots = [[column.copy() for column in [shared.food_indices, shared.quantities, shared.impacts, shared.ratings]]
+                 for (shared, index) in [service.getEntry(target, extra_qty_dict) for target in targets]]
+    requests = [('/topk' if i % 4 < 2 else '/filter', dict(request, meal_kcal=targets[i % 3], env_thresholds=my_thresholds if i % 2 else None,
+                 ratings=my_ratings, k=10, weights=[1, 1, 1, 1, 1], rating_weight=0.5*(i % 2))) for i in range(48)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+      answers = list(executor.map(lambda PathAndBody: post(*PathAndBody), requests))
+    print(all(status == 200 for (status, result) in answers))
+    print(all(answers[i][1] == answers[i + 12][1] for i in range(len(answers) - 12))) # same request, same answer
+    all_same = True
+    for (target, snapshot) in zip(targets, snapshots):
+      (shared, index) = service.getEntry(target, extra_qty_dict)
+      for (column, copy) in zip([shared.food_indices, shared.quantities, shared.impacts, shared.ratings], snapshot):
+        if column.flags.writeable or not np.array_equal(column, copy):
+          all_same = False
+    print(all_same)
+    try:
+      served_table.ratings[0] = 1.0
+      print(False)
+    except ValueError:
+      print(True)
+    server.shutdown()
+    server.server_close()
+    sys.exit(0)
+
+  print('Importing nutritional and environmental data... ', end='')
+  nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+  envDB = envDBmodule.EnvironmentalDatabase('poore2018/DataS2.xlsx')
+  assert(nutrDB.isComplete() and nutrDB.isConsistent() and envDB.isConsistentWith(nutrDB))
+  print('done')
+
+  service = MealPlanningService(nutrDB, envDB, arguments.max_tables, arguments.kcal_bucket)
+  for target in arguments.preload:
+    service.getEntry(target, {extra: 0.010 for extra in nutrDB.extras})
+  server = makeServer(service, arguments.host, arguments.port, arguments.verbose)
+  print('Serving on http://{0}:{1}'.format(*server.server_address))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  server.server_close()
@@ -0,0 +1,262 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# Local modules
+
+import mealtablemodule
+
+
+#############
+# Constants #
+#############
+
+# Offsets of the columns in the shared block are multiples of ALIGNMENT bytes (one cache line)
+ALIGNMENT = 64
+
+# Columns published in the shared block (the ratings depend on the user and stay private to each process)
+SHARED_COLUMNS = ['food_indices', 'quantities', 'impacts']
+
+
+##########################
+# Class SharedMealHandle #
+##########################
+
+class SharedMealHandle(object):
+
+  def __init__(self, Name, Foods, NbMeals, Dtype, IndexDtype, Offsets):
+    """
+    Parameters passed in data mode: Name, Foods, NbMeals, Dtype, IndexDtype, Offsets
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - Name is the name of a shared memory block created by SharedMealTable
+      - Offsets is a dictionary giving the offset in bytes of each column of SHARED_COLUMNS in the block
+    Postconditions:
+      - self only holds the description of the block (a few hundred bytes), so that it is cheap to pickle
+        and send to worker processes, which give it to SharedMealTable to attach to the block
+    Result: self
+    """
+    self.name = Name
+    self.foods = list(Foods)
+    self.nb_meals = NbMeals
+    self.dtype = np.dtype(Dtype).str
+    self.index_dtype = np.dtype(IndexDtype).str
+    self.offsets = dict(Offsets)
+
+
+  def getShapes(self):
+    """
+    Parameters passed in data mode: self
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: [none]
+    Preconditions: [none]
+    Postconditions: [none]
+    Result: a dictionary giving the (shape, dtype) of each column of SHARED_COLUMNS
+    """
+    return {'food_indices': ((self.nb_meals, 6), np.dtype(self.index_dtype)),
+            'quantities': ((self.nb_meals, 6), np.dtype(self.dtype)),
+            'impacts': ((self.nb_meals, 5), np.dtype(self.dtype))}
+
+
+
+#########################
+# Class SharedMealTable #
+#########################
+
+class SharedMealTable(object):
+
+  def __init__(self, Source):
+    """
+    Parameters passed in data mode: Source
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - Source is either a MealTable (in the owner process) or a SharedMealHandle (in a worker process)
+    Postconditions:
+      - if Source is a MealTable, its food indices, quantities and impacts are copied once into a new shared
+        memory block; self.is_owner is True and self.handle describes the block. The impacts must therefore be
+        computed before the table is published.
+      - if Source is a SharedMealHandle, self attaches to the existing block without copying it
+      - in both cases, self.table is a MealTable whose food indices, quantities and impacts are read-only views
+        of the block; its ratings are a private array of the process, so that per-user filters can run in
+        parallel without interfering
+      - the owner must call unlink() (or use self as a context manager) once the workers are done;
+        each process calls close() when it no longer uses self.table
+    Result: self
+    """
+    if isinstance(Source, mealtablemodule.MealTable):
+      self.is_owner = True
+      offsets = {}
+      size = 0
+      for column in SHARED_COLUMNS:
+        offsets[column] = size
+        size += -(-getattr(Source, column).nbytes // ALIGNMENT)*ALIGNMENT
+      self.shared_memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+      self.handle = SharedMealHandle(self.shared_memory.name, Source.foods, len(Source), Source.dtype, Source.food_indices.dtype, offsets)
+      for (column, array) in self._mapColumns().items():
+        array[...] = getattr(Source, column)
+    else:
+      self.is_owner = False
+      self.handle = Source
+      self.shared_memory = _attachUntracked(Source.name)
+    columns = self._mapColumns()
+    for array in columns.values():
+      array.setflags(write=False)
+    self.table = mealtablemodule.MealTable(self.handle.foods, columns['food_indices'], columns['quantities'], columns['impacts'],
+      Dtype=self.handle.dtype)
+
+
+  def _mapColumns(self):
+    columns = {}
+    for (column, (shape, dtype)) in self.handle.getShapes().items():
+      columns[column] = np.ndarray(shape, dtype=dtype, buffer=self.shared_memory.buf, offset=self.handle.offsets[column])
+    return columns
+
+
+  def __len__(self):
+    return self.handle.nb_meals
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, ExcType, ExcValue, Traceback):
+    self.close()
+    if self.is_owner:
+      self.unlink()
+    return False
+
+
+  def close(self):
+    """
+    Parameters passed in data mode: [none]
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - the columns of self.table (and the tables or views built on them) are no longer referenced elsewhere
+    Postconditions:
+      - the block is unmapped from this process; self.table is set to None
+    Result: [none]
+    """
+    if self.shared_memory is None:
+      return
+    self.table = None
+    self.shared_memory.close()
+
+
+  def unlink(self):
+    """
+    Parameters passed in data mode: [none]
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - self.is_owner is True
+    Postconditions:
+      - the block is destroyed once every process has closed it; no new process can attach to it
+    Result: [none]
+    """
+    if not self.is_owner:
+      raise ValueError('Only the owner of a SharedMealTable can unlink it.')
+    if self.shared_memory is None:
+      return
+    if sys.version_info < (3, 13):
+      # An attachment sharing the resource tracker of the owner (same process or forked worker) may have withdrawn
+      # the registration of the block; registering it again is a no-op otherwise
+      resource_tracker.register(self.shared_memory._name, 'shared_memory')
+    self.shared_memory.unlink()
+    self.shared_memory = None
+
+
+
+########################
+# Function definitions #
+########################
+
+def _attachUntracked(Name):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Name is the name of an existing shared memory block
+  Postconditions:
+    - the block is not registered in the resource tracker of this process: only its owner, which registered it
+      when creating it, unlinks it (and the tracker of the owner if the owner dies)
+  Result: a SharedMemory instance attached to the block
+  """
+  if sys.version_info >= (3, 13):
+    return shared_memory.SharedMemory(name=Name, track=False)
+  # Fallback for Python < 3.13, which has no track parameter: attaching always registers the block in the resource
+  # tracker, which would unlink it when this process exits. The registration of this block only is withdrawn (the
+  # owner registers it again before unlinking it, in case the tracker is shared).
+  block = shared_memory.SharedMemory(name=Name)
+  resource_tracker.unregister(block._name, 'shared_memory')
+  return block
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  import concurrent.futures
+  import pickle
+  import envDBmodule
+  import nutritionDBmodule
+
+  def countEnvironmentFriendlyMeals(Handle, Thresholds, FoodRatings):
+    shared = SharedMealTable(Handle)
+    view = shared.table.filterBasedOnEnvironmentalImpact(Thresholds).filterBasedOnUserVeto(FoodRatings)
+    result = (len(view), np.shares_memory(view.table.impacts, shared.table.impacts))
+    view = None
+    shared.close()
+    return result
+
+  nutrDB = nutritionDBmodule.NutritionDatabase('poore2018/TableS1_augmented_with_FAO_data.xlsx')
+  envDB = envDBmodule.EnvironmentalDatabase('poore2018/DataS2.xlsx')
+  extra_qty_dict = {food: 0.010 for food in nutrDB.extras}
+  meal_table = nutrDB.enumerateAllPossibleMealsWithQuantities(720, extra_qty_dict, AsTable=True)
+  meal_table.computeAllEnvironmentalImpacts(envDB)
+  my_thresholds = envDBmodule.EnvironmentalImpact([2.0, 1.5, 15.0, 10.0, 3000])
+
+  print('Unit test of SharedMealTable publication:')
+  with SharedMealTable(meal_table) as shared:
+    print(len(pickle.dumps(shared.handle)) < 4096) # only the description of the block is sent to the workers
+    print(np.array_equal(shared.table.food_indices, meal_table.food_indices) and np.array_equal(shared.table.impacts, meal_table.impacts))
+    print(shared.table[10].getFoods() == meal_table[10].getFoods())
+    print('')
+
+    print('Unit test of SharedMealTable attachment by worker processes:')
+    users = [{food: 3 for food in nutrDB.getAllFoods()} for i in range(4)]
+    for (user, vetoed) in zip(users, ['Coffee', 'Eggs', 'Rice', 'Apples']):
+      user[vetoed] = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+      results = list(executor.map(countEnvironmentFriendlyMeals, [shared.handle]*len(users), [my_thresholds]*len(users), users))
+    expected = [len(meal_table.filterBasedOnEnvironmentalImpact(my_thresholds).filterBasedOnUserVeto(user)) for user in users]
+    print([count for (count, zero_copy) in results] == expected)
+    print(all(zero_copy for (count, zero_copy) in results))
+    attached = SharedMealTable(shared.handle)
+    attached.close()
+    print(np.array_equal(shared.table.impacts, meal_table.impacts)) # closing an attachment does not destroy the block
+    name = shared.handle.name
+  print('')
+
+  print('Unit test of SharedMealTable cleanup:')
+  try:
+    shared_memory.SharedMemory(name=name)
+  except FileNotFoundError:
+    print(True) # the owner has destroyed the block
+  else:
+    print(False)
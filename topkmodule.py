@@ -0,0 +1,162 @@
+###########
+# Imports #
+###########
+
+# External librairies
+
+import numpy as np
+
+
+#############
+# Constants #
+#############
+
+# Largest possible rating of a meal (6 foods rated between 0 and 5), used to normalize the ratings
+MAX_MEAL_RATING = 30.0
+
+
+#########################
+# Class TopKAccumulator #
+#########################
+
+class TopKAccumulator(object):
+
+  def __init__(self, K):
+    """
+    Parameters passed in data mode: K
+    Parameters passed in data/result mode: [none]
+    Parameters passed in result mode: self
+    Preconditions:
+      - K is a non-negative integer
+    Postconditions:
+      - self keeps the K best (lowest) scores added so far and their rows, so that the top-k of data that does
+        not fit in memory can be computed in a single pass over its chunks, in O(chunk size + K) memory
+    Result: self
+    """
+    self.k = K
+    self.rows = np.zeros(0, dtype=np.intp)
+    self.scores = np.zeros(0)
+
+
+  def add(self, Rows, Scores):
+    """
+    Parameters passed in data mode: Rows, Scores
+    Parameters passed in data/result mode: self
+    Parameters passed in result mode: [none]
+    Preconditions:
+      - Rows is an int array of row indices (distinct from those already added), Scores the float array of their scores
+    Postconditions:
+      - self.rows and self.scores hold the K best rows among those added so far, sorted as by selectTopK
+    Result: [none]
+    """
+    rows = np.concatenate([self.rows, np.asarray(Rows, dtype=np.intp)])
+    scores = np.concatenate([self.scores, np.asarray(Scores, dtype=np.float64)])
+    best = selectTopK(scores, self.k, rows)
+    self.rows = rows[best]
+    self.scores = scores[best]
+
+
+
+########################
+# Function definitions #
+########################
+
+def computeImpactScales(Impacts):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Impacts is an (N,5) float array
+  Postconditions: [none]
+  Result: a (5,) float array, the mean of each indicator (1 where the mean is 0 or undefined), by which
+  the impacts are divided so that the five indicators have comparable magnitudes
+  """
+  impacts = np.asarray(Impacts, dtype=np.float64).reshape(-1, 5)
+  finite = np.isfinite(impacts)
+  counts = np.count_nonzero(finite, axis=0)
+  means = np.sum(np.where(finite, impacts, 0), axis=0)/np.maximum(counts, 1)
+  return np.where((counts > 0) & (means > 0), means, 1.0)
+
+
+def computeScores(Impacts, Weights, Scales, Ratings=None, RatingWeight=0.0):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Impacts is an (N,5) float array, Weights and Scales are lists or arrays of 5 non-negative floats
+    - if RatingWeight is not 0, Ratings is the (N,) float array of the ratings of the meals (see computeAllRatings)
+  Postconditions: [none]
+  Result: the (N,) float array of the scores of the meals (the lower, the better):
+  sum over d of Weights[d]*Impacts[:,d]/Scales[d], minus RatingWeight*Ratings/MAX_MEAL_RATING
+  """
+  factors = np.asarray(Weights, dtype=np.float64)/np.asarray(Scales, dtype=np.float64)
+  scores = np.asarray(Impacts, dtype=np.float64).reshape(-1, 5) @ factors
+  if RatingWeight != 0:
+    scores -= RatingWeight*np.asarray(Ratings, dtype=np.float64)/MAX_MEAL_RATING
+  return scores
+
+
+def selectTopK(Scores, K, Rows=None):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Scores is an (N,) float array, K a non-negative integer
+    - if specified, Rows is an (N,) int array used to break the ties (default: the positions in Scores)
+  Postconditions:
+    - the K-th smallest score is found with a partial selection (np.partition, linear time), then only the
+      K selected positions are sorted: the cost is O(N + K log K) instead of O(N log N)
+  Result: the int array of the positions of the (at most) K lowest scores, sorted by increasing score and,
+  for equal scores, by increasing row; NaN scores are never selected
+  """
+  scores = np.asarray(Scores, dtype=np.float64)
+  rows = np.arange(len(scores)) if Rows is None else np.asarray(Rows)
+  valid = np.flatnonzero(~np.isnan(scores))
+  k = min(K, len(valid))
+  if k <= 0:
+    return np.zeros(0, dtype=np.intp)
+  kth_score = np.partition(scores[valid], k - 1)[k - 1]
+  better = np.flatnonzero(scores < kth_score)
+  ties = np.flatnonzero(scores == kth_score)
+  ties = ties[np.argsort(rows[ties], kind='stable')][:k - len(better)]
+  selected = np.concatenate([better, ties])
+  return selected[np.lexsort((rows[selected], scores[selected]))]
+
+
+
+################
+# Main program #
+################
+
+if __name__ == "__main__":
+
+  generator = np.random.default_rng(0)
+
+  print('Unit test of selectTopK:')
+  scores = generator.random(10000).round(3) # many ties
+  expected = np.lexsort((np.arange(len(scores)), scores))[:50]
+  print(np.array_equal(selectTopK(scores, 50), expected))
+  print(len(selectTopK(scores, 0)) == 0 and np.array_equal(selectTopK(scores[:5], 10), np.lexsort((np.arange(5), scores[:5]))))
+  with_nan = scores[:10].copy()
+  with_nan[[1, 4]] = np.nan
+  print(len(selectTopK(with_nan, 10)) == 8 and 1 not in selectTopK(with_nan, 10).tolist())
+  print('')
+
+  print('Unit test of TopKAccumulator:')
+  accumulator = TopKAccumulator(50)
+  for start in range(0, len(scores), 999):
+    accumulator.add(np.arange(start, min(start + 999, len(scores))), scores[start:start+999])
+  print(np.array_equal(accumulator.rows, expected) and np.array_equal(accumulator.scores, scores[expected]))
+  print('')
+
+  print('Unit test of computeScores:')
+  impacts = generator.random((100, 5))*[1, 10, 100, 1000, 10000]
+  scales = computeImpactScales(impacts)
+  scores = computeScores(impacts, [1, 0, 0, 0, 0], scales)
+  print(np.array_equal(selectTopK(scores, 5), np.argsort(impacts[:, 0])[:5]))
+  ratings = generator.integers(0, 31, 100).astype(float)
+  combined = computeScores(impacts, [0, 0, 0, 0, 0], scales, ratings, RatingWeight=1.0)
+  print(ratings[selectTopK(combined, 1)[0]] == ratings.max())
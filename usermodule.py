@@ -4,7 +4,9 @@
 
 # External librairies
 
+import csv
 import os.path
+import numpy as np
 
 
 # Local modules
@@ -14,6 +16,18 @@ import nutritionDBmodule
 import envDBmodule
 
 
+#############
+# Constants #
+#############
+
+# Physical activity level factors by which the basal metabolic rate is multiplied
+PHYSICAL_ACTIVITY_FACTORS = {'sedentary': 1.4, 'light': 1.6, 'moderate': 1.75, 'intense': 1.9, 'very intense': 2.1}
+
+# Shares of the daily energy requirement brought by the breakfast and by each of the lunch and dinner
+BREAKFAST_SHARE = 0.2
+MAIN_MEAL_SHARE = 0.4
+
+
 ##############
 # Class User #
 ##############
@@ -167,18 +181,9 @@ class User(object):
       - a ValueError exception is thrown if one of the parameter values is not valid
     Returned result: a float equal to the daily energy requirement in kcal, computed as PhysicalActivityLevel*BasalMetabolicRate.
     """
-    if self.physical_activity_level == 'sedentary':
-      PAL = 1.4
-    elif self.physical_activity_level == 'light':
-      PAL = 1.6
-    elif self.physical_activity_level == 'moderate':
-      PAL = 1.75
-    elif self.physical_activity_level == 'intense':
-      PAL = 1.9
-    elif self.physical_activity_level == 'very intense':
-      PAL = 2.1
-    else:
+    if self.physical_activity_level not in PHYSICAL_ACTIVITY_FACTORS:
       raise ValueError('Physical activity level should be one of "sedentary", "light", "moderate", "intense", "very intense"')
+    PAL = PHYSICAL_ACTIVITY_FACTORS[self.physical_activity_level]
     return PAL*self.basalMetabolicRate()
 
 
@@ -395,6 +400,90 @@ class User(object):
 
 
 
+########################
+# Function definitions #
+########################
+
+def computeCohortEnergyRequirements(Genders, Ages, BodyWeights, Heights, PhysicalActivityLevels):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Genders, Ages, BodyWeights, Heights and PhysicalActivityLevels are lists or arrays of the same length N,
+      describing N users as the parameters of User (the numbers may be NaN, e.g. for unreadable values)
+  Postconditions:
+    - the checks of User.basalMetabolicRate and User.dailyEnergyRequirement are applied to every row, but
+      instead of raising a ValueError at the first invalid user, they are reported as per-row error masks
+  Result: a tuple (bmr, daily_energy, breakfast_kcal, main_meal_kcal, errors), where
+    - bmr, daily_energy, breakfast_kcal and main_meal_kcal are (N,) float arrays containing the basal metabolic
+      rate, the daily energy requirement and the kcal targets of the breakfast (BREAKFAST_SHARE of the daily
+      energy) and of the lunch and dinner (MAIN_MEAL_SHARE), NaN for the invalid rows (an invalid activity
+      level does not prevent the computation of the basal metabolic rate, as in User)
+    - errors is a dictionary associating an (N,) boolean array to each of 'gender', 'age', 'body_weight',
+      'height' and 'physical_activity_level', True for the rows where this parameter is invalid;
+      errors['any'] is their union
+  """
+  genders = np.asarray(Genders).astype(str)
+  ages = np.asarray(Ages, dtype=np.float64)
+  body_weights = np.asarray(BodyWeights, dtype=np.float64)
+  heights = np.asarray(Heights, dtype=np.float64)
+  # the activity levels are mapped to their factors once per distinct level, and not once per row
+  (levels, level_indices) = np.unique(np.asarray(PhysicalActivityLevels).astype(str), return_inverse=True)
+  factors = np.array([PHYSICAL_ACTIVITY_FACTORS.get(level, np.nan) for level in levels.tolist()])[level_indices.reshape(-1)]
+  errors = {}
+  errors['gender'] = (genders != 'F') & (genders != 'M')
+  errors['age'] = ~(ages >= 18)
+  errors['body_weight'] = ~(body_weights >= 0)
+  errors['height'] = ~(heights >= 0)
+  errors['physical_activity_level'] = np.isnan(factors)
+  bmr_errors = errors['gender'] | errors['age'] | errors['body_weight'] | errors['height']
+  errors['any'] = bmr_errors | errors['physical_activity_level']
+  bmr = 10*body_weights + 6.25*heights - 5.0*ages + np.where(genders == 'F', -161.0, 5.0)
+  bmr[bmr_errors] = np.nan
+  daily_energy = factors*bmr
+  return (bmr, daily_energy, BREAKFAST_SHARE*daily_energy, MAIN_MEAL_SHARE*daily_energy, errors)
+
+
+def _toFloat(String):
+  # float value of String, NaN if it is not a number
+  try:
+    return float(String)
+  except ValueError:
+    return np.nan
+
+
+def readCohortFile(Filename):
+  """
+  Parameters passed in data mode: [all]
+  Parameters passed in data/result mode: [none]
+  Parameters passed in result mode: [none]
+  Preconditions:
+    - Filename is a CSV file with a header line containing the columns gender, age, body_weight, height and
+      physical_activity_level (other columns are ignored)
+  Postconditions:
+    - a ValueError exception is thrown if one of these columns is missing; the values that are not numbers
+      are read as NaN, so that the corresponding rows are reported by computeCohortEnergyRequirements
+  Result: a tuple (genders, ages, body_weights, heights, physical_activity_levels) of arrays, which can be
+  passed to computeCohortEnergyRequirements
+  """
+  columns = ['gender', 'age', 'body_weight', 'height', 'physical_activity_level']
+  with open(Filename, newline='') as f:
+    reader = csv.DictReader(f)
+    missing = [column for column in columns if column not in (reader.fieldnames or [])]
+    if len(missing) > 0:
+      raise ValueError('Missing columns in ' + Filename + ': ' + ', '.join(missing))
+    values = {column: [] for column in columns}
+    for line in reader:
+      for column in columns:
+        values[column].append((line[column] or '').strip())
+  numbers = []
+  for column in ['age', 'body_weight', 'height']:
+    numbers.append(np.array([_toFloat(value) for value in values[column]], dtype=np.float64))
+  return (np.array(values['gender'], dtype=str), numbers[0], numbers[1], numbers[2], np.array(values['physical_activity_level'], dtype=str))
+
+
+
 ################
 # Main program #
 ################
@@ -506,6 +595,70 @@ if __name__ == "__main__":
 
 
 
+  #################################################
+  # Unit tests of computeCohortEnergyRequirements #
+  #################################################
+
+  print('Unit tests of computeCohortEnergyRequirements:')
+
+  genders = ['F', 'M', 'X', 'F', 'M', 'F']
+  ages = [40, 40, 40, 17, 40, np.nan]
+  body_weights = [60, 60, 60, 60, 60, 60]
+  heights = [165, 165, 165, 165, 165, 165]
+  levels = ['light', 'very intense', 'light', 'light', 'lalala', 'light']
+  (bmr, daily_energy, breakfast_kcal, main_meal_kcal, errors) = computeCohortEnergyRequirements(genders, ages, body_weights, heights, levels)
+  print(myutils.approxEqual(bmr[0], 1270.25, releps, abseps) and myutils.approxEqual(daily_energy[0], 2032.4, releps, abseps))
+  print(myutils.approxEqual(daily_energy[1], User('M', 60, 165, 40, 'very intense').dailyEnergyRequirement(), releps, abseps))
+  print(myutils.approxEqual(breakfast_kcal[0], 0.2*2032.4, releps, abseps) and myutils.approxEqual(main_meal_kcal[0], 0.4*2032.4, releps, abseps))
+  print(errors['any'].tolist() == [False, False, True, True, True, True])
+  print(errors['gender'][2] and errors['age'][3] and errors['physical_activity_level'][4] and errors['age'][5] and not errors['age'][4])
+  print(np.isnan(daily_energy[2:]).all() and not np.isnan(bmr[4]))
+
+  # same results as the User methods on a large random cohort, in a single call
+  import tempfile
+  import time
+  generator = np.random.default_rng(0)
+  nb_users = 300000
+  genders = generator.choice(['F', 'M', '?'], nb_users, p=[0.5, 0.49, 0.01])
+  ages = generator.integers(10, 90, nb_users)
+  body_weights = generator.uniform(-1, 120, nb_users).round(1)
+  heights = generator.integers(140, 200, nb_users)
+  levels = generator.choice(list(PHYSICAL_ACTIVITY_FACTORS) + ['none'], nb_users)
+  start = time.time()
+  (bmr, daily_energy, breakfast_kcal, main_meal_kcal, errors) = computeCohortEnergyRequirements(genders, ages, body_weights, heights, levels)
+  duration = time.time() - start
+  all_same = True
+  for i in generator.integers(0, nb_users, 2000).tolist():
+    try:
+      der = User(str(genders[i]), float(body_weights[i]), int(heights[i]), int(ages[i]), str(levels[i])).dailyEnergyRequirement()
+    except ValueError:
+      if not errors['any'][i]:
+        all_same = False
+    else:
+      if errors['any'][i] or not myutils.approxEqual(der, daily_energy[i], releps, abseps):
+        all_same = False
+  print(all_same)
+  print('({0} users in {1:.3f} s)'.format(nb_users, duration))
+
+  print('Unit tests of readCohortFile:')
+
+  with tempfile.TemporaryDirectory() as directory:
+    filename = os.path.join(directory, 'cohort.csv')
+    with open(filename, 'w') as f:
+      f.write('id,gender,age,body_weight,height,physical_activity_level\n1,F,40,60,165,light\n2,M,n/a,70,180,moderate\n')
+    (genders, ages, body_weights, heights, levels) = readCohortFile(filename)
+    (bmr, daily_energy, breakfast_kcal, main_meal_kcal, errors) = computeCohortEnergyRequirements(genders, ages, body_weights, heights, levels)
+    print(myutils.approxEqual(daily_energy[0], 2032.4, releps, abseps) and errors['age'].tolist() == [False, True])
+    with open(filename, 'w') as f:
+      f.write('gender,age\nF,40\n')
+    try:
+      readCohortFile(filename)
+      print(False)
+    except ValueError:
+      print(True)
+
+
+
   ####################################
   # Unit tests of setExtraQuantities #
   ####################################